@@ -1,13 +1,28 @@
-from typing import TypedDict, Literal
-from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, SystemMessage
-from langchain_openai import ChatOpenAI
-from pydantic import BaseModel, Field
+from __future__ import annotations  # Annotations name langchain and langgraph types that are imported when used
+
+from typing import TYPE_CHECKING, TypedDict, Literal, Annotated, Optional
 from dotenv import load_dotenv
-from tools import *
-from tools import AVAILABLE_TOOLS
+from history import get_history_manager
+from result_store import get_result_store
+from plan_cache import get_plan_cache
+from routing import get_router, is_timeout
+from ratelimit import get_rate_limiter, estimate_tokens
+import asyncio
+import concurrent.futures
+import functools
+import importlib
+import operator
 import os
+import re
+import threading
+import time
+import uuid
+import weakref
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableConfig
+    from langgraph.graph import StateGraph
+    from schemas import TodoListSchema, ReflectionSchema, BatchReflectionSchema
 
 # Load environment variables from .env file
 load_dotenv()
@@ -23,39 +38,91 @@ Key Components:
 - Node functions: 
     - generate_todos() generates the to-do list based on the user query.
     - display_and_wait_for_approval() shows the todo list in the terminal and waits for user approval in confirm mode.
-    - select_next_task() selects the next pending task from the todo list.
-    - execute_task() executes the selected task using an LLM with access to defined tools.
-    - reflect() reflects on the task result and updates its status.
+    - select_next_task() selects every pending task whose dependencies are settled, up to the concurrency cap.
+    - execute_task() executes one selected task using an LLM with access to defined tools. Selected tasks run in parallel.
+    - reflect() reflects on the results of the executed tasks and updates their statuses. Tasks whose tool calls
+      all clearly succeeded or failed are decided by rules, the others by a structured LLM verdict (ReflectionSchema).
     - reflect_and_complete() generates a final summary output after all tasks are done.
-- Graph construction: create_agent_graph() builds the workflow graph with nodes and conditional edges.
+  Every node that waits on the LLM, a tool or the user also has an async version (agenerate_todos(), aexecute_task(), ...).
+- Graph construction: agent_workflow() builds the workflow graph with nodes and conditional edges, once per process,
+  and create_agent_graph() compiles it, once per checkpointer.
+  Ready tasks are fanned out to execute_task with LangGraph's Send API and their results are merged back
+  into AgentState by the reducers on 'tasks' and 'conversation_history'.
+  The compiled graph runs the sync nodes under invoke()/stream() and the async nodes under ainvoke()/astream().
+- Running a goal: arun_goal() drives one goal on the running event loop, so one loop can drive many goals at once.
+  run_goal() is its sync wrapper.
+
+Importing this module is cheap: langgraph, langchain, pydantic (the LLM output schemas in schemas.py), the tools and
+the clients are imported by the functions that use them, so `import agent` does not pay their second of imports
+until a graph is built or a node runs. The schemas and tools can still be imported from here (see __getattr__).
 
 """
 
+# Names this module used to import at the top, by the module that defines them; imported on first access
+_LAZY_EXPORTS = {
+    **dict.fromkeys(["TaskSchema", "TodoListSchema", "ReflectionSchema", "TaskVerdictSchema", "BatchReflectionSchema"], "schemas"),
+    **dict.fromkeys(["web_search", "read_file", "write_file", "append_to_file", "search_workspace",
+                     "AVAILABLE_TOOLS", "FILE_WRITING_TOOLS"], "tools"),
+    "get_llm": "clients",
+    "get_checkpointer": "checkpointer",
+}
+
 
+def __getattr__(name: str):
+    if name in _LAZY_EXPORTS:
+        value = getattr(importlib.import_module(_LAZY_EXPORTS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
-""" Agent states and LLM output schemas """
 
-class TaskSchema(BaseModel):
-    """ Schema by which an LLM can generate a single task """
-    id: int = Field(description="Unique identifier for the task") # We shall see if the id thing actually works
-    title: str = Field(description="Title of the task")
-    description: str = Field(description="Brief description of the task")
 
-class TodoListSchema(BaseModel):
-    """ Schema for a list of tasks """
-    tasks: list[TaskSchema] = Field(description="List of tasks generated from the goal")
+""" Agent states """
 
 class Task(TypedDict):
     """
     Represents a single, executable task in the agent workflow.
-    Attributes: TODO
+    Attributes:
+        id: Unique identifier of the task within the to-do list
+        title: Short title of the task
+        description: Brief description of the task
+        depends_on: IDs of the tasks that have to be settled (not pending) before this task can start
+        status: Current status of the task
+        result: Tool results or LLM response produced while executing the task
+        tool_outcomes: Per tool call of the last execution: "succeeded" or "failed" if the tool's result says so
+            unambiguously, "unclear" if judging it takes reading the result
+        reflection: Reflection on the result
     """
     id: int
     title: str
     description: str
+    depends_on: list[int]
     status: Literal["pending", "complete", "failed", "needs-follow-up"]
     result: str | None
+    tool_outcomes: list[Literal["succeeded", "failed", "unclear"]]
+    reflection: str | None
+
+
+def merge_tasks(current: list[Task] | None, update: list[Task] | None) -> list[Task] | None:
+    """
+    Reducer for AgentState['tasks']. 
+    Nodes return only the tasks they changed; those replace the stored task with the same id and the plan order is kept,
+    so results of tasks executed in parallel merge back the same way on every run.
+    """
+    if update is None:
+        return current
+    if not current:
+        return list(update)
+
+    merged = {task["id"]: task for task in current}
+    order = [task["id"] for task in current]
+    for task in update:
+        if task["id"] not in merged:
+            order.append(task["id"])
+        merged[task["id"]] = task
+    return [merged[task_id] for task_id in order]
+
 
 class AgentState(TypedDict):
     """
@@ -64,14 +131,33 @@ class AgentState(TypedDict):
         goal: The main objective the agent is trying to achieve, as entered by the user
         mode: Decides whether the agent waits for user confirmation before executing tasks ("confirm") or proceeds automatically ("auto")
         tasks: To-do list generated by LLM
+        current_task_id: Task executed by the current execute_task call. Each parallel branch gets its own value
+        active_task_ids: Tasks selected for the current round of parallel execution
         conversation_history: LLM message history maintained across all tasks for context
+        llm_calls_saved: Reflections that needed no LLM call of their own: decided from the tool outcomes alone,
+            or judged together with other tasks in one batched call
+        awaiting_reflection: Executed tasks whose reflection waits for a fuller batch (batched reflection only).
+            They stay pending, but are not selected again
+        reflection_batch_started: Time at which the oldest task in awaiting_reflection started waiting
+        speculative_results: Confirmed speculative executions of pending tasks, used when the tasks are executed
+        speculation_hits / speculation_misses: Speculative executions used / discarded
+    
+    Nodes return partial updates. 'tasks' and 'conversation_history' have reducers, so parallel branches
+    can update them in the same step.
     """
     goal: str
     mode: Literal["confirm", "auto"]
-    tasks: list[Task] | None
+    tasks: Annotated[list[Task] | None, merge_tasks]
     current_task_id: int | None
+    active_task_ids: list[int]
     approved: bool
-    conversation_history: list[str]  # Memory across tasks
+    conversation_history: Annotated[list[str], operator.add]  # Memory across tasks
+    llm_calls_saved: Annotated[int, operator.add]
+    awaiting_reflection: list[int]
+    reflection_batch_started: float | None
+    speculative_results: list[dict]
+    speculation_hits: Annotated[int, operator.add]
+    speculation_misses: Annotated[int, operator.add]
     output: str | None  # Final output after all tasks are done
 
 
@@ -80,6 +166,65 @@ class AgentState(TypedDict):
 
 """ Agent nodes """
 
+def invoke_llm(node: str, prompt, prepare=None, task: Task | None = None):
+    """
+    Invoke the model routed for a node (see routing.py) and record the call's latency, tokens and cost.
+    The call waits for the provider's rate limits and 429s and other transient failures are retried (see ratelimit.py).
+    If the call exceeds the node's latency budget, it is repeated with the node's fallback tier.
+
+    Args:
+        node: Name of the calling graph node
+        prompt: The LLM input
+        prepare: Turns the chat model into the runnable to invoke, e.g. by binding tools
+        task: The task the call is about, for per-task routing rules
+    """
+    router = get_router()
+    routes = router.routes(node, prompt, task)
+    for route in routes:
+        from clients import get_llm
+        llm = get_llm(**route["client"])
+        runnable = prepare(llm) if prepare else llm
+
+        def call():
+            with router.track(node, route):
+                return runnable.invoke(prompt)
+
+        try:
+            return get_rate_limiter().provider(route["provider"]).call(call, estimate_tokens(prompt))
+        except Exception as e:
+            if route is routes[-1] or not is_timeout(e):
+                raise
+            report_fallback(node, route, routes[-1])
+
+
+async def ainvoke_llm(node: str, prompt, prepare=None, task: Task | None = None):
+    """ Async version of invoke_llm(). Calls over the latency budget are cancelled when it runs out """
+    router = get_router()
+    routes = router.routes(node, prompt, task)
+    for route in routes:
+        from clients import get_llm
+        llm = get_llm(**route["client"])
+        runnable = prepare(llm) if prepare else llm
+
+        async def call():
+            with router.track(node, route):
+                if route["budget"]:
+                    return await asyncio.wait_for(runnable.ainvoke(prompt), route["budget"])
+                return await runnable.ainvoke(prompt)
+
+        try:
+            return await get_rate_limiter().provider(route["provider"]).acall(call, estimate_tokens(prompt))
+        except Exception as e:
+            if route is routes[-1] or not is_timeout(e):
+                raise
+            report_fallback(node, route, routes[-1])
+
+
+def report_fallback(node: str, route: dict, fallback: dict) -> None:
+    print(f"\n{node}: {route['client']['model']} exceeded the {route['budget']}s latency budget, "
+          f"retrying with {fallback['client']['model']}")
+
+
 def generate_todos(state: AgentState) -> AgentState:
     """
     Generate TO-DO list from user goal using LLM.
@@ -88,20 +233,57 @@ def generate_todos(state: AgentState) -> AgentState:
     and adds them to the state with 'pending' status.
     
     """
-    llm = ChatOpenAI(model="gpt-5-mini", temperature=0)
-    structured_llm = llm.with_structured_output(TodoListSchema)
-    
-    # LLM prompt
-    prompt = f"""Create the simplest possible to-do list for this goal by breaking it down into 3-7 simple, actionable tasks:
+    response = cached_todo_list(state)
+    if response is None:
+        from schemas import TodoListSchema
+        response = invoke_llm("generate_todos", todo_prompt(state), prepare=lambda llm: llm.with_structured_output(TodoListSchema))
+        cache_todo_list(state, response)
+    return apply_todo_list(state, response)
+
+
+async def agenerate_todos(state: AgentState) -> AgentState:
+    """ Async version of generate_todos() """
+    response = cached_todo_list(state)
+    if response is None:
+        from schemas import TodoListSchema
+        response = await ainvoke_llm("generate_todos", todo_prompt(state), prepare=lambda llm: llm.with_structured_output(TodoListSchema))
+        cache_todo_list(state, response)
+    return apply_todo_list(state, response)
+
+
+def cached_todo_list(state: AgentState) -> TodoListSchema | None:
+    """ The plan of a cached similar goal, adapted to this goal, if the plan cache is on and has one (see plan_cache.py) """
+    cache = get_plan_cache()
+    match = cache.lookup(state['goal']) if cache else None
+    if match is None:
+        return None
+    plan, cached_goal, similarity = match
+    print(f"\nReusing the plan of a similar goal: '{cached_goal}' (similarity {similarity:.2f})")
+    from schemas import TodoListSchema
+    return TodoListSchema.model_validate(plan)
+
+
+def cache_todo_list(state: AgentState, response: TodoListSchema) -> None:
+    cache = get_plan_cache()
+    if cache:
+        cache.store(state['goal'], response.model_dump())
+
+
+def todo_prompt(state: AgentState) -> str:
+    """ LLM prompt for generate_todos """
+    return f"""Create the simplest possible to-do list for this goal by breaking it down into 3-7 simple, actionable tasks:
     Goal: {state['goal']}
     
     Each task should represent a single, simple step.
     Each task should be achievable using only simple file operation tools: 'read file', 'write to file', 'append to file' or simple web search.
+    For each task, list in 'depends_on' the ids of the earlier tasks whose results it needs. Leave it empty if the task can run on its own.
     
     Avoid steps such as 'record', 'confirm', or 'reflect' unless absolutely necessary.
     """
 
-    response = structured_llm.invoke(prompt)
+
+def apply_todo_list(state: AgentState, response: TodoListSchema) -> AgentState:
+    """ Print the generated to-do list and turn it into the state update of generate_todos """
 
     # Print generated tasks
     print("\n" + "=" * 50)
@@ -117,20 +299,21 @@ def generate_todos(state: AgentState) -> AgentState:
 
 
     # Update state tasks and conversation history
-    state["tasks"] = [
+    tasks = [
         {
             "id": task.id,
             "title": task.title,
             "description": task.description,
+            "depends_on": task.depends_on,
             "status": "pending",
             "result": None,
+            "tool_outcomes": [],
             "reflection": None  
         }
         for task in response.tasks 
     ]
-    state["conversation_history"] = [f"Goal: {state['goal']}"]  # TODO: Move this to a better place
     
-    return state
+    return {"tasks": tasks, "conversation_history": [f"Goal: {state['goal']}"]}  # TODO: Move this to a better place
 
 
 def display_and_wait_for_approval(state: AgentState) -> AgentState:
@@ -143,184 +326,750 @@ def display_and_wait_for_approval(state: AgentState) -> AgentState:
     print("  [y] Yes - Start execution")
     print("  [n] No - Cancel")
     
-    choice = input("\nYour choice: ").strip().lower()
+    choice = input("\nYour choice: ")
+    return apply_approval(choice, state['goal'])
+
+
+async def adisplay_and_wait_for_approval(state: AgentState) -> AgentState:
+    """ Async version of display_and_wait_for_approval(). Waits for the user's input without blocking the event loop. """
+    print("\n" + "=" * 50)
+    print("\nDo you approve this task list?")
+    print("  [y] Yes - Start execution")
+    print("  [n] No - Cancel")
+    
+    choice = await asyncio.to_thread(input, "\nYour choice: ")
+    return apply_approval(choice, state['goal'])
+
+
+def apply_approval(choice: str, goal: str | None = None) -> AgentState:
+    """ Turn the user's answer into the state update of display_and_wait_for_approval. A rejected plan is not reused for later goals """
+    choice = choice.strip().lower()
     
     if choice == 'y' or choice == 'yes':
-        state["approved"] = True
         print("\n Task list approved. Starting execution...\n")
-    else:
-        state["approved"] = False
-        print("\n Task list rejected. Exiting...")
-    
-    return state
+        return {"approved": True}
 
+    cache = get_plan_cache()
+    if cache and goal:
+        cache.forget(goal)
+    print("\n Task list rejected. Exiting...")
+    return {"approved": False}
 
-def select_next_task(state: AgentState) -> AgentState:
-    """ Find and select the next pending task. First pending task is selected. """
 
-    if state["tasks"] is not None:
-        for task in state["tasks"]:
-            if task["status"] == "pending":
-                state["current_task_id"] = task["id"]
-                return state
-    
-    # No pending tasks found - clear current_task_id
-    state["current_task_id"] = None
-    return state
+def get_max_concurrency(config: RunnableConfig | None = None) -> int:
+    """
+    Maximum number of tasks executed (and reflected on) at the same time.
+    Set per run with config["configurable"]["max_concurrency"], or process-wide with AGENT_MAX_CONCURRENCY. 
+    1 restores strictly sequential execution.
+
+    Raises:
+        ValueError: If the setting is not an integer of at least 1
+    """
+    configurable = (config or {}).get("configurable", {})
+    value = configurable.get("max_concurrency")
+    if value is None:
+        value = os.getenv("AGENT_MAX_CONCURRENCY", "4")
+    try:
+        max_concurrency = int(value)
+    except (TypeError, ValueError):
+        max_concurrency = 0
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be an integer of at least 1, got {value!r}")
+    return max_concurrency
+
+
+def get_ready_tasks(tasks: list[Task] | None, waiting: set[int] | frozenset = frozenset()) -> list[Task]:
+    """
+    Return the pending tasks whose dependencies are settled, in plan order.
+
+    A dependency is settled once it is no longer pending - failed dependencies do not block a task, 
+    the execution prompt already tells the LLM not to solve failed tasks. Dependencies on unknown ids are ignored.
+    Tasks in `waiting` were executed and wait for their reflection: they are not ready, and tasks depending on them are not either.
+    If pending tasks remain but none is ready (a dependency cycle), the first pending task is returned so the plan cannot stall
+    (unless tasks are waiting, their reflection settles them).
+    """
+    if not tasks:
+        return []
+
+    statuses = {task["id"]: task["status"] for task in tasks}
+    pending = [task for task in tasks if task["status"] == "pending" and task["id"] not in waiting]
+    ready = [
+        task for task in pending
+        if all(statuses.get(dep, "complete") != "pending" for dep in task.get("depends_on") or [] if dep != task["id"])
+    ]
+
+    if pending and not ready and not waiting:
+        return pending[:1]
+    return ready
+
+
+def select_next_task(state: AgentState, config: Optional[RunnableConfig] = None) -> AgentState:
+    """ 
+    Select the pending tasks that can run now, i.e. all tasks whose dependencies are settled, 
+    up to the concurrency cap. The first selected task becomes current_task_id.
+    """
+    ready = get_ready_tasks(state["tasks"], set(state.get("awaiting_reflection") or []))[:get_max_concurrency(config)]
+    active_task_ids = [task["id"] for task in ready]
+
+    # No pending tasks found - current_task_id is cleared
+    return {
+        "current_task_id": active_task_ids[0] if active_task_ids else None,
+        "active_task_ids": active_task_ids
+    }
 
 
 def execute_task(state: AgentState) -> AgentState:
     """ 
     Execute the current task using available tools.
     Logs result in conversation history.
+
+    Several instances of this node can run at the same time, one per selected task (see dispatch_ready_tasks). 
+    Only the executed task and the new history entries are returned, the reducers merge them into the state.
     """
-      
-    # Get next task 
-    current_task = next((t for t in state["tasks"] if t["id"] == state["current_task_id"]), None)
+    current_task, history, task_prompt = start_task(state)
+    if state.get("speculative_result"):
+        return finish_speculative_task(current_task, history, state["speculative_result"])
+    
+    # LLM with tools, routed by the task's size and tool needs
+    from tools import AVAILABLE_TOOLS
+    response = invoke_llm("execute_task", task_prompt, prepare=lambda llm: llm.bind_tools(AVAILABLE_TOOLS), task=current_task)
+
+    outcomes = invoke_tools(response.tool_calls)
+    return finish_task(current_task, history, response, outcomes)
+
+
+async def aexecute_task(state: AgentState) -> AgentState:
+    """ Async version of execute_task() """
+    current_task, history, task_prompt = start_task(state)
+    speculation = state.get("speculative_result")
+    if speculation:
+        if speculation["outcomes"] is None:
+            speculation = dict(speculation, outcomes=await ainvoke_tools(speculation["tool_calls"]))
+        return finish_speculative_task(current_task, history, speculation)
+    
+    # LLM with tools, routed by the task's size and tool needs
+    from tools import AVAILABLE_TOOLS
+    response = await ainvoke_llm("execute_task", task_prompt, prepare=lambda llm: llm.bind_tools(AVAILABLE_TOOLS), task=current_task)
+
+    outcomes = await ainvoke_tools(response.tool_calls)
+    return finish_task(current_task, history, response, outcomes)
+
+
+def start_task(state: AgentState) -> tuple[Task, list[str], str]:
+    """ 
+    Look up the current task and build its execution prompt.
+
+    Returns:
+        A copy of the task (the stored task is shared with the other branches), the new history entries and the LLM prompt
+    """
+    current_task = dict(next((t for t in state["tasks"] if t["id"] == state["current_task_id"]), None))
+    history = []
     
     # Add task to conversation history
-    state["conversation_history"].append(f"Executing task #{current_task['id']}: {current_task['title']}")
+    history.append(f"Executing task #{current_task['id']}: {current_task['title']}")
     print(f"\nTASK #{current_task['id']}: {current_task['title']}\n")
     
-    # Initialize LLM with tools
-    llm = ChatOpenAI(model="gpt-5-mini", temperature=0)
-    llm_with_tools = llm.bind_tools(AVAILABLE_TOOLS)
-    
-    # Create LLM prompt
-    task_prompt = f"""Execute this task described with the title and description:
-    Title: {current_task['title']}
-    Description: {current_task['description']}
-    Context: {state['conversation_history']}
+    context = state.get("task_context") or task_context(state, current_task)
+    return current_task, history, execution_prompt(current_task, context)
+
+
+def get_resolved_result_chars() -> int:
+    """ Most characters of one stored tool output put into a prompt in full (set with AGENT_RESOLVED_RESULT_CHARS) """
+    return max(200, int(os.getenv("AGENT_RESOLVED_RESULT_CHARS", "2000")))
+
+
+def task_context(state: AgentState, task: Task) -> str:
+    """
+    History context of a task, followed by the results of the tasks it depends on. History entries only carry
+    previews of long tool outputs, so the dependencies' results are resolved (up to get_resolved_result_chars() each)
+    """
+    context = get_history_manager().context_for(state["conversation_history"], task)
+    tasks_by_id = {t["id"]: t for t in state.get("tasks") or []}
+    store = get_result_store()
+    results = [
+        f"Result of task #{dep} ({tasks_by_id[dep]['title']}): {store.resolve(tasks_by_id[dep]['result'], max_chars=get_resolved_result_chars())}"
+        for dep in task.get("depends_on") or [] if dep != task["id"] and (tasks_by_id.get(dep) or {}).get("result")
+    ]
+    if results:
+        context += "\n\nResults of the tasks this task depends on:\n" + "\n".join(results)
+    return context
+
+
+def execution_prompt(task: Task, context: str) -> str:
+    """ LLM prompt for executing a task, given its rendered history context """
+    return f"""Execute this task described with the title and description:
+    Title: {task['title']}
+    Description: {task['description']}
+    Context: {context}
     
     Focus on the current task. If any tasks failed previously, do not try to solve them.
     Use the available tools as needed to complete the task.
     Do not create files unless absolutely necessary.
     Put all created files in an 'agent-files/' directory."""
-    
-    response = llm_with_tools.invoke(task_prompt)
+
+
+def find_tool(tool_name: str):
+    """ Return the tool called tool_name from AVAILABLE_TOOLS, or None """
+    from tools import AVAILABLE_TOOLS
+    return next((t for t in AVAILABLE_TOOLS if t.name == tool_name), None)
+
+
+def invoke_tool(tool_call: dict) -> dict:
+    """ 
+    Run one tool call requested by the LLM.
+
+    Returns:
+        The tool call with its outcome: 'result' if it ran, 'error' if it raised, neither if the tool does not exist
+    """
+    tool_func = find_tool(tool_call['name'])
+    if tool_func is None:
+        return {**tool_call, "found": False}
+    try:
+        return {**tool_call, "found": True, "result": tool_func.invoke(tool_call['args'])}
+    except Exception as e:
+        return {**tool_call, "found": True, "error": e}
+
+
+async def ainvoke_tool(tool_call: dict) -> dict:
+    """ Async version of invoke_tool() """
+    tool_func = find_tool(tool_call['name'])
+    if tool_func is None:
+        return {**tool_call, "found": False}
+    try:
+        return {**tool_call, "found": True, "result": await tool_func.ainvoke(tool_call['args'])}
+    except Exception as e:
+        return {**tool_call, "found": True, "error": e}
+
+
+def get_max_tool_concurrency() -> int:
+    """ Maximum number of tool calls from one LLM response that run at the same time. Set with AGENT_MAX_TOOL_CONCURRENCY """
+    return max(1, int(os.getenv("AGENT_MAX_TOOL_CONCURRENCY", "8")))
+
+
+def group_tool_calls(tool_calls: list[dict]) -> list[list[int]]:
+    """
+    Split the tool calls of one LLM response into groups that can run at the same time.
+
+    Calls on a path that one of the calls writes to (write_file, append_to_file) conflict with each other
+    and stay together in one group, in the order the LLM requested them. Every other call is a group of its own.
+
+    Returns:
+        Groups of indexes into tool_calls
+    """
+    def call_path(tool_call: dict) -> str | None:
+        path = (tool_call.get('args') or {}).get('file_path')
+        return os.path.normpath(os.path.abspath(path)) if isinstance(path, str) and path else None
+
+    from tools import FILE_WRITING_TOOLS
+    written_paths = {call_path(call) for call in tool_calls if call['name'] in FILE_WRITING_TOOLS} - {None}
+
+    groups = {}
+    for index, tool_call in enumerate(tool_calls):
+        path = call_path(tool_call)
+        key = ("path", path) if path in written_paths else ("call", index)
+        groups.setdefault(key, []).append(index)
+    return list(groups.values())
+
+
+def invoke_tools(tool_calls: list[dict]) -> list[dict]:
+    """
+    Run the tool calls of one LLM response on a bounded thread pool.
+    Only conflicting calls (see group_tool_calls) run one after the other. Outcomes are returned in tool call order.
+    """
+    groups = group_tool_calls(tool_calls)
+    if len(groups) <= 1:
+        return [invoke_tool(tool_call) for tool_call in tool_calls]
+
+    outcomes = [None] * len(tool_calls)
+
+    def run_group(group: list[int]):
+        for index in group:
+            outcomes[index] = invoke_tool(tool_calls[index])
+
+    from langchain_core.runnables.config import ContextThreadPoolExecutor
+    with ContextThreadPoolExecutor(max_workers=min(len(groups), get_max_tool_concurrency())) as pool:
+        list(pool.map(run_group, groups))
+    return outcomes
+
+
+async def ainvoke_tools(tool_calls: list[dict]) -> list[dict]:
+    """ Async version of invoke_tools(), running the groups as asyncio tasks """
+    semaphore = asyncio.Semaphore(get_max_tool_concurrency())
+    outcomes = [None] * len(tool_calls)
+
+    async def run_group(group: list[int]):
+        async with semaphore:
+            for index in group:
+                outcomes[index] = await ainvoke_tool(tool_calls[index])
+
+    await asyncio.gather(*(run_group(group) for group in group_tool_calls(tool_calls)))
+    return outcomes
+
+
+def finish_task(current_task: Task, history: list[str], response, outcomes: list[dict], response_shown: bool | None = None) -> AgentState:
+    """ 
+    Record the tool outcomes (in tool call order) or the plain LLM response as the task result.
+
+    Long outputs are kept once in the result store. The task result and the history only get their references
+    (handle + bounded preview), one per tool call, so they grow linearly with the number of tool calls.
+    A plain response is printed unless response_shown (by default: unless its tokens were streamed).
+    """
+    store = get_result_store()
 
     if response.tool_calls:
-        current_task['result'] = ''  # Initialize result once before processing all tool calls
+        results = []  # One entry per tool call
         
-        for tool_call in response.tool_calls:
-            tool_name = tool_call['name']
-            tool_args = tool_call['args']
+        for outcome in outcomes:
+            tool_name = outcome['name']
+            tool_args = outcome['args']
         
-            tool_func = next((t for t in AVAILABLE_TOOLS if t.name == tool_name), None)
-            if tool_func:
-                try:
-                    result = tool_func.invoke(tool_args)
-                    # Check if tool_args string representation is too long to log
-                    if len(str(tool_args)) > 100: # Avoid logging large content in conversation history
-                        state["conversation_history"].append(f"Tool '{tool_name}' executed.")
-                        print(f"Tool '{tool_name}' executed.\n")
-                    else:
-                        state["conversation_history"].append(f"Tool '{tool_name}' executed with arguments {tool_args}")
-                        print(f"Tool '{tool_name}' executed with arguments {tool_args}")
-                    current_task['result'] += str(result)
-                    state["conversation_history"].append(f"Result: {current_task['result']}") # TODO: Update for case where result is None, for instance tool call creates a file. (Maybe they should all return strings)
-                    print(f"Result: {current_task['result']}\n")
-                except Exception as e:
-                    current_task['result'] += f"Tool execution failed: {e}"
-                    state["conversation_history"].append(f"Tool {tool_name}execution failed: {e}")
-                    print(f"Tool {tool_name} execution failed: {e}") # TODO: Maybe this should be added to conversation history? 
+            if not outcome['found']:
+                results.append(f"Tool '{tool_name}' not found")
+                history.append(f"Tool '{tool_name}' not found in AVAILABLE_TOOLS")
+                print(f"Tool '{tool_name}' not found in AVAILABLE_TOOLS")
+
+            elif 'error' in outcome:
+                e = outcome['error']
+                results.append(f"Tool execution failed: {e}")
+                history.append(f"Tool {tool_name}execution failed: {e}")
+                print(f"Tool {tool_name} execution failed: {e}") # TODO: Maybe this should be added to conversation history? 
 
             else:
-                current_task['result'] += f"Tool '{tool_name}' not found"
-                state["conversation_history"].append(f"Tool '{tool_name}' not found in AVAILABLE_TOOLS")
-                print(f"Tool '{tool_name}' not found in AVAILABLE_TOOLS")
+                # Check if tool_args string representation is too long to log
+                if len(str(tool_args)) > 100: # Avoid logging large content in conversation history
+                    history.append(f"Tool '{tool_name}' executed.")
+                    print(f"Tool '{tool_name}' executed.\n")
+                else:
+                    history.append(f"Tool '{tool_name}' executed with arguments {tool_args}")
+                    print(f"Tool '{tool_name}' executed with arguments {tool_args}")
+                result = store.reference(str(outcome['result']))
+                results.append(result)
+                history.append(f"Result: {result}") # TODO: Update for case where result is None, for instance tool call creates a file. (Maybe they should all return strings)
+                print(f"Result: {result}\n")
+
+        current_task['result'] = "\n".join(results)
+        current_task['tool_outcomes'] = [classify_tool_outcome(outcome) for outcome in outcomes]
 
     # No tool calls made
     else:
-        result = response.content
+        result = store.reference(response.content)
         current_task['result'] = result
-        state["conversation_history"].append(f"LLM Response: {result}")
-        print(f"LLM Response: {result}\n")
+        current_task['tool_outcomes'] = []
+        history.append(f"LLM Response: {result}")
+        if not (tokens_streamed() if response_shown is None else response_shown):
+            print(f"LLM Response: {result}\n")
+
+    return {"tasks": [current_task], "conversation_history": history}
+
 
-    return state
+def finish_speculative_task(current_task: Task, history: list[str], speculation: dict) -> AgentState:
+    """ Finish a task from its confirmed speculative execution (see speculate_task()), running the file writes it held back """
+    print(f"Using the speculative execution of task #{current_task['id']}")
+    outcomes = speculation["outcomes"]
+    if outcomes is None:
+        outcomes = invoke_tools(speculation["tool_calls"])
+    from langchain_core.messages import AIMessage
+    response = AIMessage(content=speculation["content"], tool_calls=speculation["tool_calls"])
+    return {**finish_task(current_task, history, response, outcomes, response_shown=False), "speculation_hits": 1}
 
 
+# Results by which the tools report that they failed ("Error: File 'x' not found", "Search error: ...")
+_FAILED_RESULT = re.compile(r"(Error\b|Search error:)")
 
-def reflect(state: AgentState) -> AgentState:
+
+def classify_tool_outcome(outcome: dict) -> Literal["succeeded", "failed", "unclear"]:
+    """
+    Judge a tool call by its outcome alone: "failed" if the tool was not found, raised or returned an error,
+    "succeeded" if a file writing tool confirmed the write, otherwise "unclear" (e.g. search results, file contents)
+    """
+    if not outcome['found'] or 'error' in outcome:
+        return "failed"
+    result = str(outcome['result'])
+    if _FAILED_RESULT.match(result):
+        return "failed"
+    from tools import FILE_WRITING_TOOLS
+    if outcome['name'] in FILE_WRITING_TOOLS and result.startswith("Successfully "):
+        return "succeeded"
+    return "unclear"
+
+
+
+def reflect_on_task(task: Task) -> tuple[Task, str, bool]:
     """ 
-    Reflect on the output of a task and decide on the task's status 
-    TODO: Involve human-in-the-loop when LLM deems it necessary
+    Reflect on the output of a single task and decide on the task's status.
+    Tasks whose tool calls all succeeded or all failed unambiguously are decided without an LLM call.
+
+    Returns:
+        A copy of the task with updated status and reflection, the history entry for the reflection
+        and whether the LLM call was saved
     """
-    # Get the current task by ID
-    current_task = next((t for t in state["tasks"] if t["id"] == state["current_task_id"]), None)
-    
-    if not current_task:
-        print(f"Error: Could not find task with ID {state['current_task_id']}")
-        return state
-    
-    llm = ChatOpenAI(model="gpt-5-mini", temperature=0)
+    verdict = fast_reflection(task)
+    if verdict is not None:
+        return apply_reflection(task, verdict, llm_call_saved=True, note="from the tool outcomes")
+    from schemas import ReflectionSchema
+    response = invoke_llm("reflect", reflection_prompt(task), prepare=lambda llm: llm.with_structured_output(ReflectionSchema), task=task)
+    return apply_reflection(task, response)
+
+
+async def areflect_on_task(task: Task) -> tuple[Task, str, bool]:
+    """ Async version of reflect_on_task() """
+    verdict = fast_reflection(task)
+    if verdict is not None:
+        return apply_reflection(task, verdict, llm_call_saved=True, note="from the tool outcomes")
+    from schemas import ReflectionSchema
+    response = await ainvoke_llm("reflect", reflection_prompt(task), prepare=lambda llm: llm.with_structured_output(ReflectionSchema), task=task)
+    return apply_reflection(task, response)
+
+
+def reflect_on_batch(batch: list[Task]) -> list[tuple[Task, str, bool]]:
+    """ 
+    Reflect on several tasks with one LLM call that returns a verdict per task id.
+    Tasks the LLM returned no verdict for are reflected on one by one.
+    """
+    if len(batch) == 1:
+        return [reflect_on_task(batch[0])]
+    from schemas import BatchReflectionSchema
+    response = invoke_llm("reflect", batch_reflection_prompt(batch), prepare=lambda llm: llm.with_structured_output(BatchReflectionSchema))
+    reflections, missing = apply_batch_reflection(batch, response)
+    return reflections + [reflect_on_task(task) for task in missing]
 
-    reflection_prompt = f"""Summarize the result of the recently completed task titled '{current_task['title']}'.
+
+async def areflect_on_batch(batch: list[Task]) -> list[tuple[Task, str, bool]]:
+    """ Async version of reflect_on_batch() """
+    if len(batch) == 1:
+        return [await areflect_on_task(batch[0])]
+    from schemas import BatchReflectionSchema
+    response = await ainvoke_llm("reflect", batch_reflection_prompt(batch), prepare=lambda llm: llm.with_structured_output(BatchReflectionSchema))
+    reflections, missing = apply_batch_reflection(batch, response)
+    return reflections + list(await asyncio.gather(*(areflect_on_task(task) for task in missing)))
+
+
+def fast_reflection(task: Task) -> ReflectionSchema | None:
+    """ 
+    Rule-based verdict for tasks whose tool calls all succeeded (e.g. write_file returned "Successfully wrote ...")
+    or all failed (an "Error: ..." result). None if the result has to be read to judge it
+    """
+    from schemas import ReflectionSchema
+    outcomes = set(task.get('tool_outcomes') or ["unclear"])
+    if outcomes == {"succeeded"}:
+        return ReflectionSchema(status="successful", explanation=f"Every tool call succeeded. {task['result']}")
+    if outcomes == {"failed"}:
+        return ReflectionSchema(status="failed", explanation=f"Every tool call failed. {task['result']}")
+    return None
+
+
+def reflection_prompt(task: Task) -> str:
+    """ LLM prompt for reflecting on a single task """
+    return f"""Summarize the result of the recently completed task titled '{task['title']}'.
     Based on the result, choose one label for the task: "successful", "failed", or "needs follow-up".
     In no more than three sentences, briefly explain your decision. Be concise.
-    This is the result: {current_task['result']}
+    This is the result: {get_result_store().resolve(task['result'])}
     """
 
-    response = llm.invoke(reflection_prompt)
-    reflection = response.content
 
-    # Determine status based on which keyword appears first in the reflection
-    reflection_lower = reflection.lower()
-    
-    # Find positions of each keyword (returns -1 if not found)
-    pos_successful = reflection_lower.find("successful")
-    pos_success = reflection_lower.find("success")
-    pos_failed = reflection_lower.find("failed")
-    pos_follow_up = reflection_lower.find("follow-up")
-    
-    # Get the earliest success-related position
-    success_positions = [p for p in [pos_successful, pos_success] if p != -1]
-    earliest_success = min(success_positions) if success_positions else float('inf')
-    
-    # Get the earliest position among all keywords
-    positions = {
-        'complete': earliest_success,
-        'failed': pos_failed if pos_failed != -1 else float('inf'),
-        'needs-follow-up': pos_follow_up if pos_follow_up != -1 else float('inf')
-    }
-    
-    # Find which keyword appears first
-    first_status = min(positions.items(), key=lambda x: x[1])
-    
-    if first_status[1] != float('inf'):
-        current_task['status'] = first_status[0]
-    else:
-        current_task['status'] = "complete"  # Default to complete if no keywords found
+def batch_reflection_prompt(batch: list[Task]) -> str:
+    """ LLM prompt for reflecting on several tasks at once """
+    results = "\n\n".join(
+        f"Task #{task['id']}: {task['title']}\nResult: {get_result_store().resolve(task['result'])}" for task in batch
+    )
+    return f"""Summarize the results of the recently completed tasks below.
+    For every task, choose one label based on its result: "successful", "failed", or "needs follow-up".
+    In no more than three sentences per task, briefly explain your decision. Be concise.
+    Return exactly one verdict per task, with the task's ID.
+
+{results}
+    """
+
+
+# Task status for each label of ReflectionSchema
+REFLECTION_STATUSES = {"successful": "complete", "failed": "failed", "needs follow-up": "needs-follow-up"}
+
+
+def apply_reflection(task: Task, verdict: ReflectionSchema, llm_call_saved: bool = False, note: str | None = None) -> tuple[Task, str, bool]:
+    """ Set the task status from the verdict. Returns the updated copy of the task, its history entry and llm_call_saved """
+    task = dict(task)
+    task['status'] = REFLECTION_STATUSES[verdict.status]
+    task['reflection'] = verdict.explanation
+    print(f"Reflection{f' ({note})' if note else ''}: {verdict.explanation}")
+    print(f"✓ Task #{task['id']} marked as: {task['status']}\n")
+
+    return task, f"Reflection on task #{task['id']}: {verdict.explanation}. Task marked as {task['status']}.", llm_call_saved
+
+
+def apply_batch_reflection(batch: list[Task], response: BatchReflectionSchema) -> tuple[list[tuple[Task, str, bool]], list[Task]]:
+    """ 
+    Apply the verdicts of a batched reflection. Every task after the first one judged by the call saved an LLM call.
+    Returns the reflections and the tasks without a verdict
+    """
+    verdicts = {verdict.task_id: verdict for verdict in response.verdicts}
+    reflections = []
+    for task in batch:
+        if task['id'] in verdicts:
+            reflections.append(apply_reflection(task, verdicts[task['id']], llm_call_saved=bool(reflections), note="batched"))
+    return reflections, [task for task in batch if task['id'] not in verdicts]
+
+
+def get_reflection_batching(config: RunnableConfig | None = None) -> tuple[int, float]:
+    """
+    Batch size and maximum wait (seconds) of batched reflection.
+    Set per run with config["configurable"]["reflection_batch_size"] / ["reflection_max_wait_s"], or process-wide with
+    AGENT_REFLECTION_BATCH_SIZE (default 1: every task is reflected on with its own LLM call) and AGENT_REFLECTION_MAX_WAIT_S (2).
+    """
+    configurable = (config or {}).get("configurable", {})
+    size = configurable.get("reflection_batch_size") or os.getenv("AGENT_REFLECTION_BATCH_SIZE", "1")
+    max_wait = configurable.get("reflection_max_wait_s")
+    if max_wait is None:
+        max_wait = os.getenv("AGENT_REFLECTION_MAX_WAIT_S", "2")
+    return max(1, int(size)), float(max_wait)
+
+
+def reflect(state: AgentState, config: RunnableConfig | None = None) -> AgentState:
+    """ 
+    Reflect on the output of the executed tasks and decide on each task's status.
+    Tasks executed in the same round are reflected on in parallel, up to the concurrency cap.
+    With batched reflection, tasks are judged in batches instead (see split_reflections()).
+    With speculation, the tasks that only wait for this reflection are executed meanwhile (see speculative_tasks()).
+    TODO: Involve human-in-the-loop when LLM deems it necessary
+    """
+    executed = executed_tasks(state)
+    if not executed:
+        return {}
+
+    decided, batches, waiting = split_reflections(state, executed, config)
+    reflections = [reflect_on_task(task) for task in decided]
+    speculative = speculative_tasks(state, executed, reflections, batches, config)
+    speculations = {}
+    if len(batches) == 1 and not speculative:
+        reflections += reflect_on_batch(batches[0])
+    elif batches or speculative:
+        # The context-propagating pool keeps callbacks (and with them streaming and tracing) attached to the run
+        from langchain_core.runnables.config import ContextThreadPoolExecutor
+        with ContextThreadPoolExecutor(max_workers=min(len(batches), get_max_concurrency(config)) + len(speculative)) as pool:
+            pending = [pool.submit(reflect_on_batch, batch) for batch in batches]
+            speculations = {task["id"]: pool.submit(speculate_task, state, task, assumes) for task, assumes in speculative}
+            for future in concurrent.futures.as_completed(pending):
+                batch_reflections = future.result()
+                reflections += batch_reflections
+                # Speculation on a task that did not complete is wasted: cancel it if it has not started
+                for task_id in invalidated_speculations(speculative, batch_reflections):
+                    speculations[task_id].cancel()
+
+    results = {task_id: speculation_outcome(future) for task_id, future in speculations.items()}
+    return {**apply_reflections(state, reflections, waiting), **settle_speculations(state, executed, reflections, results)}
+
+
+async def areflect(state: AgentState, config: RunnableConfig | None = None) -> AgentState:
+    """ Async version of reflect(). Speculative executions are cancelled as soon as a task they assume does not complete """
+    executed = executed_tasks(state)
+    if not executed:
+        return {}
+
+    decided, batches, waiting = split_reflections(state, executed, config)
+    reflections = [reflect_on_task(task) for task in decided]
+    speculative = speculative_tasks(state, executed, reflections, batches, config)
+    speculations = {task["id"]: asyncio.create_task(aspeculate_task(state, task, assumes)) for task, assumes in speculative}
+    semaphore = asyncio.Semaphore(get_max_concurrency(config))
+
+    async def reflect_limited(batch: list[Task]) -> list[tuple[Task, str, bool]]:
+        async with semaphore:
+            batch_reflections = await areflect_on_batch(batch)
+        for task_id in invalidated_speculations(speculative, batch_reflections):
+            speculations[task_id].cancel()
+        return batch_reflections
+
+    for batch_reflections in await asyncio.gather(*(reflect_limited(batch) for batch in batches)):
+        reflections += batch_reflections
+    await asyncio.gather(*speculations.values(), return_exceptions=True)
+
+    results = {task_id: speculation_outcome(task) for task_id, task in speculations.items()}
+    return {**apply_reflections(state, reflections, waiting), **settle_speculations(state, executed, reflections, results)}
+
+
+def split_reflections(state: AgentState, executed: list[Task], config: RunnableConfig | None = None) -> tuple[list[Task], list[list[Task]], list[Task]]:
+    """
+    Split the executed tasks into the ones the rules decide, the batches to reflect on now and the ones left waiting.
+
+    Without batching every other task is a batch of its own. With batching the tasks go into batches of up to
+    the batch size, and a last, partial batch waits for the next round's results as long as another task can run
+    in the meantime and its oldest task has waited less than the maximum wait. Waiting tasks stay pending but are
+    not selected again (see awaiting_reflection), so has_more_tasks still routes back to select_next_task.
 
-    current_task['reflection'] = reflection
-    state["conversation_history"].append(f"Reflection on task #{state['current_task_id']}: {reflection}. Task marked as {current_task['status']}.")
-    print(f"Reflection: {reflection}")
-    print(f"✓ Task #{state['current_task_id']} marked as: {current_task['status']}\n")
+    Returns:
+        Tasks decided by the rules, batches to reflect on now and the tasks that wait for a fuller batch
+    """
+    size, max_wait = get_reflection_batching(config)
+    decided = [task for task in executed if fast_reflection(task) is not None]
+    unclear = [task for task in executed if fast_reflection(task) is None]
+    batches = [unclear[i:i + size] for i in range(0, len(unclear), size)]
+
+    if size > 1 and batches and len(batches[-1]) < size:
+        waited = time.time() - (state.get("reflection_batch_started") or time.time())
+        if waited < max_wait and get_ready_tasks(state["tasks"], {task["id"] for task in executed}):
+            return decided, batches[:-1], batches[-1]
+    return decided, batches, []
+
+
+def get_speculation(config: RunnableConfig | None = None) -> bool:
+    """ Whether to execute tasks speculatively while their dependencies are reflected on: config["configurable"]["speculate"] or AGENT_SPECULATE """
+    configurable = (config or {}).get("configurable", {})
+    value = configurable.get("speculate")
+    if value is None:
+        value = os.getenv("AGENT_SPECULATE", "").strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def speculative_tasks(state: AgentState, executed: list[Task], reflections: list[tuple[Task, str, bool]],
+                      batches: list[list[Task]], config: RunnableConfig | None = None) -> list[tuple[Task, list[int]]]:
+    """
+    Pending tasks that become ready if the tasks in `batches`, whose reflection is about to start, are complete,
+    up to the concurrency cap. Tasks executed in this round or speculated on earlier are left out.
+
+    Returns:
+        The tasks with the ids of the reflected-on tasks each of them assumes to complete
+    """
+    if not get_speculation(config):
+        return []
+    assumed = {task["id"] for batch in batches for task in batch}
+    statuses = {task["id"]: task["status"] for task in state["tasks"]}
+    statuses.update({task["id"]: task["status"] for task, _, _ in reflections})
+    statuses.update({task_id: "complete" for task_id in assumed})
+    excluded = {task["id"] for task in executed} | {result["task_id"] for result in state.get("speculative_results") or []}
+
+    speculative = []
+    for task in state["tasks"]:
+        depends_on = {dep for dep in task.get("depends_on") or [] if dep != task["id"]}
+        if (task["status"] == "pending" and task["id"] not in excluded and depends_on & assumed
+                and all(statuses.get(dep, "complete") != "pending" for dep in depends_on)):
+            speculative.append((task, sorted(depends_on & assumed)))
+    return speculative[:get_max_concurrency(config)]
+
+
+def speculate_task(state: AgentState, task: Task, assumes: list[int]) -> dict:
+    """
+    Execute a task ahead of the reflection on the tasks it depends on (assumes), as if they were complete:
+    the LLM call and the read-only tool calls. File writes cannot be taken back, so a response that writes files
+    keeps all of its tool calls until the speculation is confirmed (see finish_speculative_task())
+    """
+    prompt = execution_prompt(task, task_context(state, task))
+    from tools import AVAILABLE_TOOLS, FILE_WRITING_TOOLS
+    response = invoke_llm("execute_task", prompt, prepare=lambda llm: llm.bind_tools(AVAILABLE_TOOLS), task=task)
+    writes = any(call["name"] in FILE_WRITING_TOOLS for call in response.tool_calls)
+    return speculative_result(task, assumes, response, None if writes else invoke_tools(response.tool_calls))
+
+
+async def aspeculate_task(state: AgentState, task: Task, assumes: list[int]) -> dict:
+    """ Async version of speculate_task() """
+    prompt = execution_prompt(task, task_context(state, task))
+    from tools import AVAILABLE_TOOLS, FILE_WRITING_TOOLS
+    response = await ainvoke_llm("execute_task", prompt, prepare=lambda llm: llm.bind_tools(AVAILABLE_TOOLS), task=task)
+    writes = any(call["name"] in FILE_WRITING_TOOLS for call in response.tool_calls)
+    return speculative_result(task, assumes, response, None if writes else await ainvoke_tools(response.tool_calls))
+
+
+def speculative_result(task: Task, assumes: list[int], response, outcomes: list[dict] | None) -> dict:
+    """ What a speculative execution keeps in the state (tool errors as text, so it can be checkpointed) """
+    if outcomes is not None:
+        outcomes = [{**outcome, "error": str(outcome["error"])} if "error" in outcome else outcome for outcome in outcomes]
+    return {"task_id": task["id"], "assumes": assumes, "content": response.content, "tool_calls": response.tool_calls, "outcomes": outcomes}
+
+
+def speculation_outcome(future) -> dict | None:
+    """ Result of a finished speculative execution (thread pool future or asyncio task), None if it was cancelled or raised """
+    if future.cancelled():
+        return None
+    if future.exception() is not None:
+        print(f"Speculative execution failed: {future.exception()}")
+        return None
+    return future.result()
+
+
+def invalidated_speculations(speculative: list[tuple[Task, list[int]]], reflections: list[tuple[Task, str, bool]]) -> list[int]:
+    """ Ids of the speculated tasks that assumed one of the reflected tasks would complete, when it did not """
+    not_complete = {task["id"] for task, _, _ in reflections if task["status"] != "complete"}
+    return [task["id"] for task, assumes in speculative if not_complete & set(assumes)]
+
+
+def settle_speculations(state: AgentState, executed: list[Task], reflections: list[tuple[Task, str, bool]],
+                        results: dict[int, dict | None]) -> AgentState:
+    """
+    Keep the speculative results whose assumed tasks all completed, for execute_task to use, and discard the others.
+    Results kept earlier stay until their task is executed.
+    """
+    statuses = {task["id"]: task["status"] for task, _, _ in reflections}
+    executed_ids = {task["id"] for task in executed}
+    kept = [result for result in state.get("speculative_results") or [] if result["task_id"] not in executed_ids]
+    misses = 0
+    for task_id, result in results.items():
+        if result is not None and all(statuses.get(dep) == "complete" for dep in result["assumes"]):
+            kept.append(result)
+        else:
+            misses += 1
+            print(f"Discarded the speculative execution of task #{task_id}")
+    if not results and not state.get("speculative_results"):
+        return {}
+    return {"speculative_results": kept, "speculation_misses": misses}
+
+
+def executed_tasks(state: AgentState) -> list[Task]:
+    """ Return the tasks executed in the current round, after the ones executed earlier that wait for their reflection """
+    task_ids = list(state.get("awaiting_reflection") or []) + (state.get("active_task_ids") or [state["current_task_id"]])
+    tasks_by_id = {t["id"]: t for t in state["tasks"]}
+    
+    executed = []
+    for task_id in dict.fromkeys(task_ids):
+        if task_id not in tasks_by_id:
+            print(f"Error: Could not find task with ID {task_id}")
+            continue
+        executed.append(tasks_by_id[task_id])
+    return executed
+
+
+def apply_reflections(state: AgentState, reflections: list[tuple[Task, str, bool]], waiting: list[Task] | None = None) -> AgentState:
+    """ Print the task statuses and turn the reflections into the state update of reflect """
+    plan_order = {task["id"]: i for i, task in enumerate(state["tasks"])}
+    reflections = sorted(reflections, key=lambda reflection: plan_order.get(reflection[0]["id"], len(plan_order)))
+    updated_tasks = [task for task, _, _ in reflections]
+    waiting_ids = [task["id"] for task in waiting or []]
     
     # Debug: show all task statuses
     print("Current task statuses:")
-    for task in state["tasks"]:
+    for task in merge_tasks(state["tasks"], updated_tasks):
         status_icon = "✓" if task["status"] == "complete" else "." if task["status"] == "pending" else "✗"
-        print(f"  {status_icon} Task {task['id']}: {task['status']}")
+        print(f"  {status_icon} Task {task['id']}: {task['status']}{' (waiting for batched reflection)' if task['id'] in waiting_ids else ''}")
     print()
+
+    # The wait of a batch counts from its oldest task
+    still_waiting = set(waiting_ids) & set(state.get("awaiting_reflection") or [])
+    started = state.get("reflection_batch_started") if still_waiting else time.time()
     
-    return state 
+    return {
+        "tasks": updated_tasks,
+        "conversation_history": [entry for _, entry, _ in reflections],
+        "llm_calls_saved": sum(saved for _, _, saved in reflections),
+        "awaiting_reflection": waiting_ids,
+        "reflection_batch_started": started if waiting_ids else None,
+    }
 
 
 
 def reflect_and_complete(state: AgentState) -> AgentState:
     """ Mark the agent as having completed all tasks. """
+    response = invoke_llm("reflect_and_complete", final_output_prompt(state))
+    return {"output": response.content}
 
-    llm = ChatOpenAI(model="gpt-5-mini", temperature=0)
 
-    final_output_prompt = f"""The agent has completed all tasks for the goal: {state['goal']}.
-    Based on the conversation history: {state['conversation_history']}, provide a concise summary of
-    the final output or result achieved by the agent. If the goal was to answer a question, provide the answer."""
+async def areflect_and_complete(state: AgentState) -> AgentState:
+    """ Async version of reflect_and_complete() """
+    response = await ainvoke_llm("reflect_and_complete", final_output_prompt(state))
+    return {"output": response.content}
 
-    response = llm.invoke(final_output_prompt)
-    state["output"] = response.content
 
-    return state
+def final_output_prompt(state: AgentState) -> str:
+    """ LLM prompt for the final summary. The stored tool outputs in the history are resolved, up to get_resolved_result_chars() each """
+    history = get_result_store().resolve(get_history_manager().context_for(state['conversation_history']), max_chars=get_resolved_result_chars())
+    return f"""The agent has completed all tasks for the goal: {state['goal']}.
+    Based on the conversation history: {history}, provide a concise summary of
+    the final output or result achieved by the agent. If the goal was to answer a question, provide the answer."""
 
 
 
@@ -361,41 +1110,103 @@ def has_more_tasks(state: AgentState) -> str:
     if state["tasks"] is not None:
         pending_count = sum(1 for task in state["tasks"] if task["status"] == "pending")
         if pending_count > 0:
-            print(f"→ {pending_count} pending task(s) remaining")
+            # Tasks waiting for a batched reflection are pending too; the batch waits only while other tasks can run
+            waiting = len(state.get("awaiting_reflection") or [])
+            print(f"→ {pending_count} pending task(s) remaining" + (f", {waiting} waiting for batched reflection" if waiting else ""))
             return "execute"
     
     print("→ No more pending tasks. Moving to completion.")
     return "end"
 
 
+def dispatch_ready_tasks(state: AgentState) -> list | str:  # A list of Sends; resolved by LangGraph, which this module imports lazily
+    """
+    Fan out every selected task to its own execute_task call.
+
+    Each Send carries the task, its id, its history context (task_context) rendered from the current state and
+    its confirmed speculative execution, if there is one;
+    the branches run in the same step and their results are merged back by the reducers.
+    
+    Returns:
+        One Send per selected task, or "complete" if nothing was selected (e.g. an empty to-do list)
+    """
+    if not state.get("active_task_ids"):
+        return "complete"
+    from langgraph.types import Send
+    # Each branch gets only its own task and its rendered history context, not a copy of the whole state:
+    # pending Sends are checkpointed, and full copies made every dispatch grow with tasks x history
+    tasks_by_id = {task["id"]: task for task in state["tasks"]}
+    speculative = {result["task_id"]: result for result in state.get("speculative_results") or []}
+    return [
+        Send("execute_task", {
+            "current_task_id": task_id,
+            "tasks": [tasks_by_id[task_id]],
+            "task_context": task_context(state, tasks_by_id[task_id]),
+            "speculative_result": speculative.get(task_id),
+        })
+        for task_id in state["active_task_ids"]
+    ]
+
+
 
 
 """ Graph construction """
 
-def create_agent_graph():
+def create_agent_graph(checkpointer=None):
     """
-    Create and compile the agent workflow graph.
+    Compile the agent workflow graph (see agent_workflow()) with a checkpointer.
+
+    Args:
+        checkpointer: Checkpoint saver for the graph. Defaults to checkpointer.get_checkpointer(): a durable
+            SQLite checkpointer if AGENT_CHECKPOINT_DB is set, otherwise an in-memory one
+    
+    Returns:
+        Compiled LangGraph application ready for execution. It is compiled once per checkpointer and shared
+        by the callers that pass the same one
+    """
+    if checkpointer is None:
+        from checkpointer import get_checkpointer
+        checkpointer = get_checkpointer()
+    with _compiled_graphs_lock:
+        app = _compiled_graphs.get(id(checkpointer))
+        if app is None or app.checkpointer is not checkpointer:
+            app = agent_workflow().compile(checkpointer=checkpointer)
+            _compiled_graphs[id(checkpointer)] = app
+        return app
+
+
+# Compiled graphs by the id of their checkpointer. Weak values: a graph keeps its checkpointer (and so the id) alive,
+# and is compiled again once nobody holds it. Keying by the checkpointer itself would keep both alive for good
+_compiled_graphs: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+_compiled_graphs_lock = threading.Lock()
+
+
+@functools.cache
+def agent_workflow() -> StateGraph:
+    """
+    Build the agent workflow graph. It is built once per process and compiled once per checkpointer by create_agent_graph().
     
     The graph consists of the following nodes:
     - generate_todos: Generate task list from user goal
-    - select_next_task: Select the next pending task
-    - execute_task: Execute the current task using LLM with tools
+    - select_next_task: Select the pending tasks whose dependencies are settled
+    - execute_task: Execute one selected task using LLM with tools (one call per selected task, in parallel)
+    - reflect: Decide on the status of the executed tasks
     - reflect_and_complete: Generate final summary after all tasks are done
-    
-    Returns:
-        Compiled LangGraph application ready for execution
     """
     
+    from langchain_core.runnables import RunnableLambda
+    from langgraph.graph import StateGraph, END
+
     # Initialize StateGraph with AgentState schema
     workflow = StateGraph(AgentState)
     
-    # Add nodes to the graph
-    workflow.add_node("generate_todos", generate_todos)
-    workflow.add_node("display_and_wait_for_approval", display_and_wait_for_approval)
+    # Add nodes to the graph. Nodes with an async version use it under ainvoke()/astream()
+    workflow.add_node("generate_todos", RunnableLambda(generate_todos, afunc=agenerate_todos))
+    workflow.add_node("display_and_wait_for_approval", RunnableLambda(display_and_wait_for_approval, afunc=adisplay_and_wait_for_approval))
     workflow.add_node("select_next_task", select_next_task)
-    workflow.add_node("execute_task", execute_task)
-    workflow.add_node("reflect", reflect)
-    workflow.add_node("reflect_and_complete", reflect_and_complete)
+    workflow.add_node("execute_task", RunnableLambda(execute_task, afunc=aexecute_task))
+    workflow.add_node("reflect", RunnableLambda(reflect, afunc=areflect))
+    workflow.add_node("reflect_and_complete", RunnableLambda(reflect_and_complete, afunc=areflect_and_complete))
     
     # Set entry point
     workflow.set_entry_point("generate_todos")
@@ -420,10 +1231,17 @@ def create_agent_graph():
         }
     )
 
-    # After selecting a task, execute it
-    workflow.add_edge("select_next_task", "execute_task")
+    # After selecting tasks, execute all of them at the same time
+    workflow.add_conditional_edges(
+        "select_next_task",
+        dispatch_ready_tasks,
+        {
+            "execute_task": "execute_task",
+            "complete": "reflect_and_complete"
+        }
+    )
 
-    # After executing a task, reflect on it
+    # After all selected tasks are executed, reflect on them
     workflow.add_edge("execute_task", "reflect")
     
     # After reflecting on the status of a task, check if there are more tasks to execute.
@@ -441,11 +1259,139 @@ def create_agent_graph():
     # After reflection, end the workflow
     workflow.add_edge("reflect_and_complete", END)
     
-    # Compile the graph with memory for state persistence
-    memory = MemorySaver()
-    app = workflow.compile(checkpointer=memory)
-    
-    return app
+    return workflow
+
+
+
+
+""" Running the agent """
+
+def new_agent_state(goal: str, mode: Literal["confirm", "auto"] = "auto") -> AgentState:
+    """ Initial state for a goal. Auto mode is pre-approved. """
+    return {
+        "goal": goal,
+        "mode": mode,
+        "tasks": None,
+        "current_task_id": None,
+        "active_task_ids": [],
+        "approved": (mode == "auto"),
+        "conversation_history": [],
+        "llm_calls_saved": 0,
+        "awaiting_reflection": [],
+        "reflection_batch_started": None,
+        "speculative_results": [],
+        "speculation_hits": 0,
+        "speculation_misses": 0,
+        "output": None
+    }
+
+
+def new_run_config(thread_id: str | None = None, callbacks: list | None = None, **configurable) -> RunnableConfig:
+    """ 
+    Run config for one goal. Every goal needs its own thread id, otherwise concurrent goals share checkpoints.
+    callbacks (e.g. streaming.TimeToFirstTokenHandler) are passed to every LLM call of the run.
+    Extra keyword arguments (e.g. max_concurrency) are passed to the nodes as configurable values.
+    """
+    config = {
+        "configurable": {"thread_id": thread_id or uuid.uuid4().hex, **configurable},
+        "recursion_limit": 100  # Increased from default 25 to allow more tasks
+    }
+    if callbacks:
+        config["callbacks"] = callbacks
+    return config
+
+
+def tokens_streamed() -> bool:
+    """ True inside a run whose LLM tokens are streamed to the terminal, so nodes do not print LLM responses again """
+    try:
+        from langgraph.config import get_config
+        return bool(get_config().get("configurable", {}).get("stream_tokens"))
+    except RuntimeError:  # Called outside a graph run
+        return False
+
+
+async def astream_run(app, graph_input, config: RunnableConfig, renderer=None) -> None:
+    """
+    Drive the graph to the end. With a renderer (streaming.TokenRenderer), LLM tokens are streamed with
+    stream_mode="messages" and rendered as they arrive; otherwise the nodes print their own output.
+    """
+    if renderer is None:
+        async for _ in app.astream(graph_input, config):
+            pass  # Nodes print their own output
+        return
+
+    config = {**config, "configurable": {**config.get("configurable", {}), "stream_tokens": True}}
+    try:
+        async for message, metadata in app.astream(graph_input, config, stream_mode="messages"):
+            renderer.feed(message, metadata)
+    finally:
+        renderer.close()
+
+
+async def arun_goal(goal: str, mode: Literal["confirm", "auto"] = "auto", app=None, config: RunnableConfig | None = None,
+                    renderer=None) -> AgentState:
+    """
+    Run the agent for one goal on the running event loop.
+
+    Args:
+        goal (str): The goal to work on
+        mode (str): "auto" or "confirm"
+        app: Compiled graph to use. Compiling once and sharing it between goals saves the compilation per goal
+        config (RunnableConfig): Run config, see new_run_config(). A fresh thread id is used if not given
+        renderer: Optional streaming.TokenRenderer to stream LLM tokens to; it is closed at the end of the run
+
+    Returns:
+        AgentState: The final state of the run
+    """
+    app = app or create_agent_graph()
+    config = config or new_run_config()
+
+    await astream_run(app, new_agent_state(goal, mode), config, renderer)
+
+    return (await app.aget_state(config)).values
+
+
+def run_goal(goal: str, mode: Literal["confirm", "auto"] = "auto", app=None, config: RunnableConfig | None = None) -> AgentState:
+    """ Sync wrapper around arun_goal() """
+    return asyncio.run(arun_goal(goal, mode, app, config))
+
+
+async def aresume_goal(thread_id: str, app=None, config: RunnableConfig | None = None, renderer=None) -> AgentState:
+    """
+    Continue an interrupted run from the last super-step saved in its checkpoints.
+    Tasks already marked complete are not executed again. The graph needs a durable checkpointer (see checkpointer.py).
+
+    Args:
+        thread_id (str): Thread id of the run to continue
+        app: Compiled graph to use
+        config (RunnableConfig): Run config; its thread id is replaced by thread_id
+        renderer: Optional streaming.TokenRenderer to stream LLM tokens to
+
+    Returns:
+        AgentState: The final state of the run
+
+    Raises:
+        ValueError: If there is no checkpoint for thread_id
+    """
+    app = app or create_agent_graph()
+    config = config or new_run_config()
+    config = {**config, "configurable": {**config.get("configurable", {}), "thread_id": thread_id}}
+
+    snapshot = await app.aget_state(config)
+    if not snapshot.values:
+        raise ValueError(f"No checkpoint found for thread '{thread_id}'")
+
+    if snapshot.next:  # Finished runs have nothing left to do
+        await astream_run(app, None, config, renderer)
+    elif renderer is not None:
+        renderer.close()
+
+    return (await app.aget_state(config)).values
+
+
+def resume_goal(thread_id: str, app=None, config: RunnableConfig | None = None) -> AgentState:
+    """ Sync wrapper around aresume_goal() """
+    return asyncio.run(aresume_goal(thread_id, app, config))
 
 
 
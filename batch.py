@@ -0,0 +1,258 @@
+from agent import create_agent_graph, arun_goal, aresume_goal, new_run_config
+from checkpointer import DEFAULT_CHECKPOINT_PATH, get_checkpointer
+from result_store import configure_result_store
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import time
+
+"""
+Non-interactive batch runner: runs the goals of a JSONL file through the agent, many at a time.
+
+    python batch.py goals.jsonl --output results.jsonl --concurrency 16
+    python batch.py goals.jsonl --output results.jsonl --resume      # after an interruption
+
+Every line of the input is a JSON object with the goal in "goal" (or, as in requests.jsonl, in "title" and
+"body") and an optional job id in "id" or "request_id" (the line number otherwise). Job ids must be unique: a line
+repeating an earlier id is skipped. Goals are read as they are
+needed and run in auto mode on one compiled graph, at most `concurrency` at a time, each with its own thread id
+derived from the batch id and the job id.
+
+Results are appended to the output file as JSONL as soon as each goal finishes, one record per goal:
+id, goal, thread_id, status ("ok" or "error"), output, tasks (id, title, status), seconds and error.
+With --resume, goals whose last record is "ok" are skipped, goals interrupted mid-run continue from their last
+checkpoint (the checkpoints are durable, see checkpointer.py) and everything else runs from the start.
+
+The agent's own output is hidden unless --verbose is given; progress goes to stderr. At the end the throughput
+(goals/min) and the latency percentiles of the goals are printed.
+"""
+
+
+def goal_record(line: str, line_number: int) -> tuple[str, str] | None:
+    """ Job id and goal of one input line, None for a blank line. Raises ValueError if the line has no goal """
+    if not line.strip():
+        return None
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("not a JSON object")
+    goal = record.get("goal") or "\n\n".join(str(record[key]) for key in ("title", "body") if record.get(key))
+    if not goal:
+        raise ValueError("no 'goal' (or 'title'/'body') field")
+    job_id = record.get("id") or record.get("request_id") or f"line-{line_number}"
+    return str(job_id), goal
+
+
+def read_goals(path: str):
+    """
+    Yield (job id, goal) for every goal in a JSONL file, reading it line by line. Invalid lines are reported and skipped,
+    and so are lines repeating an earlier job id: the job id names the goal's checkpoint thread and its result record
+    """
+    first_lines: dict[str, int] = {}
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            try:
+                record = goal_record(line, line_number)
+                if record is not None and record[0] in first_lines:
+                    raise ValueError(f"duplicate job id '{record[0]}' (first used on line {first_lines[record[0]]})")
+            except ValueError as e:  # json.JSONDecodeError is a ValueError too
+                print(f"Skipping line {line_number} of {path}: {e}", file=sys.stderr)
+                continue
+            if record is not None:
+                first_lines[record[0]] = line_number
+                yield record
+
+
+def finished_jobs(output: str) -> set[str]:
+    """ Ids of the jobs whose last record in an output file is "ok" """
+    statuses = {}
+    if os.path.exists(output):
+        with open(output, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # A record cut off by a crash
+                statuses[record.get("id")] = record.get("status")
+    return {job_id for job_id, status in statuses.items() if status == "ok"}
+
+
+def default_batch_id(output: str) -> str:
+    """ Batch id derived from the output path, so a resumed batch finds the checkpoints of its goals again """
+    return "batch-" + hashlib.sha1(os.path.abspath(output).encode()).hexdigest()[:10]
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def format_report(stats: dict) -> str:
+    """ Render the statistics returned by arun_batch() """
+    lines = [
+        f"Goals: {stats['ok']} ok, {stats['errors']} failed, {stats['skipped']} skipped (finished earlier), {stats['resumed']} resumed",
+        f"Throughput: {stats['goals_per_min']:.1f} goals/min ({stats['elapsed_s']:.1f}s)",
+    ]
+    if stats["latency_s"]:
+        latency = stats["latency_s"]
+        lines.append(f"Latency per goal: p50 {latency['p50']:.2f}s, p90 {latency['p90']:.2f}s, p99 {latency['p99']:.2f}s, max {latency['max']:.2f}s")
+    return "\n".join(lines)
+
+
+
+
+""" Running a batch """
+
+async def arun_goal_job(app, job_id: str, goal: str, thread_id: str, resume: bool, config: dict) -> tuple[dict, bool]:
+    """
+    Run (or, with resume, continue) one goal of a batch.
+
+    Returns:
+        The goal's output record and whether it continued from a checkpoint
+    """
+    run_config = new_run_config(thread_id=thread_id, **config)
+    start = time.perf_counter()
+    resumed = False
+    try:
+        snapshot = await app.aget_state(run_config)
+        if snapshot.values and resume:
+            resumed = True
+            final_state = await aresume_goal(thread_id, app, run_config)
+        else:
+            if snapshot.values:  # Left over from an earlier batch with the same id: start over
+                await app.checkpointer.adelete_thread(thread_id)
+            final_state = await arun_goal(goal, "auto", app, run_config)
+        record = {
+            "status": "ok",
+            "output": final_state.get("output"),
+            "tasks": [{"id": t["id"], "title": t["title"], "status": t["status"]} for t in final_state.get("tasks") or []],
+        }
+    except Exception as e:
+        record = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+    return {"id": job_id, "goal": goal, "thread_id": thread_id, **record, "seconds": round(time.perf_counter() - start, 3)}, resumed
+
+
+async def arun_batch(input_path: str, output: str, concurrency: int = 8, app=None, resume: bool = False,
+                     batch_id: str | None = None, config: dict | None = None, progress_every: int = 10) -> dict:
+    """
+    Run every goal of a JSONL file, at most `concurrency` at a time, and append a record per goal to `output`.
+
+    Args:
+        input_path: JSONL file with the goals (see the module docstring)
+        output: JSONL file the results are appended to
+        concurrency: Number of goals run at the same time
+        app: Compiled graph shared by all goals; compiled with the default checkpointer if not given
+        resume: Skip the goals finished earlier and continue interrupted ones from their checkpoints
+        batch_id: Prefix of the goals' thread ids. Derived from the output path if not given
+        config: Extra configurable values for every run (e.g. max_concurrency)
+        progress_every: Print progress to stderr every this many finished goals
+
+    Returns:
+        Counts of ok, failed, skipped and resumed goals, elapsed time, throughput and latency percentiles
+
+    Raises:
+        FileExistsError: If output already has results and resume is not set
+    """
+    if not resume and os.path.exists(output) and os.path.getsize(output):
+        raise FileExistsError(f"'{output}' already has results; pass resume=True (--resume) or use a new output file")
+    app = app or create_agent_graph()
+    batch_id = batch_id or default_batch_id(output)
+    skip = finished_jobs(output) if resume else set()
+    stats = {"ok": 0, "errors": 0, "skipped": 0, "resumed": 0}
+    latencies = []
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=2 * concurrency)  # Goals are read only as fast as they are run
+    start = time.perf_counter()
+
+    async def produce():
+        for job_id, goal in read_goals(input_path):
+            if job_id in skip:
+                stats["skipped"] += 1
+                continue
+            await queue.put((job_id, goal))
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def work(out):
+        while (job := await queue.get()) is not None:
+            job_id, goal = job
+            record, resumed = await arun_goal_job(app, job_id, goal, f"{batch_id}-{job_id}", resume, config or {})
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            stats["ok" if record["status"] == "ok" else "errors"] += 1
+            stats["resumed"] += resumed
+            latencies.append(record["seconds"])
+            done = stats["ok"] + stats["errors"]
+            if progress_every and done % progress_every == 0:
+                rate = done / (time.perf_counter() - start) * 60
+                print(f"[{done} goals] {rate:.1f} goals/min, {stats['errors']} failed", file=sys.stderr)
+
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "a+b") as f:
+        if f.tell() and (f.seek(-1, os.SEEK_END), f.read(1))[1] != b"\n":
+            f.write(b"\n")  # Finish a record cut off by a crash, so the next one starts on its own line
+    with open(output, "a", encoding="utf-8") as out:
+        await asyncio.gather(produce(), *(work(out) for _ in range(concurrency)))
+
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    stats["elapsed_s"] = elapsed
+    stats["goals_per_min"] = (stats["ok"] + stats["errors"]) / elapsed * 60 if elapsed else 0.0
+    stats["latency_s"] = {
+        "p50": percentile(latencies, 0.5), "p90": percentile(latencies, 0.9), "p99": percentile(latencies, 0.99), "max": latencies[-1],
+    } if latencies else {}
+    return stats
+
+
+
+
+""" Entry point """
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the goals of a JSONL file through the agent")
+    parser.add_argument("input", help="JSONL file with one goal per line")
+    parser.add_argument("--output", "-o", required=True, help="JSONL file the results are appended to")
+    parser.add_argument("--concurrency", "-c", type=int, default=8, help="Goals run at the same time (default: 8)")
+    parser.add_argument("--resume", action="store_true", help="Continue a partially finished batch")
+    parser.add_argument("--batch-id", help="Prefix of the goals' thread ids (default: derived from the output path)")
+    parser.add_argument("--max-concurrency", type=int, help="Tasks of one goal executed at the same time")
+    parser.add_argument("--checkpoint-db", default=os.getenv("AGENT_CHECKPOINT_DB", DEFAULT_CHECKPOINT_PATH),
+                        help=f"SQLite file for checkpoints (default: {DEFAULT_CHECKPOINT_PATH})")
+    parser.add_argument("--verbose", action="store_true", help="Show the agent's output (interleaved between goals)")
+    return parser.parse_args(argv)
+
+
+async def amain(args: argparse.Namespace):
+    load_dotenv()
+    if not os.getenv("OPENAI_API_KEY"):
+        print("Error: OPENAI_API_KEY not found in .env file")
+        return
+
+    # Durable checkpoints, so an interrupted batch can be resumed, and tool outputs on disk (as in main.py)
+    checkpointer = get_checkpointer(args.checkpoint_db)
+    if not os.getenv("AGENT_RESULT_STORE_DIR"):
+        configure_result_store(directory=os.path.join(os.path.dirname(args.checkpoint_db) or ".", "results"))
+    app = create_agent_graph(checkpointer)
+    config = {"max_concurrency": args.max_concurrency} if args.max_concurrency else {}
+
+    try:
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+            stats = await arun_batch(args.input, args.output, args.concurrency, app, args.resume, args.batch_id, config)
+    except FileExistsError as e:
+        print(f"Error: {e}")
+        return
+    print(format_report(stats))
+
+
+def main():
+    asyncio.run(amain(parse_args()))
+
+
+if __name__ == "__main__":
+    main()
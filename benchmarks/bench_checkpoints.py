@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from langgraph.checkpoint.memory import MemorySaver
+
+import agent
+import checkpointer
+from benchmarks.fakes import ScriptedChatModel, offline, synthetic_plan
+
+"""
+Benchmark: checkpointing overhead and storage per super-step.
+
+Runs a synthetic plan through the real graph with an instant fake LLM (benchmarks/fakes.py), so the measured time is
+graph and checkpoint overhead only, once per checkpointer:
+- memory:        MemorySaver (nothing is durable)
+- sqlite-sync:   SQLiteCheckpointSaver committing every write before returning (flush_interval=0)
+- sqlite-batch:  SQLiteCheckpointSaver with batched writes (the default)
+
+Then it reports the bytes stored per checkpoint with whole channel values (delta=False) and with
+delta-encoded list channels (the default), and checks that both reconstruct the same final state.
+
+Run from the repository root:
+    python -m benchmarks.bench_checkpoints --tasks 50 --content-chars 1500
+"""
+
+
+def run(saver, plan, content_chars: int = 100, config=None) -> tuple[float, int]:
+    """ Run the plan once, returning the wall time and the number of checkpoints written """
+    content = ("The task was successful. " + "It produced a detailed answer covering the subtopic. " * (content_chars // 52))[:max(content_chars, 25)]
+    with offline(ScriptedChatModel(plan=plan, answer=content)):
+        app = agent.create_agent_graph(saver)
+        config = config or agent.new_run_config()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(agent.arun_goal("Write a report", app=app, config=config))
+        elapsed = time.perf_counter() - start
+        return elapsed, len(list(saver.list(config)))
+
+
+def bytes_per_checkpoint(saver, plan, content_chars: int) -> tuple[list[int], int, dict]:
+    """ Run the plan, returning the bytes queued for storage by each checkpoint, the bytes stored and the final state """
+    sizes = []
+    put = saver.put
+    def measured_put(*args, **kwargs):
+        before = saver.bytes_written
+        config = put(*args, **kwargs)
+        sizes.append(saver.bytes_written - before)
+        return config
+    saver.put = measured_put
+
+    config = agent.new_run_config()
+    run(saver, plan, content_chars, config)
+    return sizes, saver.storage_bytes(config["configurable"]["thread_id"]), saver.get_tuple(config).checkpoint["channel_values"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=50, help="Number of tasks in the synthetic plan")
+    parser.add_argument("--content-chars", type=int, default=1500, help="Length of every fake LLM answer (task results and reflections)")
+    args = parser.parse_args()
+
+    plan = synthetic_plan(args.tasks)
+    run(MemorySaver(), plan)  # Warm-up: imports and first-call costs
+    with tempfile.TemporaryDirectory() as directory:
+        savers = {
+            "memory": MemorySaver(),
+            "sqlite-sync": checkpointer.SQLiteCheckpointSaver(os.path.join(directory, "sync.sqlite"), flush_interval=0),
+            "sqlite-batch": checkpointer.SQLiteCheckpointSaver(os.path.join(directory, "batch.sqlite")),
+        }
+
+        print(f"{'checkpointer':<14}  {'wall time':>10}  {'checkpoints':>11}  {'per step':>9}  {'commits':>7}")
+        for name, saver in savers.items():
+            elapsed, checkpoints = run(saver, plan)
+            commits = getattr(saver, "flushes", "-")
+            print(f"{name:<14}  {elapsed * 1000:>8.0f}ms  {checkpoints:>11}  {elapsed / checkpoints * 1000:>7.2f}ms  {commits:>7}")
+            if hasattr(saver, "close"):
+                saver.close()
+
+        full_saver = checkpointer.SQLiteCheckpointSaver(os.path.join(directory, "full.sqlite"), delta=False)
+        delta_saver = checkpointer.SQLiteCheckpointSaver(os.path.join(directory, "delta.sqlite"))
+        full, full_stored, full_state = bytes_per_checkpoint(full_saver, plan, args.content_chars)
+        delta, delta_stored, delta_state = bytes_per_checkpoint(delta_saver, plan, args.content_chars)
+        assert full_state == delta_state, "Delta-encoded checkpoints should reconstruct the same state"
+
+        print(f"\nBytes per checkpoint ({args.tasks} tasks, {args.content_chars}-character answers)")
+        print(f"{'step':>4}  {'whole':>9}  {'delta':>9}")
+        for step in sorted({*range(0, len(full), max(1, len(full) // 10)), len(full) - 1}):
+            print(f"{step:>4}  {full[step]:>9}  {delta[step]:>9}")
+        print(f"\nmean per step:  {sum(full) / len(full):>10.0f} whole, {sum(delta) / len(delta):>8.0f} delta")
+        print(f"last step:      {full[-1]:>10} whole, {delta[-1]:>8} delta")
+        print(f"stored in total: {full_stored:>9} whole, {delta_stored:>8} delta")
+        full_saver.close()
+        delta_saver.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import os
+import statistics
+import time
+
+from benchmarks.fake_server import FakeServer
+
+"""
+Micro-benchmark: per-task latency with per-call clients vs. the shared client registry.
+
+A "task" is what one execute_task node costs on the network: one chat completion plus one web search.
+"before" builds a fresh ChatOpenAI and TavilyClient for every task, like the nodes used to;
+"after" uses clients.get_llm() and clients.get_tavily_client().
+
+Run from the repository root:
+    python -m benchmarks.bench_clients --tasks 50 --handshake-ms 30
+"""
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_before(tasks: int, base_url: str) -> list[float]:
+    from langchain_openai import ChatOpenAI
+    from tavily import TavilyClient
+
+    latencies = []
+    for _ in range(tasks):
+        start = time.perf_counter()
+        llm = ChatOpenAI(model="gpt-5-mini", temperature=0)
+        llm.invoke("Execute the task")
+        TavilyClient(api_key="fake", api_base_url=base_url).search("query", max_results=3)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_after(tasks: int, base_url: str) -> list[float]:
+    import clients
+
+    clients.close_clients()
+    clients.configure_clients(tavily_base_url=base_url)
+
+    latencies = []
+    for _ in range(tasks):
+        start = time.perf_counter()
+        clients.get_llm().invoke("Execute the task")
+        clients.get_tavily_client().search("query", max_results=3)
+        latencies.append(time.perf_counter() - start)
+
+    clients.close_clients()
+    return latencies
+
+
+def _report(label: str, latencies: list[float], connections: int) -> None:
+    print(
+        f"{label:<8} mean {statistics.mean(latencies) * 1000:7.2f} ms   "
+        f"p50 {_percentile(latencies, 50) * 1000:7.2f} ms   "
+        f"p95 {_percentile(latencies, 95) * 1000:7.2f} ms   "
+        f"connections opened: {connections}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=50, help="Number of simulated tasks per run")
+    parser.add_argument("--handshake-ms", type=float, default=30.0, help="Simulated TLS handshake per new connection")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated server time per request")
+    args = parser.parse_args()
+
+    with FakeServer(latency=args.latency_ms / 1000, handshake_delay=args.handshake_ms / 1000) as server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ["OPENAI_API_KEY"] = "fake"
+        os.environ["TAVILY_API_KEY"] = "fake"
+
+        # Warm up imports so neither run pays for them
+        run_before(1, server.base_url)
+
+        server.connections = 0
+        before = run_before(args.tasks, server.base_url)
+        _report("before", before, server.connections)
+
+        server.connections = 0
+        after = run_after(args.tasks, server.base_url)
+        _report("after", after, server.connections)
+
+    print(f"speedup  {statistics.mean(before) / statistics.mean(after):.2f}x mean per-task latency")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import file_cache
+from tools import append_to_file, read_file, write_file
+from workspace_index import get_workspace_index
+
+"""
+Benchmark: read_file and append_to_file with and without the file cache and the append handle pool.
+
+Writes a file with write_file and reads it back with read_file, as a task reading an earlier task's output does,
+with the write-through cache on and off. Then appends many short entries with append_to_file through the pool
+of open handles (write-through, and with the opt-in buffer), and with an open/append/close per call as before the pool.
+
+Run from the repository root:
+    python -m benchmarks.bench_file_cache --kb 64 --reads 200 --appends 2000
+"""
+
+
+def time_reads(path: str, reads: int) -> float:
+    times = []
+    for _ in range(reads):
+        start = time.perf_counter()
+        read_file.func(path)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kb", type=int, default=64, help="Size of the file that is read back")
+    parser.add_argument("--reads", type=int, default=200, help="read_file calls per setting (the median is reported)")
+    parser.add_argument("--appends", type=int, default=2000, help="append_to_file calls per setting")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "report.md")
+        content = ("A line of the report written by an earlier task.\n" * (args.kb * 1024 // 50 + 1))[:args.kb * 1024]
+
+        print(f"{'read_file, ' + str(args.kb) + 'KB':<28}  {'median':>9}")
+        for label, cache in (("no cache", None), ("write-through cache", file_cache.FileCache())):
+            file_cache.configure_file_cache(cache)
+            write_file.func(path, content)
+            print(f"{label:<28}  {time_reads(path, args.reads):>7.1f}us")
+
+        entry = "- finding from a task\n"
+        print(f"\n{'append_to_file x ' + str(args.appends):<28}  {'total':>9}  {'per call':>9}")
+        start = time.perf_counter()
+        index = get_workspace_index()
+        for _ in range(args.appends):
+            # What append_to_file did before the pool
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(entry)
+            index.update(path, entry, appended=True)
+        elapsed = time.perf_counter() - start
+        print(f"{'open/append/close':<28}  {elapsed * 1000:>7.1f}ms  {elapsed / args.appends * 1e6:>7.1f}us")
+
+        for label, interval in (("pooled handle, write-through", 0.0), ("pooled handle, 200ms buffer", 0.2)):
+            pool = file_cache.AppendPool(flush_interval=interval)
+            file_cache.configure_append_pool(pool)
+            start = time.perf_counter()
+            for _ in range(args.appends):
+                append_to_file.func(path, entry)
+            pool.flush()
+            elapsed = time.perf_counter() - start
+            print(f"{label:<28}  {elapsed * 1000:>7.1f}ms  {elapsed / args.appends * 1e6:>7.1f}us  (writes: {pool.stats()['writes']})")
+        file_cache.configure_append_pool(file_cache.AppendPool())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import agent
+import checkpointer
+import search_cache
+import tracing
+from benchmarks.fakes import ScriptedChatModel, offline, synthetic_plan
+
+"""
+Benchmark: the whole graph end to end, offline.
+
+Runs create_agent_graph() over synthetic plans (chains of three dependent tasks) with the scripted fake chat
+model and the fake Tavily backend from benchmarks/fakes.py, so nothing touches the network and runs are repeatable.
+Per plan size it reports:
+- wall time of the run, and latency per graph node (calls, mean, p50, p95, total)
+- peak Python memory (tracemalloc, measured in a second run so it does not slow down the timed one)
+- checkpoint count and size (SQLiteCheckpointSaver in a temporary directory)
+- LLM calls, tokens and searches
+With --reflection-batch-size the tasks are reflected on in batches, one LLM call per batch. With --speculate the
+next tasks are executed while their dependencies are reflected on; speculation hits and misses are reported.
+With --trace the timed runs are also traced (tracing.py), so comparing with an untraced run shows the tracing overhead.
+
+Results are written to a JSON file; --compare prints the change against an earlier file.
+
+Run from the repository root:
+    python -m benchmarks.bench_graph --tasks 5 50 500 --output bench_graph.json
+    python -m benchmarks.bench_graph --tasks 5 50 --output after.json --compare bench_graph.json
+"""
+
+
+class NodeTimer(BaseCallbackHandler):
+    """ Records the duration of every graph node run """
+    def __init__(self):
+        self._started = {}  # Run id -> (node, start time)
+        self.samples: dict[str, list[float]] = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, name=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # The node itself, not the runnable of the same name it wraps or any other runnable nested in it
+        if node is not None and name == node and parent_run_id not in self._started:
+            self._started[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            node, start = started
+            self.samples.setdefault(node, []).append(time.perf_counter() - start)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+    def summary(self) -> dict[str, dict]:
+        return {node: _latency_stats(values) for node, values in sorted(self.samples.items())}
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _latency_stats(values: list[float]) -> dict:
+    return {
+        "calls": len(values),
+        "mean_ms": statistics.mean(values) * 1000,
+        "p50_ms": _percentile(values, 50) * 1000,
+        "p95_ms": _percentile(values, 95) * 1000,
+        "total_ms": sum(values) * 1000,
+    }
+
+
+def run_once(tasks: int, args: argparse.Namespace, directory: str, measure_memory: bool = False) -> dict:
+    """ Run a plan of `tasks` tasks through the graph once and return its measurements """
+    llm = ScriptedChatModel(
+        plan=synthetic_plan(tasks),
+        latency=args.llm_latency_ms / 1000,
+        token_latency=args.token_latency_ms / 1000,
+        answer_tokens=args.answer_tokens,
+        tool_call_percent=args.tool_call_percent,
+    )
+    saver = checkpointer.SQLiteCheckpointSaver(os.path.join(directory, f"{tasks}-{measure_memory}.sqlite"))
+    search_cache.configure_search_cache(search_cache.SearchCache())  # Every run starts with an empty cache
+    timer = NodeTimer()
+    tracer = tracing.Tracer(args.trace) if args.trace and not measure_memory else None
+    config = agent.new_run_config(callbacks=[timer] + ([tracer] if tracer else []), max_concurrency=args.max_concurrency,
+                                  reflection_batch_size=args.reflection_batch_size, reflection_max_wait_s=args.reflection_max_wait_s,
+                                  speculate=args.speculate)
+    config["recursion_limit"] = 10 * tasks + 100
+
+    with offline(llm, args.search_latency_ms / 1000, args.result_chars) as (tavily, async_tavily):
+        app = agent.create_agent_graph(saver)
+        if measure_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            final_state = asyncio.run(agent.arun_goal("Write a report", app=app, config=config))
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if measure_memory else None
+        tracemalloc.stop()
+
+    thread_id = config["configurable"]["thread_id"]
+    saver.flush()
+    result = {
+        "tasks": tasks,
+        "completed": sum(task["status"] == "complete" for task in final_state["tasks"]),
+        "wall_time_s": elapsed,
+        "peak_memory_bytes": peak,
+        "checkpoints": len(list(saver.list(config))),
+        "checkpoint_bytes": saver.storage_bytes(thread_id),
+        "checkpoint_bytes_written": saver.bytes_written,
+        "llm_calls": llm.calls,
+        "input_tokens": llm.input_tokens,
+        "output_tokens": llm.output_tokens,
+        "searches": tavily.searches + async_tavily.searches,
+        "speculation_hits": final_state.get("speculation_hits", 0),
+        "speculation_misses": final_state.get("speculation_misses", 0),
+        "nodes": timer.summary(),
+    }
+    saver.close()
+    if tracer:
+        tracer.close()
+    return result
+
+
+def run(tasks: int, args: argparse.Namespace) -> dict:
+    """ Timed run plus, unless turned off, a second run measuring peak memory """
+    with tempfile.TemporaryDirectory() as directory:
+        result = run_once(tasks, args, directory)
+        if not args.no_memory:
+            result["peak_memory_bytes"] = run_once(tasks, args, directory, measure_memory=True)["peak_memory_bytes"]
+    return result
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _report(results: list[dict]) -> None:
+    print(f"{'tasks':>5}  {'wall time':>10}  {'per task':>9}  {'peak memory':>11}  {'checkpoints':>11}  {'stored':>9}  {'LLM calls':>9}")
+    for r in results:
+        memory = f"{r['peak_memory_bytes'] / 2**20:.1f}MB" if r["peak_memory_bytes"] is not None else "-"
+        print(f"{r['tasks']:>5}  {r['wall_time_s'] * 1000:>8.0f}ms  {r['wall_time_s'] / r['tasks'] * 1000:>7.2f}ms  {memory:>11}  "
+              f"{r['checkpoints']:>11}  {r['checkpoint_bytes'] / 1024:>7.0f}KB  {r['llm_calls']:>9}")
+        if r.get("speculation_hits") or r.get("speculation_misses"):
+            print(f"{'':>5}  speculation: {r['speculation_hits']} hits, {r['speculation_misses']} misses")
+
+    for r in results:
+        print(f"\nPer node, {r['tasks']} tasks")
+        print(f"{'node':<22}  {'calls':>5}  {'mean':>9}  {'p50':>9}  {'p95':>9}  {'total':>10}")
+        for node, stats in r["nodes"].items():
+            print(f"{node:<22}  {stats['calls']:>5}  {stats['mean_ms']:>7.2f}ms  {stats['p50_ms']:>7.2f}ms  "
+                  f"{stats['p95_ms']:>7.2f}ms  {stats['total_ms']:>8.0f}ms")
+
+
+def _compare(results: list[dict], path: str) -> None:
+    with open(path) as f:
+        before = {r["tasks"]: r for r in json.load(f)["results"]}
+    print(f"\nCompared with {path}")
+    print(f"{'tasks':>5}  {'wall time':>21}  {'peak memory':>21}  {'stored':>19}")
+    for r in results:
+        old = before.get(r["tasks"])
+        if old is None:
+            continue
+        def change(key, scale, unit, digits=0):
+            if old.get(key) is None or r.get(key) is None:
+                return "-"
+            return f"{old[key] * scale:.{digits}f}{unit} -> {r[key] * scale:.{digits}f}{unit} ({(r[key] / old[key] - 1) * 100:+.0f}%)"
+        print(f"{r['tasks']:>5}  {change('wall_time_s', 1000, 'ms'):>21}  {change('peak_memory_bytes', 2**-20, 'MB', 1):>21}  "
+              f"{change('checkpoint_bytes', 2**-10, 'KB'):>19}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, nargs="+", default=[5, 50, 500], help="Plan sizes to run")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated time to first token of every LLM call")
+    parser.add_argument("--token-latency-ms", type=float, default=0.0, help="Simulated time per output token")
+    parser.add_argument("--answer-tokens", type=int, default=50, help="Length of every fake LLM answer in tokens")
+    parser.add_argument("--tool-call-percent", type=int, default=50, help="Share of tasks executed with a web_search tool call")
+    parser.add_argument("--search-latency-ms", type=float, default=0.0, help="Simulated time per web search")
+    parser.add_argument("--result-chars", type=int, default=300, help="Length of every fake search result")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Tasks executed at the same time")
+    parser.add_argument("--reflection-batch-size", type=int, default=1, help="Tasks judged per reflection call (1: one call per task)")
+    parser.add_argument("--reflection-max-wait-s", type=float, default=2.0, help="Longest a partial reflection batch waits for more results")
+    parser.add_argument("--speculate", action="store_true", help="Execute the next tasks while their dependencies are reflected on")
+    parser.add_argument("--trace", metavar="PATH", help="Trace the timed runs to this JSONL file (to measure the tracing overhead)")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the peak memory run")
+    parser.add_argument("--output", default="bench_graph.json", help="JSON file to write the results to")
+    parser.add_argument("--compare", metavar="JSON", help="Earlier results file to compare with")
+    args = parser.parse_args()
+
+    run(5, args)  # Warm-up: imports and first-call costs
+    results = []
+    for tasks in args.tasks:
+        result = run(tasks, args)
+        assert result["completed"] == tasks, f"Only {result['completed']} of {tasks} tasks completed"
+        results.append(result)
+
+    _report(results)
+    if args.compare:
+        _compare(results, args.compare)
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            "results": results,
+        }, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
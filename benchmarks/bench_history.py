@@ -0,0 +1,83 @@
+import argparse
+import contextlib
+import io
+
+import agent
+import history
+
+"""
+Benchmark: prompt tokens per task with and without the history manager.
+
+Builds the conversation history of a synthetic plan (each task: one web search with a realistic result
+and one reflection) and measures the execute_task prompt of every task, plus the final summary prompt,
+once with the full history interpolated (manager disabled) and once rendered by HistoryManager.
+
+Run from the repository root:
+    python -m benchmarks.bench_history --tasks 30 --budget 2000
+"""
+
+SEARCH_RESULT = "\n\n".join(
+    f"{i}. Article {i} about the topic\n   " + "A paragraph of search result content describing the topic in some detail. " * 4
+    + f"\n   Source: https://example.com/{i}"
+    for i in range(1, 4)
+)
+
+
+def synthetic_plan(tasks: int) -> list[dict]:
+    return [
+        {
+            "id": i,
+            "title": f"Research subtopic {i}",
+            "description": f"Search the web for subtopic {i} and note the key facts",
+            "depends_on": [i - 1] if i % 5 == 0 else [],
+            "status": "pending",
+            "result": None,
+            "reflection": None,
+        }
+        for i in range(1, tasks + 1)
+    ]
+
+
+def prompt_tokens_per_task(tasks: list[dict], manager: history.HistoryManager) -> tuple[list[int], int]:
+    """ Run the plan's history forward and measure each execute_task prompt and the final prompt """
+    history.configure_history(budget_tokens=manager.budget_tokens, recent_entries=manager.recent_entries, summary_tokens=manager.summary_tokens)
+    state = {"goal": "Write a report", "tasks": tasks, "conversation_history": ["Goal: Write a report"]}
+
+    per_task = []
+    for task in tasks:
+        state["current_task_id"] = task["id"]
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, entries, prompt = agent.start_task(state)
+        per_task.append(history.count_tokens(prompt))
+
+        # What execute_task and reflect add to the history for this task
+        state["conversation_history"] += entries + [
+            f"Tool 'web_search' executed with arguments {{'query': 'subtopic {task['id']}'}}",
+            f"Result: {SEARCH_RESULT}",
+            f"Reflection on task #{task['id']}: The search for subtopic {task['id']} was successful. Task marked as complete.",
+        ]
+
+    final = history.count_tokens(agent.final_output_prompt(state))
+    return per_task, final
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=30, help="Number of tasks in the synthetic plan")
+    parser.add_argument("--budget", type=int, default=2000, help="History token budget of the manager")
+    args = parser.parse_args()
+
+    tasks = synthetic_plan(args.tasks)
+    without, final_without = prompt_tokens_per_task(tasks, history.HistoryManager(budget_tokens=0))
+    with_manager, final_with = prompt_tokens_per_task(tasks, history.HistoryManager(budget_tokens=args.budget))
+
+    print(f"{'task':>4}  {'without':>8}  {'with':>8}")
+    for task, before, after in zip(tasks, without, with_manager):
+        print(f"{task['id']:>4}  {before:>8}  {after:>8}")
+    print(f"{'final':>4}  {final_without:>8}  {final_with:>8}")
+    print(f"\ntotal prompt tokens: {sum(without) + final_without} without, {sum(with_manager) + final_with} with the manager")
+    print(f"largest prompt:      {max(without + [final_without])} without, {max(with_manager + [final_with])} with the manager")
+
+
+if __name__ == "__main__":
+    main()
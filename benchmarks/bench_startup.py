@@ -0,0 +1,87 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+"""
+Benchmark: CLI startup time, with the import time of every module from `python -X importtime`.
+
+Starts a fresh interpreter per run for each command and reports the median and best wall time:
+- python:           a bare interpreter, the floor
+- main.py --help:   the CLI up to its first output; the agent is not imported
+- import main:      what importing the entry point costs
+- import agent:     the agent module; langgraph, langchain, pydantic, the tools and the clients are imported when a
+                    graph is built or a node runs, not here
+
+Then it lists the modules with the largest cumulative import time of one command (`--profile`, default: import agent)
+and checks `main.py --help` and `import agent` against their budgets, exiting with status 1 if either is over.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup --runs 10 --budget-ms 250 --agent-budget-ms 300
+"""
+
+COMMANDS = {
+    "python": ["-c", "pass"],
+    "main.py --help": ["main.py", "--help"],
+    "import main": ["-c", "import main"],
+    "import agent": ["-c", "import agent"],
+}
+
+
+def wall_times(args: list[str], runs: int) -> list[float]:
+    """ Wall time in seconds of `runs` fresh interpreters running args """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], check=True, capture_output=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def import_times(args: list[str]) -> list[tuple[str, int, int]]:
+    """ (module, self us, cumulative us) of every module imported by one interpreter running args, from -X importtime """
+    result = subprocess.run([sys.executable, "-X", "importtime", *args], check=True, capture_output=True, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Interpreters started per command")
+    parser.add_argument("--budget-ms", type=float, default=250, help="Startup budget of main.py --help (median wall time)")
+    parser.add_argument("--agent-budget-ms", type=float, default=300, help="Budget of import agent (median wall time)")
+    parser.add_argument("--profile", default="import agent", choices=COMMANDS, help="Command whose slowest imports are listed")
+    parser.add_argument("--top", type=int, default=15, help="Number of modules listed")
+    args = parser.parse_args()
+
+    medians = {}
+    print(f"{'command':<16}  {'median':>8}  {'best':>8}")
+    for name, command in COMMANDS.items():
+        times = wall_times(command, args.runs)
+        medians[name] = statistics.median(times)
+        print(f"{name:<16}  {medians[name] * 1000:>6.0f}ms  {min(times) * 1000:>6.0f}ms")
+
+    modules = import_times(COMMANDS[args.profile])
+    print(f"\nSlowest imports of '{args.profile}' (cumulative, -X importtime):")
+    for name, self_us, cumulative_us in sorted(modules, key=lambda module: -module[2])[:args.top]:
+        print(f"  {name:<48}  {cumulative_us / 1000:>7.1f}ms  (self {self_us / 1000:.1f}ms)")
+
+    print()
+    over = False
+    for name, budget_ms in (("main.py --help", args.budget_ms), ("import agent", args.agent_budget_ms)):
+        median_ms = medians[name] * 1000
+        verdict = "within" if median_ms <= budget_ms else "OVER"
+        print(f"{name}: {median_ms:.0f}ms, {verdict} the {budget_ms:.0f}ms budget")
+        over |= median_ms > budget_ms
+    if over:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+
+from workspace_index import WorkspaceIndex, required_words, words
+
+"""
+Benchmark: search_workspace query latency with the inverted index vs. a full streaming scan.
+
+Builds a synthetic workspace of text files (notes made of a shared vocabulary plus a few rare words per file),
+indexes it once, and times keyword and regex queries with WorkspaceIndex.search() and with a plain scan of
+every file, which is what the tool would cost without the index.
+
+Run from the repository root:
+    python -m benchmarks.bench_workspace --files 10000
+"""
+
+COMMON = ("the task report result search summary data source value market growth analysis research "
+          "project deadline budget customer product team review draft final notes section").split()
+
+
+def build_workspace(root: str, files: int, lines: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    for i in range(files):
+        directory = os.path.join(root, f"dir{i % 100}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"note{i}.md"), "w", encoding="utf-8") as f:
+            for line in range(lines):
+                text = " ".join(rng.choice(COMMON) for _ in range(10))
+                if line == lines // 2:
+                    text += f" marker{i} ticket-{i * 7}"
+                f.write(text + "\n")
+
+
+def full_scan(root: str, pattern: re.Pattern, max_results: int) -> int:
+    matches = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            with open(os.path.join(directory, name), encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    if pattern.search(line):
+                        matches += 1
+    return min(matches, max_results)
+
+
+def timed(function, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=10000, help="Number of files in the workspace")
+    parser.add_argument("--lines", type=int, default=20, help="Lines per file")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query (the median is reported)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        build_workspace(root, args.files, args.lines)
+        # The stat walk is only repeated every rescan_interval seconds; a long interval times the index itself
+        index = WorkspaceIndex(root, rescan_interval=3600)
+        start = time.perf_counter()
+        index.refresh(force=True)
+        index.reindex()
+        print(f"Indexed {args.files} files in {(time.perf_counter() - start) * 1000:.0f}ms: {index.stats()}")
+
+        target = args.files // 2
+        queries = [
+            ("keyword, rare", f"marker{target}", False),
+            ("keyword, two words", f"marker{target} ticket", False),
+            ("regex, with a word", rf"ticket-{target * 7}\b", True),
+            ("regex, \\b-bounded", rf"\bmarker{target}\b", True),
+        ]
+        print(f"\n{'query':<22}  {'indexed':>9}  {'full scan':>10}  {'files read':>10}")
+        for label, query, regex in queries:
+            matches, _ = index.search(query, regex=regex)
+            assert matches, f"{label}: expected a match"
+            indexed = timed(lambda: index.search(query, regex=regex), args.repeat)
+            pattern = re.compile(query if regex else "|".join(re.escape(word) for word in query.split()), 0 if regex else re.IGNORECASE)
+            scan = timed(lambda: full_scan(root, pattern, 20), max(1, args.repeat // 2))
+            files_read = len(index.candidates(_required(query, regex)))
+            print(f"{label:<22}  {indexed:>7.2f}ms  {scan:>8.0f}ms  {files_read:>10}")
+
+        start = time.perf_counter()
+        index.refresh(force=True)
+        print(f"\nStat walk looking for files changed outside the agent (at most once per rescan_interval): "
+              f"{(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+def _required(query: str, regex: bool):
+    return required_words(query) if regex else [(word, True, True) for word in words(query)]
+
+
+if __name__ == "__main__":
+    main()
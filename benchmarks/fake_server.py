@@ -0,0 +1,172 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Local fake HTTP endpoint that speaks just enough of the OpenAI and Tavily APIs for benchmarks.
+
+- POST /chat/completions (and /v1/chat/completions) returns a fixed assistant message, or for structured output
+  (a json_schema response_format) a JSON object of that schema filled with fixed values.
+- POST /search returns three fixed search results.
+
+`handshake_delay` is slept once per new TCP connection to stand in for the TLS handshake a real
+HTTPS endpoint costs; `latency` is slept once per request to stand in for server time, or `model_latency[model]`
+for the models it lists. The model of every chat request is recorded in `models`.
+`responder` optionally builds the assistant message from the request body, e.g. to answer with tool calls.
+
+To stand in for a provider's rate limits, the first `reject_first` requests and every request beyond `max_in_flight`
+concurrent ones are answered with 429 and a Retry-After of `retry_after` seconds; `rejected` counts them.
+"""
+
+
+def _chat_completion(model: str, message: dict) -> dict:
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if message.get("tool_calls") else "stop",
+        }],
+        "usage": {"prompt_tokens": 12, "completion_tokens": 4, "total_tokens": 16},
+    }
+
+
+def _example(schema: dict, defs: dict):
+    """ Fixed value of a JSON schema: the first enum value, the fixed message for strings, empty lists ... """
+    if "$ref" in schema:
+        return _example(defs[schema["$ref"].rsplit("/", 1)[-1]], defs)
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: _example(prop, defs) for name, prop in schema.get("properties", {}).items()}
+    return {"array": [], "integer": 0, "number": 0, "boolean": True}.get(kind, "Task completed successfully.")
+
+
+def default_responder(body: dict) -> dict:
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"]["schema"]
+        return {"role": "assistant", "content": json.dumps(_example(schema, schema.get("$defs", {})))}
+    return {"role": "assistant", "content": "Task completed successfully."}
+
+
+def _search_results(query: str) -> dict:
+    return {
+        "query": query,
+        "results": [
+            {"title": f"Result {i} for {query}", "content": "Fake content.", "url": f"https://example.com/{i}"}
+            for i in range(1, 4)
+        ],
+    }
+
+
+class FakeServer:
+    """ Threaded fake endpoint, usable as a context manager. `base_url` is valid once started. """
+
+    def __init__(self, latency: float = 0.0, handshake_delay: float = 0.0, responder=default_responder,
+                 model_latency: dict[str, float] | None = None, reject_first: int = 0, max_in_flight: int | None = None,
+                 retry_after: float = 0.0):
+        self.latency = latency
+        self.reject_first = reject_first
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.rejected = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self.model_latency = model_latency or {}
+        self.models: list[str] = []
+        self.handshake_delay = handshake_delay
+        self.responder = responder
+        self.connections = 0
+        self.requests = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, so pooled clients can reuse the connection
+            disable_nagle_algorithm = True  # Otherwise delayed ACKs add ~40 ms to every reused connection
+
+            def setup(self):
+                super().setup()
+                server.connections += 1
+                time.sleep(server.handshake_delay)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    limited = server.requests <= server.reject_first or (
+                        server.max_in_flight is not None and server.in_flight > server.max_in_flight)
+                    server.rejected += limited
+                try:
+                    if limited:
+                        self._send(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"},
+                                         "detail": {"error": "Rate limit reached"}}, {"Retry-After": str(server.retry_after)})
+                    else:
+                        self._respond(body)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def _respond(self, body: dict):
+                if "model" in body:
+                    server.models.append(body["model"])
+                time.sleep(server.model_latency.get(body.get("model"), server.latency))
+
+                if self.path.endswith("/chat/completions"):
+                    payload = _chat_completion(body.get("model", "fake"), server.responder(body))
+                elif self.path.endswith("/search"):
+                    payload = _search_results(body.get("query", ""))
+                else:
+                    self.send_error(404)
+                    return
+
+                self._send(200, payload)
+
+            def _send(self, status: int, payload: dict, headers: dict | None = None):
+                data = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    for name, value in (headers or {}).items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(data)
+                except ConnectionError:
+                    pass  # The client gave up waiting (e.g. a timeout)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
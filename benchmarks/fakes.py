@@ -0,0 +1,222 @@
+import asyncio
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from typing import Any
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+import clients
+import schemas
+import tools
+
+"""
+Scripted offline stand-ins for the chat model and the Tavily clients, for benchmarks.
+
+- ScriptedChatModel: a real chat model (callbacks, streaming and usage metadata work as with ChatOpenAI) that
+  answers structured to-do list calls with a fixed plan, structured reflections with "successful" verdicts, answers some execution prompts with a web_search tool call
+  and everything else with a fixed text. Latency per call and per output token, and the answer length, are configurable.
+- FakeTavilyClient / AsyncFakeTavilyClient: search backends returning three results after a configurable latency.
+- synthetic_plan(): plans of any size, in chains of three dependent tasks.
+- offline(): patches the agent to use the fakes.
+
+Nothing here touches the network, so a run measures the graph's own overhead plus the simulated latencies.
+"""
+
+_TITLE = re.compile(r"Title: (.*)")
+_TASK_ID = re.compile(r"Task #(\d+)")
+_counter_lock = threading.Lock()
+
+
+def synthetic_plan(tasks: int) -> schemas.TodoListSchema:
+    """ Plan of `tasks` tasks in chains of three dependent tasks, so the plan runs in several waves """
+    return schemas.TodoListSchema(tasks=[
+        schemas.TaskSchema(id=i, title=f"Research subtopic {i}", description=f"Search the web for subtopic {i}",
+                         depends_on=[i - 1] if i % 3 != 1 else [])
+        for i in range(1, tasks + 1)
+    ])
+
+
+def answer_text(tokens: int) -> str:
+    """ A successful task answer of about `tokens` tokens (one token per word) """
+    words = "It produced a detailed answer covering the subtopic.".split()
+    return " ".join(["The", "task", "was", "successful."] + [words[i % len(words)] for i in range(max(0, tokens - 4))])
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Offline chat model with scripted answers.
+
+    Args:
+        plan: Returned by with_structured_output(TodoListSchema).invoke(); reflections get "successful" verdicts
+            explaining the text answer
+        latency: Seconds before the first token of every call
+        token_latency: Seconds per output token
+        answer_tokens: Length of every text answer in tokens (one word each)
+        answer: Text answer to use instead of the generated one
+        tool_call_percent: Share of tasks whose execution prompt is answered with a web_search tool call
+    """
+    plan: Any = None
+    latency: float = 0.0
+    token_latency: float = 0.0
+    answer_tokens: int = 50
+    answer: str | None = None
+    tool_call_percent: int = 0
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake"
+
+    def with_structured_output(self, schema, **kwargs):
+        if schema in (schemas.ReflectionSchema, schemas.BatchReflectionSchema):
+            return RunnableLambda(lambda prompt: verdict(schema, prompt, self.invoke(prompt)),
+                                  afunc=lambda prompt: averdict(schema, prompt, self.ainvoke(prompt)))
+
+        def structured(prompt):
+            self._count(prompt, 0)
+            time.sleep(self.latency)
+            return self.plan
+
+        async def astructured(prompt):
+            self._count(prompt, 0)
+            await asyncio.sleep(self.latency)
+            return self.plan
+
+        return RunnableLambda(structured, afunc=astructured)
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _respond(self, messages) -> tuple[AIMessage, int]:
+        """ The scripted answer for a prompt and its length in tokens """
+        prompt = "\n".join(str(message.content) for message in messages)
+        title = _TITLE.search(prompt)
+        if title and prompt.startswith("Execute this task") and zlib.crc32(title.group(1).encode()) % 100 < self.tool_call_percent:
+            call = {"name": "web_search", "args": {"query": title.group(1)}, "id": f"call_{zlib.crc32(prompt.encode()):x}", "type": "tool_call"}
+            message, tokens = AIMessage(content="", tool_calls=[call]), 10
+        else:
+            text = self.answer if self.answer is not None else answer_text(self.answer_tokens)
+            message, tokens = AIMessage(content=text), len(text.split())
+        input_tokens = self._count(prompt, tokens)
+        message.usage_metadata = {"input_tokens": input_tokens, "output_tokens": tokens, "total_tokens": input_tokens + tokens}
+        return message, tokens
+
+    def _count(self, prompt, output_tokens: int) -> int:
+        input_tokens = len(str(prompt)) // 4
+        with _counter_lock:
+            self.calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+        return input_tokens
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message, tokens = self._respond(messages)
+        time.sleep(self.latency + self.token_latency * tokens)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message, tokens = self._respond(messages)
+        await asyncio.sleep(self.latency + self.token_latency * tokens)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        message, _ = self._respond(messages)
+        time.sleep(self.latency)
+        for chunk in self._chunks(message):
+            time.sleep(self.token_latency)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        message, _ = self._respond(messages)
+        await asyncio.sleep(self.latency)
+        for chunk in self._chunks(message):
+            await asyncio.sleep(self.token_latency)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    @staticmethod
+    def _chunks(message: AIMessage) -> list[ChatGenerationChunk]:
+        if message.tool_calls:
+            chunks = [AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}
+                for call in message.tool_calls
+            ])]
+        else:
+            words = message.content.split(" ")
+            chunks = [AIMessageChunk(content=word if i == 0 else " " + word) for i, word in enumerate(words)]
+        chunks[-1].usage_metadata = message.usage_metadata
+        return [ChatGenerationChunk(message=chunk) for chunk in chunks]
+
+
+def verdict(schema, prompt: str, message: AIMessage):
+    """ "successful" verdict explaining the text answer; one per task id for batched reflections """
+    if schema is schemas.BatchReflectionSchema:
+        return schemas.BatchReflectionSchema(verdicts=[
+            schemas.TaskVerdictSchema(task_id=int(task_id), status="successful", explanation=message.content)
+            for task_id in _TASK_ID.findall(prompt)
+        ])
+    return schemas.ReflectionSchema(status="successful", explanation=message.content)
+
+
+async def averdict(schema, prompt: str, message):
+    return verdict(schema, prompt, await message)
+
+
+class FakeTavilyClient:
+    """ Stand-in for TavilyClient: three results of `result_chars` characters each after `latency` seconds """
+    def __init__(self, latency: float = 0.0, result_chars: int = 300):
+        self.latency = latency
+        self.content = ("Search result content describing the subtopic in some detail. " * (result_chars // 63 + 1))[:result_chars]
+        self.searches = 0
+
+    def _results(self, query: str) -> dict:
+        with _counter_lock:
+            self.searches += 1
+        return {
+            "query": query,
+            "results": [
+                {"title": f"Article {i} about {query}", "content": self.content, "url": f"https://example.com/{i}"}
+                for i in range(1, 4)
+            ],
+        }
+
+    def search(self, query: str, max_results: int = 3, **kwargs) -> dict:
+        time.sleep(self.latency)
+        return self._results(query)
+
+
+class AsyncFakeTavilyClient(FakeTavilyClient):
+    """ Stand-in for AsyncTavilyClient """
+    async def search(self, query: str, max_results: int = 3, **kwargs) -> dict:
+        await asyncio.sleep(self.latency)
+        return self._results(query)
+
+
+@contextlib.contextmanager
+def offline(llm, search_latency: float = 0.0, result_chars: int = 300):
+    """ Run the agent against llm and the fake search backends. Yields the sync and async fake Tavily clients """
+    tavily, async_tavily = FakeTavilyClient(search_latency, result_chars), AsyncFakeTavilyClient(search_latency, result_chars)
+    originals = clients.get_llm, tools.get_tavily_client, tools.get_async_tavily_client
+    original_key = os.environ.get("TAVILY_API_KEY")
+    clients.get_llm = lambda *args, **kwargs: llm
+    tools.get_tavily_client, tools.get_async_tavily_client = (lambda: tavily), (lambda: async_tavily)
+    os.environ["TAVILY_API_KEY"] = original_key or "fake"
+    try:
+        yield tavily, async_tavily
+    finally:
+        clients.get_llm, tools.get_tavily_client, tools.get_async_tavily_client = originals
+        if original_key is None:
+            os.environ.pop("TAVILY_API_KEY", None)
@@ -0,0 +1,579 @@
+from __future__ import annotations
+
+import asyncio
+import atexit
+import collections
+import copy
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Iterator, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+
+"""
+Durable checkpointer for the agent graph.
+
+The graph used to be compiled with MemorySaver, so a crash or restart in the middle of a plan lost every completed
+task and all of them were executed (and billed) again. SQLiteCheckpointSaver keeps checkpoints in a SQLite database
+in WAL mode; a thread can be resumed from its last super-step with agent.aresume_goal() or `python main.py --resume <thread id>`.
+Tasks already marked complete are not executed again, and neither are parallel branches that finished
+before the crash, since their writes are saved as pending writes of the interrupted super-step.
+
+Writes are batched: put() and put_writes() only serialize the changed channels and queue the rows, and a background
+writer commits everything queued in one transaction every `flush_interval` seconds (group commit). Reads flush first,
+so they always see every write. A hard crash loses at most the writes of the last `flush_interval` seconds,
+which at worst means the last super-step runs again. flush_interval=0 commits every write before returning.
+A failed commit keeps its writes queued in order: the writer retries them, and a flush(), read or close() that
+cannot commit them either raises the error.
+
+Storage follows MemorySaver: one row per checkpoint, one blob per channel version (so only channels that changed
+in a step are written) and one row per pending write.
+
+List channels (conversation_history, tasks) grow with every step, and storing them whole made checkpoint storage grow
+with steps x history. They are delta-encoded instead:
+- Every list element is stored once per thread, in the elements table, under the hash of its serialized content.
+  Long strings inside dict elements (task results, reflections) are stored as elements of their own, so a task
+  whose status changes does not store its result again.
+- A channel version stores a manifest of element hashes: a keyframe with every hash, or a delta holding only the
+  positions that changed since the previous version of the channel, plus the new length.
+- Every `keyframe_interval` versions a keyframe is written, so reading a version applies a bounded number of deltas.
+- compact() drops all but the latest checkpoints of a thread, rewrites the deltas they still need as keyframes and
+  deletes the elements nothing refers to any more. With `keep_checkpoints` set it runs periodically on its own.
+"""
+
+DEFAULT_CHECKPOINT_PATH = os.path.join(".agent-cache", "checkpoints.sqlite")
+
+_KEYFRAME, _DELTA = "list-keyframe", "list-delta"  # Blob types of delta-encoded list channels
+_LARGE_VALUE = "\x00element:"  # Prefix of a long string stored as an element of its own
+
+_ChannelState = collections.namedtuple("_ChannelState", "version values hashes depth")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, parent_checkpoint_id TEXT,
+    type TEXT NOT NULL, checkpoint BLOB NOT NULL, metadata_type TEXT NOT NULL, metadata BLOB NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, channel TEXT NOT NULL, version TEXT NOT NULL,
+    type TEXT NOT NULL, blob BLOB NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS elements (
+    thread_id TEXT NOT NULL, hash TEXT NOT NULL, type TEXT NOT NULL, blob BLOB NOT NULL,
+    PRIMARY KEY (thread_id, hash)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL, channel TEXT NOT NULL, type TEXT NOT NULL, blob BLOB NOT NULL, task_path TEXT NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+class SQLiteCheckpointSaver(BaseCheckpointSaver[str]):
+    """
+    LangGraph checkpointer backed by a SQLite database (WAL mode), with batched writes.
+
+    Args:
+        path: Database file
+        flush_interval: Seconds queued writes wait for more writes before they are committed together.
+            0 commits every write before put() returns
+        delta: Delta-encode list channels. False stores every channel version whole
+        keyframe_interval: A list channel gets a full keyframe at least every this many versions
+        large_value_chars: Strings at least this long inside dict elements are stored as elements of their own
+        keep_checkpoints: If set, threads are compacted every keyframe_interval checkpoints, keeping only this many
+            latest checkpoints. None keeps the full history (e.g. for time travel)
+        serde: Serializer for checkpoints and writes, LangGraph's default if not given
+    """
+
+    def __init__(self, path: str = DEFAULT_CHECKPOINT_PATH, flush_interval: float = 0.05, delta: bool = True,
+                 keyframe_interval: int = 16, large_value_chars: int = 256, keep_checkpoints: int | None = None, serde=None):
+        super().__init__(serde=serde)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval
+        self.large_value_chars = large_value_chars
+        self.keep_checkpoints = keep_checkpoints
+        self.flushes = 0
+        self.bytes_written = 0  # Serialized bytes queued for storage, for benchmarks and monitoring
+        self._channels: collections.OrderedDict[tuple, _ChannelState] = collections.OrderedDict()  # Last stored version of each list channel
+        self._known_elements: collections.OrderedDict[str, set[str]] = collections.OrderedDict()  # Element hashes stored per thread
+        self._channels_lock = threading.Lock()
+        self._puts_per_thread: collections.Counter = collections.Counter()
+        self._pending: list[tuple[str, tuple]] = []  # Queued (sql, params) rows
+        self._lock = threading.Lock()  # Guards _pending
+        self._db_lock = threading.Lock()  # Guards the connection
+        self._wake = threading.Condition(self._lock)
+        self._closed = False
+        self._error: Exception | None = None  # Why the background writer's last flush failed, while its rows are queued again
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+        self._writer = None
+        if flush_interval > 0:
+            self._writer = threading.Thread(target=self._write_loop, name="checkpoint-writer", daemon=True)
+            self._writer.start()
+        atexit.register(self.close)
+
+    # Batched writes
+
+    def _queue(self, rows: list[tuple[str, tuple]]) -> None:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The checkpointer is closed")
+            self._pending.extend(rows)
+            self._wake.notify()
+        if self._writer is None:
+            self.flush()
+
+    def _write_loop(self) -> None:
+        """ Background writer: once rows are queued, wait flush_interval for more and commit them together """
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._wake.wait()
+                if self._closed:
+                    return
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                # The rows are queued again: the writer retries them, and the next flush(), read or close() raises the error
+                if self._error is None:
+                    print(f"Error: could not write checkpoints to '{self.path}', retrying: {type(e).__name__}: {e}")
+                self._error = e
+
+    def flush(self) -> None:
+        """ Commit every queued write in one transaction. If that fails the writes stay queued and the error is raised """
+        with self._db_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return
+            try:
+                self._conn.execute("BEGIN")
+                for sql, params in rows:
+                    self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                with self._lock:
+                    self._pending[:0] = rows  # In front of the rows queued since, so they are written in order
+                raise
+            self._error = None
+            self.flushes += 1
+
+    def close(self) -> None:
+        """ Commit queued writes, stop the writer and close the database """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wake.notify()
+        if self._writer is not None:
+            self._writer.join()
+        try:
+            self.flush()
+        finally:
+            with self._db_lock:
+                self._conn.close()
+            atexit.unregister(self.close)
+
+    def _query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def thread_ids(self) -> list[str]:
+        """ Ids of every thread with a checkpoint, most recently started first """
+        self.flush()
+        rows = self._query("SELECT thread_id, MIN(checkpoint_id) AS started FROM checkpoints GROUP BY thread_id ORDER BY started DESC")
+        return [row[0] for row in rows]
+
+    # BaseCheckpointSaver interface
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        """ Queue a checkpoint. Only the channels in new_versions are serialized and stored """
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint = checkpoint.copy()
+        values: dict[str, Any] = checkpoint.pop("channel_values")
+
+        rows = []
+        for channel, version in new_versions.items():
+            if channel not in values:
+                rows.append(self._blob_row(thread_id, checkpoint_ns, channel, version, "empty", b""))
+            elif self.delta and isinstance(values[channel], list):
+                rows += self._encode_list(thread_id, checkpoint_ns, channel, str(version), values[channel])
+            else:
+                rows.append(self._blob_row(thread_id, checkpoint_ns, channel, version, *self.serde.dumps_typed(values[channel])))
+        type_, serialized = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        rows.append(("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                      type_, serialized, metadata_type, serialized_metadata)))
+        self.bytes_written += len(serialized) + len(serialized_metadata)
+        self._queue(rows)
+
+        if self.keep_checkpoints is not None:
+            self._puts_per_thread[thread_id] += 1
+            if self._puts_per_thread[thread_id] % self.keyframe_interval == 0:
+                self.compact(thread_id, self.keep_checkpoints)
+
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        """ Queue the writes of a task, e.g. the result of one parallel branch of a super-step """
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+
+        rows = []
+        for index, (channel, value) in enumerate(writes):
+            idx = WRITES_IDX_MAP.get(channel, index)
+            # Special writes (errors, interrupts) replace earlier ones, regular writes are saved once
+            verb = "INSERT OR REPLACE" if idx < 0 else "INSERT OR IGNORE"
+            type_, blob = self.serde.dumps_typed(value)
+            self.bytes_written += len(blob)
+            rows.append((f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type_, blob, task_path)))
+        self._queue(rows)
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        """ Return the checkpoint given by config, or the latest checkpoint of its thread """
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        sql = "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+        self.flush()
+        if checkpoint_id:
+            rows = self._query(sql + " AND checkpoint_id = ?", (thread_id, checkpoint_ns, checkpoint_id))
+        else:
+            rows = self._query(sql + " ORDER BY checkpoint_id DESC LIMIT 1", (thread_id, checkpoint_ns))
+        return self._load_tuple(rows[0]) if rows else None
+
+    def list(self, config: RunnableConfig | None, *, filter: dict[str, Any] | None = None,
+             before: RunnableConfig | None = None, limit: int | None = None) -> Iterator[CheckpointTuple]:
+        """ Checkpoints matching config, newest first """
+        conditions, params = [], []
+        if config:
+            conditions.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                conditions.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+            if get_checkpoint_id(config):
+                conditions.append("checkpoint_id = ?")
+                params.append(get_checkpoint_id(config))
+        if before and get_checkpoint_id(before):
+            conditions.append("checkpoint_id < ?")
+            params.append(get_checkpoint_id(before))
+        self.flush()
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._query(f"SELECT * FROM checkpoints {where} ORDER BY checkpoint_id DESC", tuple(params))
+
+        for row in rows:
+            if limit is not None and limit <= 0:
+                break
+            if filter:
+                metadata = self.serde.loads_typed((row[6], row[7]))
+                if not all(metadata.get(key) == value for key, value in filter.items()):
+                    continue
+            if limit is not None:
+                limit -= 1
+            yield self._load_tuple(row)
+
+    def _load_tuple(self, row: tuple) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type_, serialized, metadata_type, metadata = row
+        checkpoint = self.serde.loads_typed((type_, serialized))
+
+        channel_values = {}
+        for channel, version in checkpoint["channel_versions"].items():
+            blob = self._blob(thread_id, checkpoint_ns, channel, str(version))
+            if blob is None or blob[0] == "empty":
+                continue
+            if blob[0] in (_KEYFRAME, _DELTA):
+                hashes = self._manifest_hashes(thread_id, checkpoint_ns, channel, str(version))
+                channel_values[channel] = self._load_elements(thread_id, hashes)
+            else:
+                channel_values[channel] = self.serde.loads_typed(blob)
+
+        writes = self._query("SELECT task_id, idx, channel, type, blob, task_path FROM writes "
+                             "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                             (thread_id, checkpoint_ns, checkpoint_id))
+        writes.sort(key=lambda write: writes_sort_key(write[5], write[0], write[1]))
+
+        def config_for(id_: str) -> RunnableConfig:
+            return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": id_}}
+
+        return CheckpointTuple(
+            config=config_for(checkpoint_id),
+            checkpoint={**checkpoint, "channel_values": channel_values},
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=config_for(parent_checkpoint_id) if parent_checkpoint_id else None,
+            pending_writes=[(task_id, channel, self.serde.loads_typed((type_, blob))) for task_id, _, channel, type_, blob, _ in writes],
+        )
+
+    def delete_thread(self, thread_id: str) -> None:
+        """ Delete every checkpoint and write of a thread """
+        self._forget_channels(thread_id)
+        self._queue([(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,)) for table in ("checkpoints", "blobs", "writes", "elements")])
+
+    def get_next_version(self, current: str | None, channel: None) -> str:
+        """ Same version format as MemorySaver: a zero-padded counter (sortable as text) plus a random part """
+        current_v = 0 if current is None else current if isinstance(current, int) else int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # Delta-encoded list channels
+
+    def _blob_row(self, thread_id: str, checkpoint_ns: str, channel: str, version, type_: str, blob: bytes) -> tuple[str, tuple]:
+        self.bytes_written += len(blob)
+        return "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", (thread_id, checkpoint_ns, channel, str(version), type_, blob)
+
+    def _encode_list(self, thread_id: str, checkpoint_ns: str, channel: str, version: str, value: list) -> list[tuple[str, tuple]]:
+        """ Rows storing a list channel version: its new elements and a keyframe or delta manifest """
+        key = (thread_id, checkpoint_ns, channel)
+        with self._channels_lock:
+            previous = self._channels.get(key)
+
+        # Elements equal to the previous version's element at the same position keep their hash and are not stored again.
+        # The previous values are deep copies, so elements changed in place are still detected
+        rows, hashes, snapshot = [], [], []
+        for index, item in enumerate(value):
+            if previous is not None and index < len(previous.values) and item == previous.values[index]:
+                hashes.append(previous.hashes[index])
+                snapshot.append(previous.values[index])
+            else:
+                hashes.append(self._encode_element(thread_id, item, rows))
+                snapshot.append(copy.deepcopy(item))
+
+        if previous is None or previous.depth + 1 >= self.keyframe_interval:
+            type_, manifest, depth = _KEYFRAME, {"hashes": hashes}, 0
+        else:
+            changes = [[index, handle] for index, handle in enumerate(hashes)
+                       if index >= len(previous.hashes) or previous.hashes[index] != handle]
+            type_, manifest, depth = _DELTA, {"base": previous.version, "length": len(hashes), "changes": changes}, previous.depth + 1
+        rows.append(self._blob_row(thread_id, checkpoint_ns, channel, version, type_, json.dumps(manifest, separators=(",", ":")).encode()))
+
+        with self._channels_lock:
+            self._channels[key] = _ChannelState(version, snapshot, hashes, depth)
+            self._channels.move_to_end(key)
+            while len(self._channels) > 1024:  # Bounded over many threads; a forgotten channel starts with a keyframe
+                self._channels.popitem(last=False)
+        return rows
+
+    def _encode_element(self, thread_id: str, item, rows: list) -> str:
+        """ Queue an element (and the long strings inside it) for storage, unless it is stored already, and return its hash """
+        if isinstance(item, dict):
+            item = {key: _LARGE_VALUE + self._encode_element(thread_id, value, rows) if self._is_large(value) else value
+                    for key, value in item.items()}
+        type_, blob = self.serde.dumps_typed(item)
+        handle = hashlib.blake2b(type_.encode() + b"\0" + blob, digest_size=16).hexdigest()
+
+        with self._channels_lock:
+            known = self._known_elements.setdefault(thread_id, set())
+            self._known_elements.move_to_end(thread_id)
+            while len(self._known_elements) > 64:
+                self._known_elements.popitem(last=False)
+            if handle in known:
+                return handle
+            known.add(handle)
+        rows.append(("INSERT OR IGNORE INTO elements VALUES (?, ?, ?, ?)", (thread_id, handle, type_, blob)))
+        self.bytes_written += len(blob)
+        return handle
+
+    def _is_large(self, value) -> bool:
+        return isinstance(value, str) and len(value) >= self.large_value_chars
+
+    def _blob(self, thread_id: str, checkpoint_ns: str, channel: str, version: str) -> tuple[str, bytes] | None:
+        rows = self._query("SELECT type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                           (thread_id, checkpoint_ns, channel, version))
+        return rows[0] if rows else None
+
+    def _manifest_hashes(self, thread_id: str, checkpoint_ns: str, channel: str, version: str) -> list[str]:
+        """ Element hashes of a list channel version: the nearest keyframe with the deltas after it applied """
+        chain = []
+        while True:
+            blob = self._blob(thread_id, checkpoint_ns, channel, version)
+            if blob is None:
+                raise ValueError(f"Checkpoint blob {channel}@{version} of thread '{thread_id}' is missing")
+            manifest = json.loads(blob[1])
+            if blob[0] == _KEYFRAME:
+                hashes = manifest["hashes"]
+                break
+            chain.append(manifest)
+            version = manifest["base"]
+
+        for delta in reversed(chain):
+            hashes = hashes[:delta["length"]] + [None] * (delta["length"] - len(hashes))
+            for index, handle in delta["changes"]:
+                hashes[index] = handle
+        return hashes
+
+    def _load_elements(self, thread_id: str, hashes: list[str]) -> list:
+        """ Load and deserialize elements by hash, restoring the long strings stored separately """
+        stored = {}
+        unique = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            stored.update((handle, (type_, blob)) for handle, type_, blob in self._query(
+                f"SELECT hash, type, blob FROM elements WHERE thread_id = ? AND hash IN ({','.join('?' * len(batch))})",
+                (thread_id, *batch)))
+
+        def load(handle: str):
+            item = self.serde.loads_typed(stored[handle] if handle in stored else self._element(thread_id, handle))
+            if isinstance(item, dict):
+                item = {key: load(value[len(_LARGE_VALUE):]) if isinstance(value, str) and value.startswith(_LARGE_VALUE) else value
+                        for key, value in item.items()}
+            return item
+
+        return [load(handle) for handle in hashes]
+
+    def _element(self, thread_id: str, handle: str) -> tuple[str, bytes]:
+        rows = self._query("SELECT type, blob FROM elements WHERE thread_id = ? AND hash = ?", (thread_id, handle))
+        if not rows:
+            raise ValueError(f"Checkpoint element {handle} of thread '{thread_id}' is missing")
+        return rows[0]
+
+    def _forget_channels(self, thread_id: str) -> None:
+        """ Drop the in-memory state of a thread's list channels; their next versions start with a keyframe """
+        with self._channels_lock:
+            for key in [key for key in self._channels if key[0] == thread_id]:
+                del self._channels[key]
+            self._known_elements.pop(thread_id, None)
+
+    def compact(self, thread_id: str, keep_last: int = 1) -> None:
+        """
+        Delete all but the keep_last latest checkpoints of a thread (per namespace), together with their writes.
+        Deltas the kept checkpoints still need are rewritten as keyframes, then blobs and elements
+        nothing refers to any more are deleted. The kept checkpoints stay fully readable.
+        """
+        self.flush()
+        self._forget_channels(thread_id)
+        rows = self._query("SELECT checkpoint_ns, checkpoint_id, type, checkpoint FROM checkpoints "
+                           "WHERE thread_id = ? ORDER BY checkpoint_ns, checkpoint_id DESC", (thread_id,))
+        kept_per_ns: dict[str, list] = collections.defaultdict(list)
+        dropped = []
+        for checkpoint_ns, checkpoint_id, type_, serialized in rows:
+            if len(kept_per_ns[checkpoint_ns]) < keep_last:
+                kept_per_ns[checkpoint_ns].append(self.serde.loads_typed((type_, serialized)))
+            else:
+                dropped.append((checkpoint_ns, checkpoint_id))
+
+        kept_blobs = {(checkpoint_ns, channel, str(version))
+                      for checkpoint_ns, checkpoints in kept_per_ns.items()
+                      for checkpoint in checkpoints for channel, version in checkpoint["channel_versions"].items()}
+        statements = []
+        referenced = set()
+        for checkpoint_ns, channel, version in kept_blobs:
+            blob = self._blob(thread_id, checkpoint_ns, channel, version)
+            if blob is None or blob[0] not in (_KEYFRAME, _DELTA):
+                continue
+            hashes = self._manifest_hashes(thread_id, checkpoint_ns, channel, version)
+            referenced.update(hashes)
+            if blob[0] == _DELTA:
+                keyframe = json.dumps({"hashes": hashes}, separators=(",", ":")).encode()
+                statements.append(("UPDATE blobs SET type = ?, blob = ? WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                                   (_KEYFRAME, keyframe, thread_id, checkpoint_ns, channel, version)))
+
+        # Long strings referenced from inside the kept elements
+        for handle in list(referenced):
+            item = self.serde.loads_typed(self._element(thread_id, handle))
+            if isinstance(item, dict):
+                referenced.update(value[len(_LARGE_VALUE):] for value in item.values()
+                                  if isinstance(value, str) and value.startswith(_LARGE_VALUE))
+
+        stored_blobs = self._query("SELECT checkpoint_ns, channel, version FROM blobs WHERE thread_id = ?", (thread_id,))
+        stored_elements = self._query("SELECT hash FROM elements WHERE thread_id = ?", (thread_id,))
+        statements += [("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", (thread_id, *key)) for key in dropped]
+        statements += [("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", (thread_id, *key)) for key in dropped]
+        statements += [("DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?", (thread_id, *key))
+                       for key in stored_blobs if tuple(key) not in kept_blobs]
+        statements += [("DELETE FROM elements WHERE thread_id = ? AND hash = ?", (thread_id, handle))
+                       for handle, in stored_elements if handle not in referenced]
+        self._queue(statements)
+        self.flush()
+
+    def storage_bytes(self, thread_id: str | None = None) -> int:
+        """ Bytes of serialized checkpoints, blobs, elements and writes stored (for one thread, or in total) """
+        self.flush()
+        where, params = ("WHERE thread_id = ?", (thread_id,)) if thread_id else ("", ())
+        total = 0
+        for table, size in (("checkpoints", "LENGTH(checkpoint) + LENGTH(metadata)"), ("blobs", "LENGTH(blob)"),
+                            ("elements", "LENGTH(blob)"), ("writes", "LENGTH(blob)")):
+            total += self._query(f"SELECT COALESCE(SUM({size}), 0) FROM {table} {where}", params)[0][0]
+        return total
+
+    # Async interface. Writes only queue rows, reads run in a worker thread
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: RunnableConfig | None, *, filter: dict[str, Any] | None = None,
+                    before: RunnableConfig | None = None, limit: int | None = None) -> AsyncIterator[CheckpointTuple]:
+        for item in await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit))):
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        return self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return self.delete_thread(thread_id)
+
+
+
+
+""" Default checkpointer """
+
+_savers: dict[str, SQLiteCheckpointSaver] = {}
+_default_lock = threading.Lock()
+
+
+def get_checkpointer(path: str | None = None):
+    """
+    Return the checkpointer for new graphs: the SQLite checkpointer for path (or AGENT_CHECKPOINT_DB),
+    shared by every graph using the same file, or a MemorySaver if neither is set.
+    AGENT_CHECKPOINT_FLUSH_MS sets the batching interval of the writes (default 50), and AGENT_CHECKPOINT_KEEP
+    the number of checkpoints kept per thread by periodic compaction (unset keeps every checkpoint).
+    """
+    path = path or os.getenv("AGENT_CHECKPOINT_DB")
+    if not path:
+        from langgraph.checkpoint.memory import MemorySaver
+        return MemorySaver()
+
+    with _default_lock:
+        saver = _savers.get(path)
+        if saver is None or saver._closed:
+            keep = os.getenv("AGENT_CHECKPOINT_KEEP")
+            saver = SQLiteCheckpointSaver(path, flush_interval=float(os.getenv("AGENT_CHECKPOINT_FLUSH_MS", "50")) / 1000,
+                                          keep_checkpoints=int(keep) if keep else None)
+            _savers[path] = saver
+        return saver
@@ -0,0 +1,253 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+"""
+Shared client registry for the LLM and search providers.
+
+Building a ChatOpenAI or TavilyClient is not free: every new instance creates its own HTTP client,
+and with it a fresh connection pool, so the first request of every node paid for a new TCP + TLS handshake.
+This module builds each client once per process and hands out the same instance to every caller.
+
+Key Components:
+- Settings: pool size and timeouts, read from environment variables and adjustable with configure_clients().
+- get_llm(): one ChatOpenAI per (model, temperature, endpoint, timeout), backed by a shared, keep-alive httpx connection pool.
+  Temperature-0 clients use the on-disk response cache when it is turned on (see llm_cache.py).
+- get_tavily_client(): one TavilyClient backed by a pooled requests.Session.
+- get_async_tavily_client(): one AsyncTavilyClient per event loop, backed by that loop's own httpx connection pool.
+- close_clients(): closes every pooled connection and empties the registry.
+The httpx pools report requests and bytes to the LLM span of the current call when tracing is on (see tracing.py).
+
+Sync clients are shared by all threads. httpx.AsyncClient connections belong to the event loop that opened them,
+so async-capable clients are kept per event loop and dropped together with their loop.
+"""
+
+
+
+
+""" Settings """
+
+DEFAULT_MODEL = "gpt-5-mini"
+
+_settings = {
+    "max_connections": int(os.getenv("AGENT_HTTP_MAX_CONNECTIONS", "20")),  # Upper bound on open connections per pool
+    "max_keepalive_connections": int(os.getenv("AGENT_HTTP_MAX_KEEPALIVE", "10")),  # Idle connections kept open for reuse
+    "keepalive_expiry": float(os.getenv("AGENT_HTTP_KEEPALIVE_EXPIRY", "60")),  # Seconds an idle connection is kept
+    "timeout": float(os.getenv("AGENT_HTTP_TIMEOUT", "120")),  # Read/write timeout in seconds
+    "connect_timeout": float(os.getenv("AGENT_HTTP_CONNECT_TIMEOUT", "10")),  # Connect timeout in seconds
+    "max_retries": int(os.getenv("AGENT_HTTP_MAX_RETRIES", "4")),  # Retries of transiently failed requests (see ratelimit.py)
+    "tavily_base_url": os.getenv("TAVILY_BASE_URL"),  # None means the public Tavily API
+}
+
+_lock = threading.RLock()
+_http_client: httpx.Client | None = None
+_async_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_llms: dict[tuple, object] = {}
+_tavily_client = None
+_tavily_session: requests.Session | None = None
+_async_tavily_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, object]" = weakref.WeakKeyDictionary()
+
+
+def get_settings() -> dict:
+    """ Return a copy of the current client settings. """
+    with _lock:
+        return dict(_settings)
+
+
+def configure_clients(**settings) -> None:
+    """
+    Change pool size and timeout settings.
+
+    Already-built clients keep the settings they were built with, so the registry is closed and emptied;
+    the next get_llm() / get_tavily_client() call builds clients with the new settings.
+
+    Args:
+        **settings: Any key of the settings dict, e.g. max_connections=50, timeout=30
+    """
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"Unknown client settings: {sorted(unknown)}")
+
+    with _lock:
+        close_clients()
+        _settings.update(settings)
+
+
+
+
+""" HTTP connection pools """
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=_settings["max_connections"],
+        max_keepalive_connections=_settings["max_keepalive_connections"],
+        keepalive_expiry=_settings["keepalive_expiry"],
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(_settings["timeout"], connect=_settings["connect_timeout"])
+
+
+def get_http_client() -> httpx.Client:
+    """ Return the process-wide pooled httpx.Client. httpx.Client is safe to share between threads. """
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            from tracing import trace_http_request, trace_http_response
+            _http_client = httpx.Client(limits=_limits(), timeout=_timeout(),
+                                        event_hooks={"request": [trace_http_request], "response": [trace_http_response]})
+        return _http_client
+
+
+def _running_loop() -> asyncio.AbstractEventLoop | None:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def get_async_http_client() -> httpx.AsyncClient | None:
+    """
+    Return the pooled httpx.AsyncClient of the running event loop.
+    Returns None outside an event loop; async clients are then created lazily by the library that needs them.
+    """
+    loop = _running_loop()
+    if loop is None:
+        return None
+
+    with _lock:
+        client = _async_http_clients.get(loop)
+        if client is None:
+            from tracing import atrace_http_request, atrace_http_response
+            client = httpx.AsyncClient(limits=_limits(), timeout=_timeout(),
+                                       event_hooks={"request": [atrace_http_request], "response": [atrace_http_response]})
+            _async_http_clients[loop] = client
+        return client
+
+
+
+
+""" Provider clients """
+
+def get_llm(model: str = DEFAULT_MODEL, temperature: float = 0, base_url: str | None = None, api_key: str | None = None,
+            timeout: float | None = None):
+    """
+    Return the shared ChatOpenAI instance for a model and temperature.
+
+    All instances share one keep-alive connection pool. When called inside an event loop, the returned instance
+    is also bound to that loop's async connection pool, so `ainvoke` reuses connections too.
+
+    Args:
+        model (str): OpenAI model name
+        temperature (float): Sampling temperature
+        base_url (str): OpenAI-compatible endpoint to use instead of the OpenAI API (e.g. a local server)
+        api_key (str): API key for base_url; OPENAI_API_KEY is used if not given
+        timeout (float): Request timeout in seconds (a latency budget, see routing.py). The AGENT_HTTP_TIMEOUT setting if not given
+
+    Returns:
+        ChatOpenAI: A client that can be shared between threads and asyncio tasks
+    """
+    from langchain_openai import ChatOpenAI
+    from llm_cache import get_llm_cache
+
+    loop = _running_loop()
+    key = (model, temperature, base_url, api_key, timeout, id(loop) if loop is not None else None)
+
+    with _lock:
+        llm = _llms.get(key)
+        if llm is None:
+            endpoint = {"base_url": base_url} if base_url else {}
+            if api_key:
+                endpoint["api_key"] = api_key
+            llm = ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                timeout=timeout or _settings["timeout"],
+                max_retries=0,  # Retried by the rate limiter, which has to see the 429s (see ratelimit.py)
+                http_client=get_http_client(),
+                http_async_client=get_async_http_client(),
+                # Only deterministic calls are worth caching
+                cache=get_llm_cache() if temperature == 0 else None,
+                **endpoint,
+            )
+            _llms[key] = llm
+            if loop is not None:
+                # Forget the instance together with its event loop, its async connections are useless afterwards
+                weakref.finalize(loop, _llms.pop, key, None)
+        return llm
+
+
+def get_tavily_client():
+    """
+    Return the shared TavilyClient.
+
+    The client runs on a requests.Session whose adapter keeps up to `max_connections` connections alive,
+    so consecutive searches skip the TCP and TLS handshake.
+
+    Returns:
+        TavilyClient, or None if TAVILY_API_KEY is not set
+    """
+    global _tavily_client, _tavily_session
+    from tavily import TavilyClient
+
+    api_key = os.getenv("TAVILY_API_KEY")
+    if not api_key:
+        return None
+
+    with _lock:
+        if _tavily_client is None:
+            _tavily_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_settings["max_connections"])
+            _tavily_session.mount("https://", adapter)
+            _tavily_session.mount("http://", adapter)
+            _tavily_client = TavilyClient(api_key=api_key, api_base_url=_settings["tavily_base_url"], session=_tavily_session)
+        return _tavily_client
+
+
+def get_async_tavily_client():
+    """
+    Return the AsyncTavilyClient of the running event loop.
+
+    AsyncTavilyClient sets its own headers and base URL on the httpx client it is given, 
+    so it gets a pool of its own instead of sharing the LLM's.
+
+    Returns:
+        AsyncTavilyClient, or None if TAVILY_API_KEY is not set
+    """
+    from tavily import AsyncTavilyClient
+
+    api_key = os.getenv("TAVILY_API_KEY")
+    if not api_key:
+        return None
+
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_tavily_clients.get(loop)
+        if client is None:
+            http_client = httpx.AsyncClient(limits=_limits(), timeout=_timeout())
+            client = AsyncTavilyClient(api_key=api_key, api_base_url=_settings["tavily_base_url"], client=http_client)
+            _async_tavily_clients[loop] = client
+        return client
+
+
+def close_clients() -> None:
+    """ Close every pooled connection and empty the registry. """
+    global _http_client, _tavily_client, _tavily_session
+    with _lock:
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
+        if _tavily_session is not None:
+            _tavily_session.close()
+            _tavily_session = None
+        _tavily_client = None
+        # Async clients can only be closed from their own loop; they are released when the loop goes away
+        _async_http_clients.clear()
+        _async_tavily_clients.clear()
+        _llms.clear()
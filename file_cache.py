@@ -0,0 +1,361 @@
+import atexit
+import collections
+import os
+import threading
+import time
+
+from workspace_index import get_workspace_index
+
+"""
+Write-through cache of file contents and a pool of buffered append handles, for the file tools in tools.py.
+
+Plans often write a file in one task and read it back in the next few. Without a cache every read_file call
+reopens and reads the file again, and every append_to_file call opens and closes it.
+
+- FileCache keeps the bytes of recently used files, least recently used evicted first, up to a memory cap.
+  write_file stores what it wrote and flushed appends extend the cached bytes, so a read after a write does not go
+  to disk. Every lookup stats the file and only uses the entry if size, mtime, ctime and inode are unchanged, so
+  files changed by another process are read again. Files read within a few seconds of their last modification are
+  not cached, because a change in the same timestamp tick would not change their mtime.
+- AppendPool keeps append handles open, so appends skip the open and close. By default every append is written
+  before append() returns and write errors are raised to the caller. With a `flush_interval` appended text is
+  buffered instead and written at most `flush_interval` seconds later, when the buffer grows past `buffer_bytes`,
+  before the file is read, searched or overwritten by the tools, and at exit; buffered text is lost on a crash, and a
+  failed background write is raised by the next append to or flush of the file. The workspace index
+  (workspace_index.py) is updated when the appended text is written.
+  Files are opened with O_APPEND, so appends land at the end of the file even if another process appended
+  meanwhile, and a file that was replaced or deleted is reopened at its path before the next write.
+"""
+
+# Files modified more recently than this are not cached on read: coarse filesystem timestamps could hide a change
+_RACY_NS = 2_000_000_000
+
+
+def _signature(st: os.stat_result) -> tuple[int, int, int, int, int]:
+    return st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino, st.st_dev
+
+
+class FileCache:
+    """
+    LRU cache of file contents, validated against the file's stat on every lookup.
+
+    Args:
+        max_bytes: Memory limit for cached contents; least recently used files are evicted first
+        max_file_bytes: Larger files are never cached (read_file memory-maps them instead)
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, max_file_bytes: int = 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self._entries: collections.OrderedDict[str, tuple[tuple, bytes]] = collections.OrderedDict()  # path -> (signature, contents)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+    def get(self, path: str) -> bytes | None:
+        """ The cached contents of the file, or None if it is not cached or has changed since """
+        key = os.path.abspath(path)
+        try:
+            signature = _signature(os.stat(path))
+        except OSError:
+            signature = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            if entry[0] != signature:
+                self._drop(key)
+                self._counters["stale"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[1]
+
+    def put(self, path: str, contents: bytes, st: os.stat_result, written: bool = False) -> None:
+        """
+        Cache the contents of a file as of its stat st.
+
+        Args:
+            written: The contents were just written by this process. Read contents are only cached if the file
+                     was not modified in the last few seconds
+        """
+        if len(contents) != st.st_size or len(contents) > self.max_file_bytes:
+            return
+        if not written and time.time_ns() - st.st_mtime_ns < _RACY_NS:
+            return
+        with self._lock:
+            self._store(os.path.abspath(path), _signature(st), contents)
+
+    def extend(self, path: str, appended: bytes, before: os.stat_result, after: os.stat_result) -> None:
+        """ Add appended bytes to a cached file, if the entry matched the file before the append and nobody else wrote meanwhile """
+        key = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if entry[0] != _signature(before) or after.st_size != before.st_size + len(appended) or after.st_size > self.max_file_bytes:
+                self._drop(key)
+                return
+            self._store(key, _signature(after), entry[1] + appended)
+
+    def invalidate(self, path: str) -> None:
+        with self._lock:
+            if os.path.abspath(path) in self._entries:
+                self._drop(os.path.abspath(path))
+
+    def _store(self, key: str, signature: tuple, contents: bytes) -> None:
+        """ Add an entry and evict least recently used entries over the limit. Called with the lock held """
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (signature, contents)
+        self._bytes += len(contents)
+        while self._bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+            self._counters["evictions"] += 1
+
+    def _drop(self, key: str) -> None:
+        _, contents = self._entries.pop(key)
+        self._bytes -= len(contents)
+
+    def stats(self) -> dict:
+        """ Hit/miss counters and current size of the cache """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class _Handle:
+    def __init__(self, path: str):
+        self.path = path
+        # Create directory if it doesn't exist
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "ab", buffering=0)  # Unbuffered: appends are buffered in pending, and a failed write leaves them there
+        self.pending: list[bytes] = []
+        self.pending_bytes = 0
+        self.error: OSError | None = None  # A failed background write, raised by the next append or flush
+
+
+class AppendPool:
+    """
+    Open append handles with write buffers that are flushed within a bounded delay.
+
+    Args:
+        flush_interval: Most seconds appended text stays in memory; 0 (the default) writes every append at once
+        buffer_bytes: Buffers are written as soon as they reach this size
+        max_handles: Open handles; the least recently used one is flushed and closed first
+    """
+
+    def __init__(self, flush_interval: float = 0.0, buffer_bytes: int = 64 * 1024, max_handles: int = 32):
+        self.flush_interval = flush_interval
+        self.buffer_bytes = buffer_bytes
+        self.max_handles = max_handles
+        self._handles: collections.OrderedDict[str, _Handle] = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self._timer: threading.Timer | None = None
+        self._counters = {"appends": 0, "writes": 0, "opens": 0, "reopens": 0, "errors": 0}
+
+    def append(self, path: str, content: str) -> bool:
+        """
+        Append text to a file (created if missing).
+
+        Returns:
+            True if the text was written, False if it was buffered (only with a flush_interval)
+
+        Raises:
+            OSError: If the file cannot be opened or written, or an earlier buffered write to it failed
+        """
+        data = content.encode("utf-8")
+        key = os.path.abspath(path)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is None:
+                handle = self._handles[key] = _Handle(path)
+                self._counters["opens"] += 1
+                while len(self._handles) > self.max_handles:
+                    self._close(next(iter(self._handles)))
+            self._handles.move_to_end(key)
+            self._raise_error(handle)
+            handle.pending.append(data)
+            handle.pending_bytes += len(data)
+            self._counters["appends"] += 1
+            if self.flush_interval <= 0 or handle.pending_bytes >= self.buffer_bytes:
+                self._flush(handle)
+                return True
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_due)
+                self._timer.daemon = True
+                self._timer.start()
+            return False
+
+    def flush(self, path: str | None = None) -> None:
+        """ Write the buffered appends of one file, or of every file. Raises the first OSError after trying every file """
+        with self._lock:
+            if path is None:
+                handles = list(self._handles.values())
+            else:
+                handle = self._handles.get(os.path.abspath(path))
+                handles = [handle] if handle is not None else []
+            errors = []
+            for handle in handles:
+                try:
+                    self._raise_error(handle)
+                    self._flush(handle)
+                except OSError as e:
+                    errors.append(e)
+            if errors:
+                raise errors[0]
+
+    @staticmethod
+    def _raise_error(handle: _Handle) -> None:
+        """ Raise (once) the error of a failed background write of the handle """
+        if handle.error is not None:
+            error, handle.error = handle.error, None
+            raise error
+
+    def release(self, path: str) -> None:
+        """ Flush and close the handle of a file, e.g. before it is overwritten """
+        with self._lock:
+            self._close(os.path.abspath(path))
+
+    def close(self) -> None:
+        """ Flush and close every handle """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            for key in list(self._handles):
+                self._close(key)
+
+    def _flush_due(self) -> None:
+        with self._lock:
+            self._timer = None
+            for handle in list(self._handles.values()):
+                try:
+                    self._flush(handle)
+                except OSError as e:
+                    handle.error = e
+
+    def _flush(self, handle: _Handle) -> None:
+        """ Write a handle's buffer. Called with the lock held. Raises OSError if the write failed """
+        if not handle.pending:
+            return
+        data = b"".join(handle.pending)
+        written = 0
+        try:
+            self._reopen_if_replaced(handle)
+            before = os.fstat(handle.file.fileno())
+            while written < len(data):
+                written += handle.file.write(data[written:])
+            after = os.fstat(handle.file.fileno())
+            self._counters["writes"] += 1
+        except OSError:
+            # Keep what was not written, so a later flush can still write it
+            self._counters["errors"] += 1
+            handle.pending = [data[written:]]
+            handle.pending_bytes = len(data) - written
+            raise
+        handle.pending.clear()
+        handle.pending_bytes = 0
+        cache = get_file_cache()
+        if cache is not None:
+            cache.extend(handle.path, data, before, after)
+        get_workspace_index().update(handle.path, data.decode("utf-8"), appended=True)
+
+    def _reopen_if_replaced(self, handle: _Handle) -> None:
+        """ Reopen the path if the open file was deleted or replaced (e.g. renamed over) by another process """
+        try:
+            st = os.stat(handle.path)
+            opened = os.fstat(handle.file.fileno())
+            if (st.st_ino, st.st_dev) == (opened.st_ino, opened.st_dev):
+                return
+        except FileNotFoundError:
+            pass
+        handle.file.close()
+        os.makedirs(os.path.dirname(handle.path) or ".", exist_ok=True)
+        handle.file = open(handle.path, "ab", buffering=0)
+        self._counters["reopens"] += 1
+
+    def _close(self, key: str) -> None:
+        handle = self._handles.pop(key, None)
+        if handle is not None:
+            try:
+                self._flush(handle)
+            except OSError as e:
+                # Only buffered text (with a flush_interval) is written here, and nobody is left to raise it to.
+                # pending holds exactly the bytes that were not written
+                print(f"Error: could not append {handle.pending_bytes} bytes to '{handle.path}': {type(e).__name__}: {e}")
+            finally:
+                handle.file.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["open_handles"] = len(self._handles)
+            stats["pending_bytes"] = sum(handle.pending_bytes for handle in self._handles.values())
+        return stats
+
+
+
+
+""" Defaults """
+
+_default_cache: FileCache | None = None
+_default_pool: AppendPool | None = None
+_configured = False
+_default_lock = threading.Lock()
+
+
+def get_file_cache() -> FileCache | None:
+    """
+    Return the process-wide file cache, or None if it is turned off (AGENT_FILE_CACHE=0).
+    AGENT_FILE_CACHE_MAX_MB (default 32) limits its memory.
+    """
+    global _default_cache, _configured
+    with _default_lock:
+        if not _configured:
+            _configured = True
+            if os.getenv("AGENT_FILE_CACHE", "1").strip().lower() not in ("0", "false", "no", "off"):
+                _default_cache = FileCache(max_bytes=int(float(os.getenv("AGENT_FILE_CACHE_MAX_MB", "32")) * 1024 * 1024))
+        return _default_cache
+
+
+def configure_file_cache(cache: FileCache | None) -> None:
+    """ Replace the process-wide file cache. None turns caching off """
+    global _default_cache, _configured
+    with _default_lock:
+        _default_cache = cache
+        _configured = True
+
+
+def get_append_pool() -> AppendPool:
+    """
+    Return the process-wide append pool, flushed at exit.
+    AGENT_APPEND_FLUSH_MS (default 0: every append is written at once) lets appended text be buffered for that long.
+    """
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = AppendPool(flush_interval=float(os.getenv("AGENT_APPEND_FLUSH_MS", "0")) / 1000)
+            atexit.register(_default_pool.close)
+        return _default_pool
+
+
+def configure_append_pool(pool: AppendPool) -> None:
+    """ Replace the process-wide append pool. The previous pool is flushed and closed """
+    global _default_pool
+    with _default_lock:
+        previous, _default_pool = _default_pool, pool
+    atexit.register(pool.close)
+    if previous is not None and previous is not pool:
+        previous.close()
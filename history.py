@@ -0,0 +1,281 @@
+import functools
+import hashlib
+import os
+import re
+import threading
+
+"""
+Token-budgeted conversation history.
+
+AgentState['conversation_history'] keeps every entry, but interpolating the whole list into every prompt made
+prompt size, latency and cost grow with every task. HistoryManager renders the history into a prompt context
+that stays within a token budget:
+
+- The goal (the first entry) is always kept.
+- The most recent entries are kept verbatim.
+- Older entries that are relevant to the task at hand (entries about its dependencies, or sharing keywords
+  with its title and description) are kept as one-line digests.
+- Everything else is folded into a running summary. Summaries are cached per history prefix, so each new
+  entry is folded in once instead of re-summarizing the whole history for every prompt.
+
+Tokens are counted locally with tiktoken. If its encoding files cannot be loaded (e.g. no network on first use),
+an approximation based on word and punctuation counts is used instead.
+"""
+
+
+
+
+""" Token counting """
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def _get_encoding():
+    """ Load the tiktoken encoding once. Returns False if it is not available. """
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(os.getenv("AGENT_TOKEN_ENCODING", "o200k_base"))
+            except Exception:
+                _encoding = False
+        return _encoding
+
+
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """ Count the tokens of text with tiktoken, or approximate them if tiktoken is not available """
+    if not text:
+        return 0
+
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    # Roughly one token per 4 characters of a word, and one per punctuation character
+    return sum(max(1, (len(piece) + 3) // 4) for piece in _WORD_PATTERN.findall(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep: str = "head") -> str:
+    """ Shorten text to about max_tokens tokens, keeping its beginning ("head") or its end ("tail") """
+    if max_tokens <= 0:
+        return ""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+
+    # Cut proportionally, then tighten until it fits
+    length = max(1, int(len(text) * max_tokens / tokens))
+    while length > 1:
+        shortened = text[:length] if keep == "head" else text[-length:]
+        if count_tokens(shortened) + 1 <= max_tokens:
+            return shortened + " …" if keep == "head" else "… " + shortened
+        length = int(length * 0.9)
+    return "…"
+
+
+
+
+""" History manager """
+
+_TASK_REFERENCE = re.compile(r"task #(\d+)", re.IGNORECASE)
+_KEYWORD = re.compile(r"[a-z0-9]{4,}")
+_STOPWORDS = {"task", "tasks", "this", "that", "with", "from", "into", "them", "then", "than", "were", "will",
+              "have", "been", "result", "results", "executed", "executing", "tool", "file", "files", "using",
+              "reflection", "marked", "complete", "arguments"}
+_MILESTONE_PREFIXES = ("Executing task #", "Reflection on task #")
+
+
+def digest_entry(entry: str, max_chars: int = 160) -> str:
+    """ One-line digest of a history entry: its first line, cut at the first sentence end or max_chars """
+    line = entry.strip().split("\n", 1)[0]
+    sentence_end = re.search(r"(?<=[.!?])\s", line)
+    if sentence_end and sentence_end.start() < max_chars:
+        line = line[:sentence_end.start()]
+    return line if len(line) <= max_chars else line[:max_chars].rstrip() + "…"
+
+
+def _keywords(text: str) -> set[str]:
+    return set(_KEYWORD.findall(text.lower())) - _STOPWORDS
+
+
+class HistoryManager:
+    """
+    Renders conversation history into a prompt context within a token budget.
+
+    Args:
+        budget_tokens: Maximum tokens of the rendered context. 0 or less disables the manager
+            and renders the full history, as the agent used to.
+        recent_entries: Number of most recent entries kept verbatim (as far as the budget allows)
+        summary_tokens: Maximum tokens of the running summary of older entries
+    """
+
+    def __init__(self, budget_tokens: int = 2000, recent_entries: int = 8, summary_tokens: int = 400):
+        self.budget_tokens = budget_tokens
+        self.recent_entries = recent_entries
+        self.summary_tokens = summary_tokens
+        self._summaries: dict[str, str] = {}  # Digest of a history prefix -> running summary of that prefix
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_tokens > 0
+
+    def context_for(self, history: list[str], task: dict | None = None) -> str:
+        """
+        Render history as prompt context for a task.
+
+        Args:
+            history: The full conversation history, starting with the goal
+            task: The task the context is for. Older entries relevant to it are kept as digests.
+                None renders a context for the whole goal (e.g. the final summary)
+
+        Returns:
+            str: The context, at most budget_tokens tokens long
+        """
+        if not self.enabled:
+            return str(history)
+        if not history:
+            return ""
+
+        goal, entries = history[0], history[1:]
+        budget = self.budget_tokens - count_tokens(goal)
+
+        # Recent entries verbatim, newest first, up to 60% of the budget. Oversized entries keep their beginning
+        recent = entries[-self.recent_entries:] if self.recent_entries > 0 else []
+        recent_budget = int(budget * 0.6)
+        kept_recent = []
+        for entry in reversed(recent):
+            if recent_budget <= 8:
+                break
+            kept = truncate_to_tokens(entry, recent_budget)
+            kept_recent.insert(0, kept)
+            recent_budget -= count_tokens(kept)
+        older = entries[:len(entries) - len(kept_recent)]
+        budget -= sum(count_tokens(entry) for entry in kept_recent)
+
+        # Digests of older entries relevant to the task, most relevant first, shown in history order
+        relevant = self._relevant_entries(older, task) if task else []
+        relevant_budget = budget // 2
+        kept_relevant = []
+        for index, entry in relevant:
+            digest = digest_entry(entry)
+            if count_tokens(digest) > relevant_budget:
+                break
+            kept_relevant.append((index, digest))
+            relevant_budget -= count_tokens(digest)
+        kept_relevant = [digest for _, digest in sorted(kept_relevant)]
+        budget -= sum(count_tokens(entry) for entry in kept_relevant)
+
+        # Running summary of all older entries in what is left
+        summary_lines = self.summarize(older).split("\n") if older else []
+        while True:
+            context = self._render(goal, summary_lines, kept_relevant, kept_recent)
+            if count_tokens(context) <= self.budget_tokens or not summary_lines:
+                return context
+            summary_lines = summary_lines[1:]  # Oldest summary lines go first
+
+    @staticmethod
+    def _render(goal: str, summary_lines: list[str], relevant: list[str], recent: list[str]) -> str:
+        sections = [goal]
+        if summary_lines:
+            sections.append("Summary of earlier work:\n" + "\n".join(summary_lines))
+        if relevant:
+            sections.append("Earlier entries relevant to this task:\n" + "\n".join(f"- {entry}" for entry in relevant))
+        if recent:
+            sections.append("Recent entries:\n" + "\n".join(f"- {entry}" for entry in recent))
+        return "\n\n".join(sections)
+
+    def _relevant_entries(self, entries: list[str], task: dict) -> list[tuple[int, str]]:
+        """ Older entries about the task's dependencies or sharing keywords with it, with their index, most relevant first """
+        dependencies = {int(dep) for dep in task.get("depends_on") or []}
+        keywords = _keywords(f"{task.get('title', '')} {task.get('description', '')}")
+
+        scored = []
+        current_task_id = None
+        for index, entry in enumerate(entries):
+            reference = _TASK_REFERENCE.search(entry)
+            if reference:
+                current_task_id = int(reference.group(1))
+            score = 3 if current_task_id in dependencies else 0
+            score += len(keywords & _keywords(entry))
+            if score > 0:
+                scored.append((-score, index, entry))
+
+        return [(index, entry) for _, index, entry in sorted(scored)]
+
+    def summarize(self, entries: list[str]) -> str:
+        """
+        Running summary of entries, folded in one entry at a time.
+        The summary of the longest already summarized prefix is reused, so only new entries are folded in.
+        """
+        prefix_digests = []
+        digest = hashlib.sha1()
+        for entry in entries:
+            digest.update(entry.encode("utf-8", "replace"))
+            digest.update(b"\0")
+            prefix_digests.append(digest.hexdigest())
+
+        with self._lock:
+            start, summary = 0, ""
+            for index in range(len(entries) - 1, -1, -1):
+                if prefix_digests[index] in self._summaries:
+                    start, summary = index + 1, self._summaries[prefix_digests[index]]
+                    break
+
+        for index in range(start, len(entries)):
+            summary = self._fold(summary, entries[index])
+            with self._lock:
+                self._summaries[prefix_digests[index]] = summary
+
+        with self._lock:
+            if len(self._summaries) > 10000:  # Keep the cache bounded over long runs
+                for key in list(self._summaries)[:5000]:
+                    del self._summaries[key]
+        return summary
+
+    def _fold(self, summary: str, entry: str) -> str:
+        """ Add the digest of one entry to the summary, dropping the least important old lines when over budget """
+        lines = summary.split("\n") if summary else []
+        lines.append(digest_entry(entry))
+
+        while len(lines) > 1 and count_tokens("\n".join(lines)) > self.summary_tokens:
+            # Drop the oldest tool-level line first, keep task milestones as long as possible
+            droppable = next((i for i, line in enumerate(lines) if not line.startswith(_MILESTONE_PREFIXES)), 0)
+            del lines[droppable]
+        return "\n".join(lines)
+
+
+
+
+""" Default manager """
+
+_default_manager: HistoryManager | None = None
+_default_lock = threading.Lock()
+
+
+def get_history_manager() -> HistoryManager:
+    """
+    Return the process-wide history manager. Configured with the environment variables
+    AGENT_HISTORY_BUDGET (tokens, 0 disables the manager), AGENT_HISTORY_RECENT and AGENT_HISTORY_SUMMARY_TOKENS.
+    """
+    global _default_manager
+    with _default_lock:
+        if _default_manager is None:
+            _default_manager = HistoryManager(
+                budget_tokens=int(os.getenv("AGENT_HISTORY_BUDGET", "2000")),
+                recent_entries=int(os.getenv("AGENT_HISTORY_RECENT", "8")),
+                summary_tokens=int(os.getenv("AGENT_HISTORY_SUMMARY_TOKENS", "400")),
+            )
+        return _default_manager
+
+
+def configure_history(**settings) -> HistoryManager:
+    """ Replace the process-wide history manager, e.g. configure_history(budget_tokens=4000) """
+    global _default_manager
+    with _default_lock:
+        _default_manager = HistoryManager(**settings)
+        return _default_manager
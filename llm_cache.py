@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import warnings
+
+from langchain_core.caches import BaseCache
+
+"""
+Deterministic on-disk cache for LLM responses.
+
+Every node calls the LLM at temperature 0 with stable prompt templates, so re-running a goal used to pay again for
+identical generate_todos, reflect and reflect_and_complete calls. SQLiteLLMCache is a LangChain BaseCache: ChatOpenAI
+looks every call up before sending it and stores every response it receives.
+
+The cache key is the hash of LangChain's `llm_string` and prompt, which together cover the model, the full message list,
+the tools bound with bind_tools() and the schema given to with_structured_output(). Transport settings
+(timeouts, retries) are left out of the key, changing them does not invalidate the cache.
+Responses are stored as serialized generations, so tool calls and structured output come back exactly as received.
+
+The cache is opt-in: set AGENT_LLM_CACHE=1 (or to a database path). clients.get_llm() then attaches it to every
+temperature-0 client.
+"""
+
+# Constructor arguments that change how a request is sent, not what the model answers
+_TRANSPORT_KWARGS = {"max_retries", "request_timeout", "timeout", "http_client", "http_async_client", "streaming", "stream_usage"}
+
+DEFAULT_CACHE_PATH = os.path.join(".agent-cache", "llm-cache.sqlite")
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    """ Hash of the prompt and the LLM settings that affect the response """
+    model_part, _, params_part = llm_string.partition("---")
+    try:
+        serialized = json.loads(model_part)
+        for key in _TRANSPORT_KWARGS:
+            serialized.get("kwargs", {}).pop(key, None)
+        model_part = json.dumps(serialized, sort_keys=True)
+    except (ValueError, AttributeError):
+        pass  # Not a serialized model, use the llm_string as it is
+
+    digest = hashlib.sha256()
+    for part in (model_part, params_part, prompt):
+        digest.update(part.encode("utf-8", "replace"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    LLM response cache in a SQLite database (WAL mode), with LRU eviction, a size limit and a TTL.
+
+    Args:
+        path: Database file
+        max_entries: Maximum number of cached responses; least recently used responses are evicted first
+        max_bytes: Maximum total size of the cached responses
+        ttl_seconds: Responses older than this are treated as misses and deleted. None keeps them forever
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 10000, max_bytes: int = 256 * 1024 * 1024,
+                 ttl_seconds: float | None = 7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def lookup(self, prompt: str, llm_string: str):
+        """ Return the cached generations for this prompt and LLM, or None """
+        key = cache_key(prompt, llm_string)
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+
+        return _load_generations(row[0])
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        """ Store the generations of a response, then evict entries over the limits """
+        from langchain_core.load import dumps
+
+        value = dumps(list(return_val))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (cache_key(prompt, llm_string), value, len(value), now, now),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        """ Delete expired entries, then least recently used entries until both limits hold. Called with the lock held """
+        if self.ttl_seconds is not None:
+            self.evictions += self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,)).rowcount
+
+        entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        while entries > self.max_entries or size > self.max_bytes:
+            # Evict in batches so a full cache does not pay one query per insert
+            batch = max(1, entries - self.max_entries, entries // 20)
+            rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT ?", (batch,)).fetchall()
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key, _ in rows])
+            self.evictions += len(rows)
+            entries -= len(rows)
+            size -= sum(row_size for _, row_size in rows)
+
+    def clear(self, **kwargs) -> None:
+        """ Delete every cached response """
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        """ Hit/miss counters and current size of the cache """
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _load_generations(value: str) -> list:
+    from langchain_core._api import LangChainBetaWarning
+    from langchain_core.load import loads
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", LangChainBetaWarning)
+        return loads(value, allowed_objects="core")
+
+
+
+
+""" Default cache """
+
+_default_cache: SQLiteLLMCache | None = None
+_configured = False
+_default_lock = threading.Lock()
+
+
+def get_llm_cache() -> SQLiteLLMCache | None:
+    """
+    Return the process-wide LLM cache, or None if caching is off.
+    AGENT_LLM_CACHE turns it on ("1" uses .agent-cache/llm-cache.sqlite, anything else is taken as the database path).
+    AGENT_LLM_CACHE_MAX_ENTRIES, AGENT_LLM_CACHE_MAX_MB and AGENT_LLM_CACHE_TTL (seconds, 0 = forever) set the limits.
+    """
+    global _default_cache, _configured
+    with _default_lock:
+        if not _configured:
+            _configured = True
+            setting = os.getenv("AGENT_LLM_CACHE", "").strip()
+            if setting.lower() in ("", "0", "false", "no", "off"):
+                return None
+            ttl = float(os.getenv("AGENT_LLM_CACHE_TTL", str(7 * 24 * 3600)))
+            _default_cache = SQLiteLLMCache(
+                path=DEFAULT_CACHE_PATH if setting.lower() in ("1", "true", "yes", "on") else setting,
+                max_entries=int(os.getenv("AGENT_LLM_CACHE_MAX_ENTRIES", "10000")),
+                max_bytes=int(float(os.getenv("AGENT_LLM_CACHE_MAX_MB", "256")) * 1024 * 1024),
+                ttl_seconds=ttl or None,
+            )
+        return _default_cache
+
+
+def configure_llm_cache(cache: SQLiteLLMCache | None) -> None:
+    """ Replace the process-wide LLM cache. None turns caching off. Clients built afterwards pick it up """
+    global _default_cache, _configured
+    with _default_lock:
+        _default_cache = cache
+        _configured = True
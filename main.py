@@ -1,13 +1,103 @@
-from agent import create_agent_graph, AgentState
-from dotenv import load_dotenv
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib
 import os
+import threading
+import time
+import uuid
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from streaming import TimeToFirstTokenHandler, TokenRenderer
+    from tracing import Tracer
+
+# The agent and its dependencies (langchain, langgraph, pydantic, ...) take about a second to import. They are imported
+# when they are first needed, so --help answers at once, and for a new run in the background while the user answers
+# the prompts (see preload_agent()). agent.py itself imports langgraph, the schemas, tools and clients on first use,
+# so they are listed too
+AGENT_MODULES = ("agent", "langgraph.graph", "schemas", "tools", "clients", "checkpointer", "result_store", "streaming", "tracing")
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="AI Agent TODO Executor")
+    parser.add_argument("--resume", metavar="THREAD_ID", help="Continue an interrupted run from its last checkpoint")
+    parser.add_argument("--checkpoint-db", default=os.getenv("AGENT_CHECKPOINT_DB"),
+                        help="SQLite file for checkpoints (default: .agent-cache/checkpoints.sqlite)")
+    parser.add_argument("--list-runs", action="store_true", help="List the thread ids of earlier runs and exit")
+    parser.add_argument("--trace", metavar="PATH", default=os.getenv("AGENT_TRACE") or None,
+                        help="Write spans of every node, LLM call and tool call to this JSONL file and print a summary")
+    parser.add_argument("--no-stream", action="store_true", help="Print LLM responses once they are complete instead of token by token")
+    return parser.parse_args(argv)
+
 
 def main():
+    """ Sync entry point, a thin wrapper around amain() """
+    asyncio.run(amain(parse_args()))
+
+
+def preload_agent() -> threading.Thread:
+    """
+    Start importing AGENT_MODULES in a background thread. join() it before importing any of them, so no module is
+    imported by two threads at once. An import error is left for the main thread's import to raise
+    """
+    def preload():
+        try:
+            for name in AGENT_MODULES:
+                importlib.import_module(name)
+        except Exception:
+            pass
+
+    thread = threading.Thread(target=preload, name="preload-agent", daemon=True)
+    thread.start()
+    return thread
+
+
+def open_checkpointer(args: argparse.Namespace):
+    """ Durable checkpoints, and tool outputs on disk so references in the checkpoints stay valid after a restart """
+    from checkpointer import DEFAULT_CHECKPOINT_PATH, get_checkpointer
+    from result_store import configure_result_store
+
+    path = args.checkpoint_db or DEFAULT_CHECKPOINT_PATH
+    checkpointer = get_checkpointer(path)
+    if not os.getenv("AGENT_RESULT_STORE_DIR"):
+        configure_result_store(directory=os.path.join(os.path.dirname(path) or ".", "results"))
+    return checkpointer
+
+
+async def amain(args: argparse.Namespace | None = None):
+    """ Async entry point: asks for the mode and goal (or resumes a run), then runs the agent on the event loop """
+    args = args or parse_args([])
+
     # Load API key
+    from dotenv import load_dotenv
     load_dotenv()
     if not os.getenv("OPENAI_API_KEY"):
         print("Error: OPENAI_API_KEY not found in .env file")
         return
+
+    preload = preload_agent()
+
+    if args.list_runs:
+        preload.join()
+        for thread_id in open_checkpointer(args).thread_ids():
+            print(thread_id)
+        return
+
+    if args.resume:
+        preload.join()
+        from agent import create_agent_graph, aresume_goal, new_run_config
+        app = create_agent_graph(open_checkpointer(args))
+        ttft, renderer, tracer = run_handlers(args)
+        print(f"Resuming run {args.resume}...")
+        try:
+            final_state = await aresume_goal(args.resume, app, new_run_config(callbacks=callbacks(ttft, tracer)), renderer)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        print_final_result(final_state, renderer, ttft, tracer)
+        return
     
     # Get user's goal
     print("=" * 50)
@@ -18,53 +108,105 @@ def main():
     print("\nSelect mode:")
     print("  [1] Auto - Execute tasks automatically")
     print("  [2] Confirm - Review tasks before execution")
-    mode_choice = input("\nYour choice (default: 1): ").strip()
+    mode_choice = (await asyncio.to_thread(input, "\nYour choice (default: 1): ")).strip()
     
     mode = "confirm" if mode_choice == "2" else "auto"
     
-    goal = input("\nWhat would you like me to help you with? ").strip()
+    goal = (await asyncio.to_thread(input, "\nWhat would you like me to help you with? ")).strip()
     
     if not goal:
         print("No goal provided. Exiting.")
         return
     
-    # Create the graph
-    app = create_agent_graph()
-    
-    # Initialize state
-    initial_state = {
-        "goal": goal,
-        "mode": mode,
-        "tasks": None,
-        "current_task_id": None,
-        "approved": (mode == "auto"),  # Auto mode is pre-approved
-        "user_action": None,
-        "conversation_history": [],
-        "output": None
-    }
-    
-    # Run the agent
-    config = {
-        "configurable": {
-            "thread_id": "1"
-        },
-        "recursion_limit": 100  # Increased from default 25 to allow more tasks
-    }
+    # The agent was imported while the user was typing; the graph is only built now that there is a goal to run
+    await asyncio.to_thread(preload.join)
+    from agent import create_agent_graph, arun_goal, new_run_config
+    app = create_agent_graph(open_checkpointer(args))
+    ttft, renderer, tracer = run_handlers(args)
+
+    # Run the agent. Every run gets its own thread id, so it can be resumed after a crash
+    thread_id = uuid.uuid4().hex[:12]
+    print(f"\nRun id: {thread_id} (continue it after an interruption with: python main.py --resume {thread_id})")
     #print(f"\nGoal: {goal}\n")
     print("Great! Writing up the to-do list...")
 
-    for event in app.stream(initial_state, config):
-        pass  # Nodes print their own output
-    
-    # Get final state
-    final_state = app.get_state(config).values
-    if final_state.get("output"):
+    if renderer:
+        renderer.started_at = time.perf_counter()  # Measure from the start of the run, not from the prompts
+    final_state = await arun_goal(goal, mode, app, new_run_config(thread_id=thread_id, callbacks=callbacks(ttft, tracer)), renderer)
+    print_final_result(final_state, renderer, ttft, tracer)
+
+
+def run_handlers(args: argparse.Namespace) -> tuple[TimeToFirstTokenHandler, TokenRenderer | None, Tracer | None]:
+    """ Time-to-first-token stats, the token renderer (unless --no-stream) and the tracer (with --trace) of a run """
+    from streaming import TimeToFirstTokenHandler, TokenRenderer
+    from tracing import Tracer
+    return TimeToFirstTokenHandler(), None if args.no_stream else TokenRenderer(), Tracer(args.trace) if args.trace else None
+
+
+def callbacks(ttft: TimeToFirstTokenHandler, tracer: Tracer | None) -> list:
+    return [ttft] + ([tracer] if tracer else [])
+
+
+def print_final_result(final_state, renderer: TokenRenderer | None = None, ttft: TimeToFirstTokenHandler | None = None,
+                       tracer: Tracer | None = None):
+    """
+    Print the final output of a run (unless it was streamed already), the search and plan cache statistics, the LLM calls
+    saved by rule-based and batched reflection, speculation hits and misses, time to first token, latency and cost per routed model tier, rate limiter waits and 429s and, when tracing,
+    the trace summary
+    """
+    from search_cache import get_search_cache
+    from plan_cache import get_plan_cache
+    from routing import get_router, format_stats as format_routing_stats
+    from ratelimit import get_rate_limiter, format_stats as format_rate_limit_stats
+    from tracing import format_summary
+
+    if final_state.get("output") and (renderer is None or "reflect_and_complete" not in renderer.shown_nodes):
         print("\n" + "=" * 50)
         print("FINAL RESULT")
         print("=" * 50)
         print(final_state["output"])
 
+    search_cache = get_search_cache()
+    if search_cache:
+        stats = search_cache.stats()
+        print(f"\nSearch cache: {stats['hits'] + stats['disk_hits']} hits, {stats['deduplicated']} deduplicated, "
+              f"{stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries")
+
+    plan_cache = get_plan_cache()
+    if plan_cache:
+        stats = plan_cache.stats()
+        print(f"Plan cache: {stats['exact_hits']} exact and {stats['similar_hits']} similar hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} plans")
+
+    if final_state.get("tasks"):
+        print(f"Reflection: {final_state.get('llm_calls_saved', 0)} LLM calls saved by deciding clear tool outcomes without the LLM and by batching")
+    speculations = final_state.get("speculation_hits", 0) + final_state.get("speculation_misses", 0)
+    if speculations:
+        print(f"Speculation: {final_state['speculation_hits']} hits, {final_state['speculation_misses']} misses "
+              f"({final_state['speculation_hits'] / speculations:.0%} hit rate)")
+
+    if renderer and renderer.time_to_first_output is not None:
+        print(f"Time to first output: {renderer.time_to_first_output * 1000:.0f}ms")
+    if ttft:
+        for node, stats in ttft.summary().items():
+            print(f"Time to first token in {node}: {stats['mean_ms']:.0f}ms mean, {stats['p50_ms']:.0f}ms median, "
+                  f"{stats['max_ms']:.0f}ms max ({stats['calls']} calls)")
+
+    router = get_router()
+    if router.configured and router.stats():
+        print("\nModel routing (per node and tier):")
+        print(format_routing_stats(router.stats()))
+
+    rate_limits = get_rate_limiter().stats()
+    if any(entry["wait_s"] or entry["rate_limited"] or entry["retries"] for entry in rate_limits):
+        print("\nRate limits (limiter wait and 429s per provider):")
+        print(format_rate_limit_stats(rate_limits))
+
+    if tracer:
+        print(f"\nTrace summary (spans in {tracer.path}):")
+        print(format_summary(tracer.close()))
+
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
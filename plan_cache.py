@@ -0,0 +1,291 @@
+import collections
+import difflib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+"""
+Plan cache for generate_todos: reuse the to-do list of an earlier, similar goal instead of asking the LLM again.
+
+Many goals are near-duplicates of earlier ones ("Summarize today's news about Tesla" / "... about Nvidia").
+PlanCache keeps the plans generated for past goals with a local inverted index over the goals' words (no network,
+no embedding model). A new goal whose cosine similarity to a cached goal reaches `threshold` reuses that plan, with
+its parameters filled in: the words in which the goals differ ("Tesla" -> "Nvidia") are replaced in every task's
+title and description.
+
+Similarity is the cosine of the goals' word sets, without stopwords and with numbers unified. Words are not weighted
+by IDF: in a family of near-duplicate goals the shared template words are the common ones and the parameter is the
+rare one, so IDF would rate exactly the goals whose plans can be reused as dissimilar.
+
+Reused plans go through the same approval flow as generated ones. A plan the user rejects is forgotten, so it is
+not offered again.
+
+The cache is opt-in: set AGENT_PLAN_CACHE=1 (or to a database path). Plans are kept in memory and in a SQLite file,
+so they are reused across runs. stats() reports exact and similar hits, misses and evictions.
+"""
+
+DEFAULT_CACHE_PATH = os.path.join(".agent-cache", "plan-cache.sqlite")
+
+_TOKEN = re.compile(r"\w+(?:['’.-]\w+)*")
+_WORD = re.compile(r"\w+")
+_DIGITS = re.compile(r"\d+")
+# Words that say nothing about what a goal is about; left out of the similarity, but still filled in
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from in into is it its of on or that the this to with about".split()
+)
+
+
+def tokens(goal: str) -> list[str]:
+    """ Words of a goal in order, original case """
+    return _TOKEN.findall(goal)
+
+
+def normalize_goal(goal: str) -> str:
+    return " ".join(tokens(goal)).casefold()
+
+
+def _features(key: str) -> set[str]:
+    """ Words of a normalized goal that count for similarity: no stopwords, digits unified ("3-day" ~ "5-day") """
+    return {_DIGITS.sub("0", word) for word in key.split() if word not in _STOPWORDS}
+
+
+class PlanCache:
+    """
+    Goal-similarity cache of generated plans.
+
+    Args:
+        path: SQLite file the plans are kept in across runs; memory only if not given
+        threshold: Lowest cosine similarity (0-1) between two goals for a plan to be reused
+        max_entries: Maximum number of cached plans; least recently used plans are evicted first
+    """
+
+    def __init__(self, path: str | None = None, threshold: float = 0.7, max_entries: int = 1000):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: dict[str, dict] = {}  # Normalized goal -> {"goal", "plan", "accessed_at"}
+        self._postings: dict[str, set[str]] = {}  # Word -> normalized goals containing it
+        # Normalized goal -> normalized goal whose plan it reused, for forget(); the max_entries most recent lookups
+        self._sources: collections.OrderedDict[str, str] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "evictions": 0, "forgotten": 0}
+
+        self._conn = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS plans (key TEXT PRIMARY KEY, goal TEXT NOT NULL, plan TEXT NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            rows = self._conn.execute("SELECT key, goal, plan, accessed_at FROM plans ORDER BY accessed_at DESC LIMIT ?", (max_entries,))
+            for key, goal, plan, accessed_at in rows.fetchall():
+                self._add(key, {"goal": goal, "plan": json.loads(plan), "accessed_at": accessed_at})
+
+    def lookup(self, goal: str) -> tuple[dict, str, float] | None:
+        """
+        Find the plan of the most similar cached goal.
+
+        Returns:
+            (plan with its parameters filled in for goal, the cached goal, similarity), or None if no cached goal
+            reaches the threshold
+        """
+        key = normalize_goal(goal)
+        with self._lock:
+            entry, similarity, counter = self._entries.get(key), 1.0, "exact_hits"
+            if entry is None:
+                match, similarity = self._most_similar(key)
+                entry, counter = self._entries.get(match) if similarity >= self.threshold else None, "similar_hits"
+            plan = fill_plan(entry["plan"], entry["goal"], goal) if entry is not None else None
+            if plan is None:
+                self._counters["misses"] += 1
+                return None
+
+            self._counters[counter] += 1
+            source = normalize_goal(entry["goal"])
+            entry["accessed_at"] = time.time()
+            self._sources[key] = source
+            self._sources.move_to_end(key)
+            while len(self._sources) > self.max_entries:
+                self._sources.popitem(last=False)
+            if self._conn is not None:
+                self._conn.execute("UPDATE plans SET accessed_at = ? WHERE key = ?", (entry["accessed_at"], source))
+            return plan, entry["goal"], similarity
+
+    def store(self, goal: str, plan: dict) -> None:
+        """ Cache the plan generated for a goal, then evict least recently used plans over the limit """
+        key = normalize_goal(goal)
+        if not key:
+            return
+        entry = {"goal": goal, "plan": plan, "accessed_at": time.time()}
+        with self._lock:
+            self._remove(key)
+            self._add(key, entry)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO plans (key, goal, plan, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, goal, json.dumps(plan), entry["accessed_at"]),
+                )
+            while len(self._entries) > self.max_entries:
+                oldest = min(self._entries, key=lambda k: self._entries[k]["accessed_at"])
+                self._remove(oldest)
+                self._counters["evictions"] += 1
+
+    def forget(self, goal: str) -> None:
+        """ Drop the plan used for a goal (e.g. because the user rejected it): its own, or the one it reused """
+        key = normalize_goal(goal)
+        with self._lock:
+            for k in {key, self._sources.pop(key, key)}:
+                if k in self._entries:
+                    self._remove(k)
+                    self._counters["forgotten"] += 1
+
+    def _most_similar(self, key: str) -> tuple[str | None, float]:
+        """ Cached goal with the highest cosine similarity of their word sets to key. Called with the lock held """
+        query = _features(key)
+        overlap: dict[str, int] = {}
+        for word in query:
+            for candidate in self._postings.get(word, ()):
+                overlap[candidate] = overlap.get(candidate, 0) + 1
+        best, best_similarity = None, 0.0
+        for candidate, shared in overlap.items():
+            similarity = shared / math.sqrt(len(query) * len(_features(candidate)))
+            if similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        return best, best_similarity
+
+    def _add(self, key: str, entry: dict) -> None:
+        self._entries[key] = entry
+        for word in _features(key):
+            self._postings.setdefault(word, set()).add(key)
+
+    def _remove(self, key: str) -> None:
+        if self._entries.pop(key, None) is None:
+            return
+        for word in _features(key):
+            goals = self._postings.get(word)
+            if goals is not None:
+                goals.discard(key)
+                if not goals:
+                    del self._postings[word]
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM plans WHERE key = ?", (key,))
+
+    def stats(self) -> dict:
+        """ Hit/miss counters and number of cached plans """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+        stats["hits"] = stats["exact_hits"] + stats["similar_hits"]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._postings.clear()
+            self._sources.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM plans")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def fill_plan(plan: dict, cached_goal: str, goal: str) -> dict | None:
+    """
+    Adapt the plan of cached_goal to goal: every phrase in which the two goals differ is replaced by its
+    counterpart from goal in the tasks' titles and descriptions. None if a word only cached_goal has is left
+    in the plan (e.g. it was dropped from goal, so there is nothing to replace it with)
+    """
+    old, new = tokens(cached_goal), tokens(goal)
+    old_words, new_words = [word.casefold() for word in old], [word.casefold() for word in new]
+    replacements = {}
+    for op, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_words, new_words, autojunk=False).get_opcodes():
+        if op == "equal":
+            continue
+        if i1 == i2 or j1 == j2:
+            # Inserted or deleted words: replace them together with a neighbouring word both goals share
+            if i1 > 0 and j1 > 0:
+                i1, j1 = i1 - 1, j1 - 1
+            elif i2 < len(old) and j2 < len(new):
+                i2, j2 = i2 + 1, j2 + 1
+            if i1 == i2:
+                continue
+        replacements[" ".join(old_words[i1:i2])] = " ".join(new[j1:j2])
+    if not replacements:
+        return plan
+
+    # One pass over the text, longest phrases first, so a replacement is never replaced again
+    phrases = sorted(replacements, key=len, reverse=True)
+    pattern = re.compile(
+        "|".join(r"(?<!\w)" + r"\W+".join(re.escape(word) for word in phrase.split(" ")) + r"(?!\w)" for phrase in phrases),
+        re.IGNORECASE,
+    )
+
+    def replace(match: re.Match) -> str:
+        text = replacements[" ".join(word.casefold() for word in tokens(match.group(0)))]
+        if match.group(0).islower():  # e.g. in a file name
+            return text.lower()
+        if match.group(0)[:1].isupper() and text[:1].islower():
+            return text[:1].upper() + text[1:]
+        return text
+
+    # Words of the cached goal that the new goal does not have must all be replaced
+    stale = set(_WORD.findall(cached_goal.casefold())) - set(_WORD.findall(goal.casefold())) - _STOPWORDS
+    filled = json.loads(json.dumps(plan))
+    for task in filled.get("tasks", []):
+        for field in ("title", "description"):
+            if isinstance(task.get(field), str):
+                task[field] = pattern.sub(replace, task[field])
+                if stale & set(_WORD.findall(task[field].casefold())):
+                    return None
+    return filled
+
+
+
+
+""" Default cache """
+
+_default_cache: PlanCache | None = None
+_configured = False
+_default_lock = threading.Lock()
+
+
+def get_plan_cache() -> PlanCache | None:
+    """
+    Return the process-wide plan cache, or None if it is off.
+    AGENT_PLAN_CACHE turns it on ("1" uses .agent-cache/plan-cache.sqlite, anything else is taken as the database path).
+    AGENT_PLAN_CACHE_THRESHOLD (0.7) is the lowest goal similarity for reusing a plan and
+    AGENT_PLAN_CACHE_MAX_ENTRIES (1000) limits the number of cached plans.
+    """
+    global _default_cache, _configured
+    with _default_lock:
+        if not _configured:
+            _configured = True
+            setting = os.getenv("AGENT_PLAN_CACHE", "").strip()
+            if setting.lower() in ("", "0", "false", "no", "off"):
+                return None
+            _default_cache = PlanCache(
+                path=DEFAULT_CACHE_PATH if setting.lower() in ("1", "true", "yes", "on") else setting,
+                threshold=float(os.getenv("AGENT_PLAN_CACHE_THRESHOLD", "0.7")),
+                max_entries=int(os.getenv("AGENT_PLAN_CACHE_MAX_ENTRIES", "1000")),
+            )
+        return _default_cache
+
+
+def configure_plan_cache(cache: PlanCache | None) -> None:
+    """ Replace the process-wide plan cache. None turns it off """
+    global _default_cache, _configured
+    with _default_lock:
+        _default_cache = cache
+        _configured = True
@@ -0,0 +1,426 @@
+import asyncio
+import collections
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+
+"""
+Client-side rate limiting, retries and adaptive concurrency for the LLM and search providers.
+
+Nothing used to pace the requests: a burst of parallel tasks ran into the providers' rate limits, and a 429 either
+failed a task or came back from web_search as a "Search error" that reflect then marked as failed. Every LLM call
+(invoke_llm / ainvoke_llm) and every search now goes through the ProviderLimiter of its provider, which
+- waits for two token buckets: requests per minute and (estimated) tokens per minute,
+- caps the requests in flight with an AIMD limit: +1 per limit successful calls, halved on a 429 or, with
+  latency_target_s, on a call slower than the target. Calls started before the last decrease do not halve it again,
+  so one burst of 429s counts once,
+- retries 429s, 5xx responses and connection errors with jittered exponential backoff ("full jitter"), honoring
+  Retry-After. Timeouts are not retried, they are the latency budget's business (see routing.py).
+The time spent waiting for the buckets and the concurrency limit is recorded separately from the backoff; stats()
+reports both per provider. The OpenAI client's own retries are turned off (see clients.py), so the limiter sees every 429.
+
+Config (JSON, from AGENT_RATE_LIMIT_CONFIG), per provider, with "default" for every provider not listed. Providers are
+"openai", "tavily" and, for routing tiers with their own endpoint, the tier's "provider" (its base_url if not set):
+
+    {
+      "openai": {"requests_per_minute": 500, "tokens_per_minute": 200000, "max_concurrency": 16, "latency_target_s": 20},
+      "tavily": {"requests_per_minute": 100, "max_concurrency": 4},
+      "default": {"max_retries": 4}
+    }
+
+Without a config nothing is paced, at most 32 requests per provider are in flight and failed requests are retried
+up to AGENT_HTTP_MAX_RETRIES times.
+"""
+
+# Attempt number (0 for the first) of the request the limiter is making in the current context, for tracing
+_attempt: contextvars.ContextVar[int] = contextvars.ContextVar("rate_limiter_attempt", default=0)
+
+# Limiter waits kept per provider for the p95 in stats(): those of the most recent calls. Total and mean cover every call
+WAIT_SAMPLE_SIZE = 1000
+
+# HTTP statuses worth retrying besides 429: the provider is briefly unavailable
+_TRANSIENT_STATUSES = {500, 502, 503, 504, 529}
+
+LIMITER_SETTINGS = {"requests_per_minute", "tokens_per_minute", "burst_s", "max_concurrency", "min_concurrency",
+                    "latency_target_s", "max_retries", "backoff_base_s", "backoff_max_s"}
+
+
+def current_attempt() -> int:
+    """ Retry number of the request made in the current context: 0 for a first attempt (or outside the limiter) """
+    return _attempt.get()
+
+
+def status_code(error: BaseException) -> int | None:
+    """ HTTP status of a failed request (OpenAI, httpx and requests errors), None if it has none """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """ Whether a request failed because the provider's rate limit was exceeded """
+    from tavily.errors import UsageLimitExceededError
+    return status_code(error) == 429 or isinstance(error, UsageLimitExceededError)
+
+
+def is_transient(error: BaseException) -> bool:
+    """ Whether a request failed in a way that is worth retrying: rate limited, a 5xx response or a lost connection """
+    import httpx
+    import requests
+    from openai import APIConnectionError
+    from routing import is_timeout
+
+    if is_rate_limited(error) or status_code(error) in _TRANSIENT_STATUSES:
+        return True
+    connection_errors = (APIConnectionError, httpx.TransportError, requests.ConnectionError, ConnectionError)
+    return isinstance(error, connection_errors) and not is_timeout(error)
+
+
+def retry_after(error: BaseException) -> float | None:
+    """ Seconds the provider asked to wait (Retry-After or retry-after-ms header), None if it did not say """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass  # An HTTP date; the backoff is used instead
+    return None
+
+
+def estimate_tokens(prompt) -> int:
+    """ Rough token count of an LLM input (4 characters per token), reserved before the call """
+    return len(prompt if isinstance(prompt, str) else str(prompt)) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second up to `capacity`.
+
+    reserve() takes the tokens right away, overdrawing the bucket if needed, and returns how long the caller has to
+    wait for the debt to be refilled. Concurrent callers queue up behind each other's debt, so the rate holds for
+    threads and asyncio tasks alike.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """ Take (or, if negative, give back) tokens without waiting, e.g. once a call's real token count is known """
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class AdaptiveConcurrency:
+    """
+    Limit on the requests in flight, adapted with AIMD (additive increase, multiplicative decrease).
+
+    Args:
+        maximum: Starting and highest limit
+        minimum: Lowest limit
+        latency_target_s: Calls slower than this count as overload, like a 429. Off if not given
+        decrease: Factor the limit is multiplied with on overload
+    """
+
+    def __init__(self, maximum: int = 32, minimum: int = 1, latency_target_s: float | None = None, decrease: float = 0.5):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.latency_target_s = latency_target_s
+        self.decrease = decrease
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+        self._async_waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def _try_acquire(self) -> bool:
+        if self.in_flight < max(self.minimum, int(self.limit)):
+            self.in_flight += 1
+            return True
+        return False
+
+    def acquire(self) -> float:
+        """ Wait for a free slot. Returns the seconds waited; the call's start time for release() is taken after it """
+        start = time.monotonic()
+        with self._condition:
+            self._condition.wait_for(self._try_acquire)
+        return time.monotonic() - start
+
+    async def aacquire(self) -> float:
+        """ Async version of acquire() """
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._try_acquire():
+                    return time.monotonic() - start
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._condition:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+                raise
+
+    def release(self, started: float, overloaded: bool = False, succeeded: bool = True) -> None:
+        """
+        Free the slot of a call started at `started` (time.monotonic()) and adapt the limit: decrease it if the call
+        was rate limited or slower than the latency target, increase it if it succeeded
+        """
+        seconds = time.monotonic() - started
+        overloaded = overloaded or (succeeded and self.latency_target_s is not None and seconds > self.latency_target_s)
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                if started >= self._last_decrease:  # Calls sent before the last decrease already count
+                    self.limit = max(float(self.minimum), self.limit * self.decrease)
+                    self._last_decrease = time.monotonic()
+                    self.decreases += 1
+            elif succeeded:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class ProviderLimiter:
+    """
+    Paces, limits and retries the requests to one provider.
+
+    Args:
+        name: Provider name, for stats
+        requests_per_minute: Request rate limit. Not paced if not given
+        tokens_per_minute: Token rate limit, checked against estimate_tokens() of every call. Not paced if not given
+        burst_s: Seconds of the rates that may be sent at once
+        max_concurrency, min_concurrency, latency_target_s: Bounds and latency signal of the AIMD limit (see AdaptiveConcurrency)
+        max_retries: Retries of a request that failed transiently (see is_transient()). AGENT_HTTP_MAX_RETRIES if not given
+        backoff_base_s, backoff_max_s: Backoff before retry n is random between 0 and min(backoff_max_s, backoff_base_s * 2**n)
+    """
+
+    def __init__(self, name: str, requests_per_minute: float | None = None, tokens_per_minute: float | None = None,
+                 burst_s: float = 1.0, max_concurrency: int = 32, min_concurrency: int = 1, latency_target_s: float | None = None,
+                 max_retries: int | None = None, backoff_base_s: float = 0.5, backoff_max_s: float = 30.0):
+        from clients import get_settings
+
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute / 60, max(1.0, requests_per_minute / 60 * burst_s)) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute / 60, max(1.0, tokens_per_minute / 60 * burst_s)) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency, min_concurrency, latency_target_s)
+        self.max_retries = get_settings()["max_retries"] if max_retries is None else max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self._stats = {"calls": 0, "attempts": 0, "rate_limited": 0, "retries": 0, "failures": 0, "backoff_s": 0.0, "wait_s": 0.0}
+        self._waits: collections.deque[float] = collections.deque(maxlen=WAIT_SAMPLE_SIZE)
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        """ Take a request and the call's tokens from the buckets; returns how long to wait for them """
+        wait = self.requests.reserve(1) if self.requests else 0.0
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        """ Seconds to wait before retrying after `attempt` failed attempts: full jitter, at least the Retry-After """
+        delay = random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * 2 ** attempt))
+        return min(self.backoff_max_s, max(delay, retry_after(error) or 0.0))
+
+    def call(self, request, tokens: int = 0):
+        """
+        Make a request (a function without arguments) within the limits, retrying transient failures.
+
+        Args:
+            request: Makes the request and returns its result
+            tokens: Estimated tokens of the request, for tokens_per_minute
+
+        Raises:
+            The request's last error, once it is not transient or the retries are used up
+        """
+        waited = 0.0
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve(tokens)
+            time.sleep(wait)
+            waited += wait + self.concurrency.acquire()
+            started, succeeded, error = time.monotonic(), False, None
+            attempt_token = _attempt.set(attempt)
+            try:
+                result = request()
+                succeeded = True
+            except Exception as e:
+                error = e
+            finally:
+                _attempt.reset(attempt_token)
+                # The slot is freed whatever happens, also on KeyboardInterrupt and the like (raised as they are)
+                self.concurrency.release(started, overloaded=error is not None and is_rate_limited(error), succeeded=succeeded)
+            if succeeded:
+                self._succeeded(result, tokens, waited)
+                return result
+            time.sleep(self._failed(attempt, error, waited))
+
+    async def acall(self, request, tokens: int = 0):
+        """ Async version of call(): `request` returns an awaitable """
+        waited = 0.0
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve(tokens)
+            await asyncio.sleep(wait)
+            waited += wait + await self.concurrency.aacquire()
+            started, succeeded, error = time.monotonic(), False, None
+            attempt_token = _attempt.set(attempt)
+            try:
+                result = await request()
+                succeeded = True
+            except Exception as e:
+                error = e
+            finally:
+                _attempt.reset(attempt_token)
+                # The slot is freed whatever happens, also on cancellation (raised as it is)
+                self.concurrency.release(started, overloaded=error is not None and is_rate_limited(error), succeeded=succeeded)
+            if succeeded:
+                self._succeeded(result, tokens, waited)
+                return result
+            await asyncio.sleep(self._failed(attempt, error, waited))
+
+    def _succeeded(self, result, tokens: int, waited: float) -> None:
+        usage = getattr(result, "usage_metadata", None)
+        if self.tokens and tokens and usage:
+            self.tokens.adjust(usage.get("total_tokens", tokens) - tokens)
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["attempts"] += 1
+            self._stats["wait_s"] += waited
+            self._waits.append(waited)
+
+    def _failed(self, attempt: int, error: BaseException, waited: float) -> float:
+        """ Record a failed attempt. Returns the backoff before the next one, or raises the error if there is none """
+        rate_limited = is_rate_limited(error)
+        retry = is_transient(error) and attempt < self.max_retries
+        delay = self.backoff(attempt, error) if retry else 0.0
+        with self._lock:
+            self._stats["attempts"] += 1
+            self._stats["rate_limited"] += rate_limited
+            if retry:
+                self._stats["retries"] += 1
+                self._stats["backoff_s"] += delay
+            else:
+                self._stats["calls"] += 1
+                self._stats["failures"] += 1
+                self._stats["wait_s"] += waited
+                self._waits.append(waited)
+        if not retry:
+            raise error
+        return delay
+
+    def stats(self) -> dict:
+        """
+        Calls, attempts, 429s, retries, calls given up, limiter wait (total, mean, p95), backoff and the concurrency limit.
+        The p95 wait is that of the last WAIT_SAMPLE_SIZE calls
+        """
+        with self._lock:
+            stats, waits = dict(self._stats), list(self._waits)
+        waits.sort()
+        return {
+            "provider": self.name,
+            **stats,
+            "mean_wait_ms": stats["wait_s"] / stats["calls"] * 1000 if stats["calls"] else 0.0,
+            "p95_wait_ms": waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000 if waits else 0.0,
+            "concurrency_limit": max(self.concurrency.minimum, int(self.concurrency.limit)),
+            "concurrency_decreases": self.concurrency.decreases,
+        }
+
+
+class RateLimiter:
+    """
+    The ProviderLimiters of all providers, built on first use.
+
+    Args:
+        config: Settings per provider, "default" for the others (see the module docstring)
+    """
+
+    def __init__(self, config: dict | None = None):
+        self.config = config or {}
+        for provider, settings in self.config.items():
+            unknown = set(settings) - LIMITER_SETTINGS
+            if unknown:
+                raise ValueError(f"Unknown rate limit settings for '{provider}': {sorted(unknown)}")
+        self._providers: dict[str, ProviderLimiter] = {}
+        self._lock = threading.Lock()
+
+    def provider(self, name: str) -> ProviderLimiter:
+        with self._lock:
+            limiter = self._providers.get(name)
+            if limiter is None:
+                limiter = ProviderLimiter(name, **self.config.get(name, self.config.get("default", {})))
+                self._providers[name] = limiter
+            return limiter
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            providers = list(self._providers.values())
+        return [limiter.stats() for limiter in providers]
+
+
+def format_stats(stats: list[dict]) -> str:
+    """ Render RateLimiter.stats() as a table """
+    lines = [f"{'provider':<22}  {'calls':>5}  {'429s':>5}  {'retries':>7}  {'failed':>6}  {'wait':>9}  {'p95 wait':>9}  {'backoff':>9}  {'limit':>5}"]
+    for entry in stats:
+        lines.append(
+            f"{entry['provider']:<22}  {entry['calls']:>5}  {entry['rate_limited']:>5}  {entry['retries']:>7}  {entry['failures']:>6}  "
+            f"{entry['wait_s']:>8.2f}s  {entry['p95_wait_ms']:>7.0f}ms  {entry['backoff_s']:>8.2f}s  {entry['concurrency_limit']:>5}"
+        )
+    return "\n".join(lines)
+
+
+
+
+""" Default rate limiter """
+
+_default_limiter: RateLimiter | None = None
+_default_lock = threading.Lock()
+
+
+def load_rate_limit_config(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_rate_limiter() -> RateLimiter:
+    """ Return the process-wide rate limiter, configured from the JSON file at AGENT_RATE_LIMIT_CONFIG (defaults if not set) """
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            path = os.getenv("AGENT_RATE_LIMIT_CONFIG")
+            _default_limiter = RateLimiter(load_rate_limit_config(path) if path else None)
+        return _default_limiter
+
+
+def configure_rate_limiter(limiter: RateLimiter | None) -> None:
+    """ Replace the process-wide rate limiter. None goes back to the one from AGENT_RATE_LIMIT_CONFIG """
+    global _default_limiter
+    with _default_lock:
+        _default_limiter = limiter
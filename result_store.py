@@ -0,0 +1,170 @@
+import collections
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+"""
+Content-addressed store for tool outputs.
+
+execute_task used to append the cumulative result of a task to the history after every tool call, so a task with
+k tool calls wrote O(k²) text into the history and into every later prompt. Now every output is stored here once,
+under the hash of its content, and history and task results carry a reference instead: a short handle plus a
+bounded one-line preview, closed by "…". Nodes that actually need the full output (e.g. reflect) resolve the references.
+
+A reference looks like this:
+    [result:3f2a9c0d1b4e5f60 | 10432 chars] 1. Latest AI news The first lines of the output…
+
+Outputs up to `inline_chars` characters are short enough to be used as they are and are not stored.
+By default the store lives in memory, bounded by `max_memory_bytes`: the least recently used outputs are dropped and
+their references resolve to their preview only. With a directory (AGENT_RESULT_STORE_DIR) outputs are also written to
+disk, sharded by the first two characters of their hash, so references stay valid across restarts; in that case
+only the most recently used outputs are kept in memory.
+"""
+
+# The preview never contains "…", so a reference ends at the first one after its header, also in one-line text
+_REFERENCE_PATTERN = re.compile(r"\[result:([0-9a-f]{16}) \| \d+ chars\] [^\n…]*…")
+
+
+class ResultStore:
+    """
+    Stores each distinct output once and hands out references to it.
+
+    Args:
+        directory: Optional directory for on-disk storage
+        preview_chars: Maximum length of the preview in a reference
+        inline_chars: Outputs up to this length are not stored, they are used as they are
+        memory_items: With a directory, number of outputs kept in memory (least recently used are dropped)
+        max_memory_bytes: Size of the outputs kept in memory, with or without a directory (least recently used are dropped)
+    """
+
+    def __init__(self, directory: str | None = None, preview_chars: int = 200, inline_chars: int = 300, memory_items: int = 256,
+                 max_memory_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.preview_chars = preview_chars
+        self.inline_chars = inline_chars
+        self.memory_items = memory_items
+        self.max_memory_bytes = max_memory_bytes
+        self.memory_bytes = 0
+        self.evictions = 0
+        self._contents: collections.OrderedDict[str, str] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def put(self, content: str) -> str:
+        """ Store content (once) and return its handle """
+        handle = hashlib.sha256(content.encode("utf-8", "replace")).hexdigest()[:16]
+
+        with self._lock:
+            if handle in self._contents:
+                self._contents.move_to_end(handle)
+                return handle
+            self._remember(handle, content)
+
+        if self.directory:
+            path = self._path(handle)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write to a temporary file first, so a crash never leaves a partial output behind
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+        return handle
+
+    def get(self, handle: str) -> str | None:
+        """ Return the content stored under handle, or None if it is unknown """
+        with self._lock:
+            if handle in self._contents:
+                self._contents.move_to_end(handle)
+                return self._contents[handle]
+
+        if self.directory:
+            try:
+                with open(self._path(handle), "r", encoding="utf-8") as f:
+                    content = f.read()
+            except FileNotFoundError:
+                return None
+            with self._lock:
+                if handle not in self._contents:
+                    self._remember(handle, content)
+            return content
+        return None
+
+    def _remember(self, handle: str, content: str) -> None:
+        """ Keep content in memory and drop the least recently used outputs over the limits. Called with the lock held """
+        self._contents[handle] = content
+        self.memory_bytes += len(content)
+        while len(self._contents) > 1 and (self.memory_bytes > self.max_memory_bytes
+                                           or (self.directory and len(self._contents) > self.memory_items)):
+            _, dropped = self._contents.popitem(last=False)
+            self.memory_bytes -= len(dropped)
+            self.evictions += 1
+
+    def reference(self, content: str) -> str:
+        """ Return content itself if it is short, otherwise store it and return its reference """
+        if len(content) <= self.inline_chars:
+            return content
+        handle = self.put(content)
+        preview = " ".join(content.split()).replace("…", "...")[:self.preview_chars]
+        return f"[result:{handle} | {len(content)} chars] {preview}…"
+
+    def resolve(self, text: str | None, max_chars: int | None = None) -> str | None:
+        """
+        Replace every reference in text with the full output it points to.
+        References to unknown outputs keep their preview. max_chars optionally caps each resolved output.
+        """
+        if not text or "[result:" not in text:
+            return text
+
+        def expand(match: re.Match) -> str:
+            content = self.get(match.group(1))
+            if content is None:
+                return match.group(0)
+            if max_chars is not None and len(content) > max_chars:
+                return content[:max_chars] + f"\n… ({len(content) - max_chars} more characters)"
+            return content
+
+        return _REFERENCE_PATTERN.sub(expand, text)
+
+    def _path(self, handle: str) -> str:
+        return os.path.join(self.directory, handle[:2], f"{handle}.txt")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._contents)
+
+
+
+
+""" Default store """
+
+_default_store: ResultStore | None = None
+_default_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    """
+    Return the process-wide result store. Configured with the environment variables
+    AGENT_RESULT_STORE_DIR (on-disk storage, in memory if unset), AGENT_RESULT_PREVIEW_CHARS and
+    AGENT_RESULT_STORE_MAX_MB (outputs kept in memory, default 64).
+    """
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = ResultStore(
+                directory=os.getenv("AGENT_RESULT_STORE_DIR") or None,
+                preview_chars=int(os.getenv("AGENT_RESULT_PREVIEW_CHARS", "200")),
+                max_memory_bytes=int(float(os.getenv("AGENT_RESULT_STORE_MAX_MB", "64")) * 1024 * 1024),
+            )
+        return _default_store
+
+
+def configure_result_store(**settings) -> ResultStore:
+    """ Replace the process-wide result store, e.g. configure_result_store(directory=".agent-results") """
+    global _default_store
+    with _default_lock:
+        _default_store = ResultStore(**settings)
+        return _default_store
@@ -0,0 +1,274 @@
+import collections
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+"""
+Per-node model routing with latency and cost tiers.
+
+Every node used to call the same model, including reflect, whose only job is to pick one of three labels. A Router
+maps each node to a tier: a model plus, optionally, an OpenAI-compatible endpoint (a local stand-in server works)
+and its price per million tokens. Routing config (JSON, from AGENT_ROUTING_CONFIG):
+
+    {
+      "tiers": {
+        "fast":    {"model": "gpt-5-nano", "input_cost_per_mtok": 0.05, "output_cost_per_mtok": 0.4},
+        "default": {"model": "gpt-5-mini", "input_cost_per_mtok": 0.25, "output_cost_per_mtok": 2.0},
+        "local":   {"model": "llama3", "base_url": "http://localhost:8000/v1", "api_key_env": "LOCAL_LLM_KEY"}
+      },
+      "default_tier": "default",
+      "nodes": {
+        "reflect": {"tier": "fast"},
+        "execute_task": {"tier": "default", "rules": [{"needs_tools": false, "tier": "fast"}, {"min_prompt_chars": 8000, "tier": "default"}]},
+        "reflect_and_complete": {"tier": "default", "latency_budget_s": 30, "fallback": "fast"}
+      }
+    }
+
+- rules pick a tier per call, first match wins: min_prompt_chars / max_prompt_chars bound the prompt size, and
+  needs_tools matches tasks whose title or description does (or does not) mention searching or files.
+- A tier's "provider" names the rate limits its calls count against (see ratelimit.py): "openai" by default, the
+  tier's base_url if it has one.
+- latency_budget_s: a call that takes longer is given up and repeated with the `fallback` tier. Async calls are
+  cancelled when the budget runs out; sync calls use it as the request timeout (without retries).
+
+Without a config every node uses DEFAULT_MODEL, as before. stats() reports calls, latency, tokens, cost, timeouts
+and fallbacks per node and tier, so the tiers can be tuned.
+"""
+
+# Words in a task that suggest it needs the search or file tools
+_TOOL_HINTS = re.compile(r"\b(search|web|online|internet|look up|latest|current|news|find|file|read|write|save|append|store)\w*", re.IGNORECASE)
+
+_RULE_CONDITIONS = {"min_prompt_chars", "max_prompt_chars", "needs_tools"}
+
+# Latencies kept per node and tier for the p95 in stats(): the most recent calls. The mean covers every call
+LATENCY_SAMPLE_SIZE = 1000
+
+
+def needs_tools(task: dict | None) -> bool:
+    """ Whether a task mentions searching the web or reading and writing files """
+    if not task:
+        return False
+    return bool(_TOOL_HINTS.search(f"{task.get('title', '')} {task.get('description', '')}"))
+
+
+# The usage collector attached to every run started while a Router.track() block is active
+_usage_collector: contextvars.ContextVar = contextvars.ContextVar("routing_usage_collector", default=None)
+
+
+@functools.cache
+def _usage_collector_class() -> type:
+    """
+    Define the callback handler that adds up the tokens of the LLM calls made while it is the current collector,
+    and attach it to runs. Done on the first Router.track() rather than on import, which would import langchain.
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+    from langchain_core.tracers.context import register_configure_hook
+
+    class UsageCollector(BaseCallbackHandler):
+        run_inline = True
+
+        def __init__(self):
+            self.input_tokens = 0
+            self.output_tokens = 0
+            self._lock = threading.Lock()
+
+        def on_llm_end(self, response, **kwargs):
+            for generations in response.generations:
+                for generation in generations:
+                    usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                    if usage:
+                        with self._lock:
+                            self.input_tokens += usage.get("input_tokens", 0)
+                            self.output_tokens += usage.get("output_tokens", 0)
+
+    register_configure_hook(_usage_collector, inheritable=True)
+    return UsageCollector
+
+
+class Router:
+    """
+    Picks the model tier of every LLM call and records its latency, tokens and cost.
+
+    Args:
+        config: Routing config (see the module docstring). None routes every node to DEFAULT_MODEL
+    """
+
+    def __init__(self, config: dict | None = None):
+        from clients import DEFAULT_MODEL
+        self.configured = bool(config)
+        config = config or {}
+        self.tiers: dict[str, dict] = config.get("tiers") or {"default": {"model": DEFAULT_MODEL}}
+        self.default_tier: str = config.get("default_tier") or ("default" if "default" in self.tiers else next(iter(self.tiers)))
+        self.nodes: dict[str, dict] = config.get("nodes") or {}
+        self._stats: dict[tuple[str, str], dict] = {}
+        self._lock = threading.Lock()
+        self._validate()
+
+    def _validate(self) -> None:
+        for name, tier in self.tiers.items():
+            if not tier.get("model"):
+                raise ValueError(f"Routing tier '{name}' has no model")
+        referenced = [self.default_tier]
+        for node, settings in self.nodes.items():
+            referenced += [settings.get("tier"), settings.get("fallback")] + [rule.get("tier") for rule in settings.get("rules", [])]
+            for rule in settings.get("rules", []):
+                unknown = set(rule) - _RULE_CONDITIONS - {"tier"}
+                if unknown:
+                    raise ValueError(f"Unknown routing rule conditions for node '{node}': {sorted(unknown)}")
+        unknown = {name for name in referenced if name is not None and name not in self.tiers}
+        if unknown:
+            raise ValueError(f"Unknown routing tiers: {sorted(unknown)}")
+
+    def routes(self, node: str, prompt="", task: dict | None = None) -> list[dict]:
+        """
+        Tiers to try for one call of a node, in order: the routed tier, then the fallback tier if the node has a
+        latency budget. Every route holds the tier name, get_llm() arguments, the rate-limited provider, the time budget
+        of the call and whether it is the fallback.
+        """
+        settings = self.nodes.get(node, {})
+        tier = settings.get("tier") or self.default_tier
+        prompt_chars = len(prompt if isinstance(prompt, str) else str(prompt))
+        for rule in settings.get("rules", []):
+            if self._matches(rule, prompt_chars, task):
+                tier = rule["tier"]
+                break
+
+        budget = settings.get("latency_budget_s")
+        fallback = settings.get("fallback")
+        routes = [self._route(tier, budget if fallback else None)]
+        if fallback and budget and fallback != tier:
+            routes.append(self._route(fallback, None, is_fallback=True))
+        return routes
+
+    @staticmethod
+    def _matches(rule: dict, prompt_chars: int, task: dict | None) -> bool:
+        if "min_prompt_chars" in rule and prompt_chars < rule["min_prompt_chars"]:
+            return False
+        if "max_prompt_chars" in rule and prompt_chars > rule["max_prompt_chars"]:
+            return False
+        if "needs_tools" in rule and needs_tools(task) != rule["needs_tools"]:
+            return False
+        return True
+
+    def _route(self, name: str, budget: float | None, is_fallback: bool = False) -> dict:
+        tier = self.tiers[name]
+        client = {"model": tier["model"]}
+        if tier.get("base_url"):
+            client["base_url"] = tier["base_url"]
+        api_key = tier.get("api_key") or (os.getenv(tier["api_key_env"]) if tier.get("api_key_env") else None)
+        if api_key:
+            client["api_key"] = api_key
+        if budget:
+            client["timeout"] = budget
+        provider = tier.get("provider") or tier.get("base_url") or "openai"  # Whose rate limits apply, see ratelimit.py
+        return {"tier": name, "client": client, "provider": provider, "budget": budget, "fallback": is_fallback}
+
+    @contextlib.contextmanager
+    def track(self, node: str, route: dict):
+        """ Time the LLM call made in this block, count its tokens and record it for node and the route's tier """
+        collector = _usage_collector_class()()
+        token = _usage_collector.set(collector)
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException as e:
+            outcome = "timeout" if is_timeout(e) else "error"
+            raise
+        finally:
+            _usage_collector.reset(token)
+            self.record(node, route, time.perf_counter() - start, collector.input_tokens, collector.output_tokens, outcome)
+
+    def record(self, node: str, route: dict, seconds: float, input_tokens: int = 0, output_tokens: int = 0, outcome: str = "ok") -> None:
+        tier = self.tiers[route["tier"]]
+        cost = (input_tokens * tier.get("input_cost_per_mtok", 0) + output_tokens * tier.get("output_cost_per_mtok", 0)) / 1e6
+        with self._lock:
+            entry = self._stats.setdefault((node, route["tier"]), {
+                "calls": 0, "timeouts": 0, "errors": 0, "fallbacks": 0, "seconds": 0.0,
+                "latencies": collections.deque(maxlen=LATENCY_SAMPLE_SIZE),
+                "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0,
+            })
+            entry["calls"] += 1
+            entry["timeouts"] += outcome == "timeout"
+            entry["errors"] += outcome == "error"
+            entry["fallbacks"] += route["fallback"]
+            entry["seconds"] += seconds
+            entry["latencies"].append(seconds)
+            entry["input_tokens"] += input_tokens
+            entry["output_tokens"] += output_tokens
+            entry["cost_usd"] += cost
+
+    def stats(self) -> list[dict]:
+        """
+        Per node and tier: calls, timeouts, errors, calls served as fallback, latency statistics, tokens and cost.
+        The p95 latency is that of the last LATENCY_SAMPLE_SIZE calls
+        """
+        with self._lock:
+            items = [(key, dict(entry, latencies=list(entry["latencies"]))) for key, entry in self._stats.items()]
+        stats = []
+        for (node, tier), entry in sorted(items):
+            latencies, seconds = sorted(entry.pop("latencies")), entry.pop("seconds")
+            stats.append({
+                "node": node,
+                "tier": tier,
+                "model": self.tiers[tier]["model"],
+                **entry,
+                "mean_ms": seconds / entry["calls"] * 1000,
+                "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+            })
+        return stats
+
+
+def is_timeout(error: BaseException) -> bool:
+    """ Whether an LLM call failed because it ran out of time (its latency budget) """
+    import httpx
+    from openai import APITimeoutError
+    return isinstance(error, (TimeoutError, httpx.TimeoutException, APITimeoutError))
+
+
+def format_stats(stats: list[dict]) -> str:
+    """ Render Router.stats() as a table """
+    lines = [f"{'node':<22}  {'tier (model)':<26}  {'calls':>5}  {'mean':>9}  {'p95':>9}  {'tokens in/out':>15}  {'cost':>9}  {'timeouts':>8}  {'fallbacks':>9}"]
+    for entry in stats:
+        tier = f"{entry['tier']} ({entry['model']})"
+        lines.append(
+            f"{entry['node']:<22}  {tier:<26}  {entry['calls']:>5}  {entry['mean_ms']:>7.0f}ms  {entry['p95_ms']:>7.0f}ms  "
+            f"{str(entry['input_tokens']) + '/' + str(entry['output_tokens']):>15}  ${entry['cost_usd']:>8.4f}  "
+            f"{entry['timeouts']:>8}  {entry['fallbacks']:>9}"
+        )
+    return "\n".join(lines)
+
+
+
+
+""" Default router """
+
+_default_router: Router | None = None
+_default_lock = threading.Lock()
+
+
+def load_routing_config(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_router() -> Router:
+    """ Return the process-wide router, built from the JSON file at AGENT_ROUTING_CONFIG (every node on DEFAULT_MODEL if not set) """
+    global _default_router
+    with _default_lock:
+        if _default_router is None:
+            path = os.getenv("AGENT_ROUTING_CONFIG")
+            _default_router = Router(load_routing_config(path) if path else None)
+        return _default_router
+
+
+def configure_router(router: Router | None) -> None:
+    """ Replace the process-wide router. None goes back to the one from AGENT_ROUTING_CONFIG """
+    global _default_router
+    with _default_lock:
+        _default_router = router
@@ -0,0 +1,33 @@
+from typing import Literal
+from pydantic import BaseModel, Field
+
+"""
+Structured output schemas of the agent's LLM calls: the to-do list (generate_todos) and the verdicts on task
+results (reflect). They are kept apart from agent.py so importing the agent does not import pydantic; the nodes
+import them when they call the LLM.
+"""
+
+
+class TaskSchema(BaseModel):
+    """ Schema by which an LLM can generate a single task """
+    id: int = Field(description="Unique identifier for the task") # We shall see if the id thing actually works
+    title: str = Field(description="Title of the task")
+    description: str = Field(description="Brief description of the task")
+    depends_on: list[int] = Field(default_factory=list, description="IDs of the earlier tasks whose results this task needs. Empty if the task is independent")
+
+class TodoListSchema(BaseModel):
+    """ Schema for a list of tasks """
+    tasks: list[TaskSchema] = Field(description="List of tasks generated from the goal")
+
+class ReflectionSchema(BaseModel):
+    """ Schema for the LLM's verdict on the result of a task """
+    status: Literal["successful", "failed", "needs follow-up"] = Field(description="Label for the task, based on its result")
+    explanation: str = Field(description="Summary of the result and the reason for the label, in no more than three sentences")
+
+class TaskVerdictSchema(ReflectionSchema):
+    """ Schema for the verdict on one task of a batch """
+    task_id: int = Field(description="ID of the task the verdict is for")
+
+class BatchReflectionSchema(BaseModel):
+    """ Schema for the verdicts on a batch of tasks """
+    verdicts: list[TaskVerdictSchema] = Field(description="One verdict per task in the batch")
@@ -0,0 +1,281 @@
+import asyncio
+import collections
+import concurrent.futures
+import os
+import re
+import sqlite3
+import threading
+import time
+
+"""
+TTL cache with in-flight deduplication for web searches.
+
+Within one goal, and across goals running in the same process, web_search is often called with the same or
+trivially different queries ("Latest AI news", "latest  AI news?"). SearchCache normalizes the query and
+serves repeated searches from memory (and optionally from a SQLite file shared between processes) until their TTL expires.
+
+Concurrent identical searches share one request: the first caller fetches, every other caller - thread or asyncio
+task - waits on the same future. Failed searches are never cached.
+
+stats() reports hits, misses, deduplicated waits and evictions so operators can see how well the cache works.
+"""
+
+_PUNCTUATION = re.compile(r"[^\w\s'+#.-]|(?<!\w)[.'-]|[.'-](?!\w)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """ Case-fold the query, drop punctuation around words and collapse whitespace """
+    query = _PUNCTUATION.sub(" ", query.casefold())
+    return _WHITESPACE.sub(" ", query).strip()
+
+
+class SearchCache:
+    """
+    Normalized-query cache for search results.
+
+    Args:
+        ttl_seconds: How long a result stays valid
+        max_bytes: Memory limit for cached results; least recently used results are evicted first
+        path: Optional SQLite file for a second, on-disk tier shared between processes
+        max_disk_bytes: Size limit of the on-disk tier
+    """
+
+    def __init__(self, ttl_seconds: float = 3600, max_bytes: int = 32 * 1024 * 1024, path: str | None = None,
+                 max_disk_bytes: int = 256 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.path = path
+        self._entries: collections.OrderedDict[str, tuple[float, str]] = collections.OrderedDict()  # key -> (created_at, result)
+        self._bytes = 0
+        self._in_flight: dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()  # Guards the memory tier and the in-flight map; never held during disk I/O
+        self._disk_lock = threading.Lock()  # Guards the SQLite connection
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "deduplicated": 0, "evictions": 0}
+
+        self._conn = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS searches (key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    def get_or_fetch(self, query: str, fetch, namespace: str = "") -> str:
+        """
+        Return the cached result for query, or call fetch() once to get it.
+        Callers asking for the same query while it is being fetched wait for that fetch instead of starting their own.
+
+        Args:
+            query: The search query; normalized before lookup
+            fetch: Function that performs the search and returns its result. Exceptions are passed on to every waiting
+                caller; if the fetching caller is interrupted instead (cancelled, KeyboardInterrupt), a waiting caller fetches again
+            namespace: Extra key part for searches with different parameters (e.g. max_results)
+        """
+        key = f"{namespace}|{normalize_query(query)}"
+        while True:
+            cached, future, leader = self._claim(key)
+            if cached is not None:
+                return cached
+            if not leader:
+                try:
+                    return future.result()
+                except _Abandoned:
+                    continue  # The fetching caller was interrupted: fetch again, or wait for whoever does
+
+            try:
+                result = fetch()
+            except Exception as e:
+                self._release(key, future, error=e)
+                raise
+            except BaseException:
+                self._abandon(key, future)
+                raise
+            self._release(key, future, result=result)
+            return result
+
+    async def aget_or_fetch(self, query: str, afetch, namespace: str = "") -> str:
+        """ Async version of get_or_fetch(). afetch is an async function; waiting does not block the event loop """
+        key = f"{namespace}|{normalize_query(query)}"
+        while True:
+            cached, future, leader = self._claim(key)
+            if cached is not None:
+                return cached
+            if not leader:
+                try:
+                    # Shielded: a waiter that is cancelled must not cancel the fetch the other callers wait for
+                    return await asyncio.shield(asyncio.wrap_future(future))
+                except _Abandoned:
+                    continue
+
+            try:
+                result = await afetch()
+            except Exception as e:
+                self._release(key, future, error=e)
+                raise
+            except BaseException:  # Cancelled (e.g. a speculative task or a service shutdown): only this caller stops
+                self._abandon(key, future)
+                raise
+            self._release(key, future, result=result)
+            return result
+
+    def _claim(self, key: str) -> tuple[str | None, concurrent.futures.Future | None, bool]:
+        """ Look key up. Returns (cached result, None, False), (None, in-flight future, False) or (None, new future, True) if the caller has to fetch """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return entry[1], None, False
+                self._drop(key)
+
+            if key in self._in_flight:
+                self._counters["deduplicated"] += 1
+                return None, self._in_flight[key], False
+
+            # Claimed before the disk lookup, so callers of the same query wait for it instead of looking it up too
+            future = concurrent.futures.Future()
+            self._in_flight[key] = future
+
+        try:
+            disk_entry = self._disk_get(key, now)
+        except Exception as e:
+            self._release(key, future, error=e)
+            raise
+        except BaseException:
+            self._abandon(key, future)
+            raise
+        with self._lock:
+            if disk_entry is None:
+                self._counters["misses"] += 1
+                return None, future, True
+            del self._in_flight[key]
+            self._store(key, *disk_entry)
+            self._counters["disk_hits"] += 1
+        future.set_result(disk_entry[1])
+        return disk_entry[1], None, False
+
+    def _release(self, key: str, future: concurrent.futures.Future, result: str | None = None, error: BaseException | None = None) -> None:
+        """ Publish the outcome of a fetch to the waiting callers and cache successful results """
+        cache = error is None and not _is_error(result)
+        now = time.time()
+        with self._lock:
+            del self._in_flight[key]
+            if cache:
+                self._store(key, now, result)
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        if cache:
+            self._disk_put(key, now, result)
+
+    def _abandon(self, key: str, future: concurrent.futures.Future) -> None:
+        """ Give up a fetch that was interrupted (cancelled, KeyboardInterrupt): the waiting callers claim the query again """
+        with self._lock:
+            del self._in_flight[key]
+        future.set_exception(_Abandoned())
+
+    def _store(self, key: str, created_at: float, result: str) -> None:
+        """ Add an entry to the memory tier and evict least recently used entries over the limit. Called with the lock held """
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (created_at, result)
+        self._bytes += len(result)
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+            self._counters["evictions"] += 1
+
+    def _drop(self, key: str) -> None:
+        _, result = self._entries.pop(key)
+        self._bytes -= len(result)
+
+    def _disk_get(self, key: str, now: float) -> tuple[float, str] | None:
+        if self._conn is None:
+            return None
+        with self._disk_lock:
+            row = self._conn.execute("SELECT created_at, result FROM searches WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row[0] > self.ttl_seconds:
+            return None
+        return row[0], row[1]
+
+    def _disk_put(self, key: str, created_at: float, result: str) -> None:
+        if self._conn is None:
+            return
+        with self._disk_lock:
+            self._conn.execute("INSERT OR REPLACE INTO searches (key, result, created_at) VALUES (?, ?, ?)", (key, result, created_at))
+            self._conn.execute("DELETE FROM searches WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            size = self._conn.execute("SELECT COALESCE(SUM(LENGTH(result)), 0) FROM searches").fetchone()[0]
+            if size > self.max_disk_bytes:
+                # Drop the oldest tenth of the entries
+                count = self._conn.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+                self._conn.execute("DELETE FROM searches WHERE key IN (SELECT key FROM searches ORDER BY created_at LIMIT ?)", (max(1, count // 10),))
+
+    def stats(self) -> dict:
+        """ Hit/miss counters and current size of the cache """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["in_flight"] = len(self._in_flight)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"] + stats["deduplicated"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self._conn is not None:
+            with self._disk_lock:
+                self._conn.execute("DELETE FROM searches")
+
+
+class _Abandoned(Exception):
+    """ Set on the future of a fetch whose caller was interrupted, so the callers waiting for it claim the query again """
+
+
+def _is_error(result) -> bool:
+    return not isinstance(result, str) or result.startswith(("Error:", "Search error:", "Unexpected response type"))
+
+
+
+
+""" Default cache """
+
+_default_cache: SearchCache | None = None
+_configured = False
+_default_lock = threading.Lock()
+
+
+def get_search_cache() -> SearchCache | None:
+    """
+    Return the process-wide search cache, or None if it is turned off (AGENT_SEARCH_CACHE=0).
+    AGENT_SEARCH_CACHE_TTL (seconds, default 3600), AGENT_SEARCH_CACHE_MAX_MB (memory, default 32) and
+    AGENT_SEARCH_CACHE_PATH (optional SQLite file shared between processes) configure it.
+    """
+    global _default_cache, _configured
+    with _default_lock:
+        if not _configured:
+            _configured = True
+            if os.getenv("AGENT_SEARCH_CACHE", "1").strip().lower() not in ("0", "false", "no", "off"):
+                _default_cache = SearchCache(
+                    ttl_seconds=float(os.getenv("AGENT_SEARCH_CACHE_TTL", "3600")),
+                    max_bytes=int(float(os.getenv("AGENT_SEARCH_CACHE_MAX_MB", "32")) * 1024 * 1024),
+                    path=os.getenv("AGENT_SEARCH_CACHE_PATH") or None,
+                )
+        return _default_cache
+
+
+def configure_search_cache(cache: SearchCache | None) -> None:
+    """ Replace the process-wide search cache. None turns caching off """
+    global _default_cache, _configured
+    with _default_lock:
+        _default_cache = cache
+        _configured = True
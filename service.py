@@ -0,0 +1,375 @@
+from agent import create_agent_graph, new_agent_state, new_run_config
+from checkpointer import DEFAULT_CHECKPOINT_PATH, get_checkpointer
+from result_store import configure_result_store
+from ratelimit import get_rate_limiter
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+import uuid
+
+"""
+Long-running agent service: a local HTTP server that runs submitted goals on a worker pool.
+
+Starting `python main.py` per goal pays the langchain/langgraph imports and the graph compilation every time, and
+nothing can be submitted from outside the process. AgentService compiles the graph once, accepts goals into a
+bounded queue and runs them on `workers` concurrent workers, each goal (job) with its own thread id.
+
+    python service.py --port 8765 --workers 8 --queue-size 100
+    python service.py --unix /tmp/agent.sock
+
+HTTP API (JSON):
+- POST /jobs {"goal": "...", "config": {...}}  -> 202 with the job; 429 with Retry-After when the queue is full;
+                                                 400 for a config with keys other than RUN_CONFIG_KEYS;
+                                                 413 for a body over AGENT_SERVICE_MAX_BODY_BYTES (1 MiB)
+- GET /jobs/<id>                                -> status (queued, running, done, failed), progress events, output
+- GET /jobs/<id>/events                         -> the job's progress events as they happen (NDJSON, chunked)
+- GET /metrics                                  -> queue depth, worker utilization, job counts, wait/run times, rate limits
+- GET /health
+
+The nodes' own terminal output is hidden unless --verbose is given. Finished jobs are kept (up to max_finished_jobs)
+so their results can be fetched.
+"""
+
+
+class QueueFullError(Exception):
+    """ Raised by AgentService.submit() when the job queue is full """
+
+
+# Run settings a job may set in its "config" (see agent.new_run_config()), with a check of their values
+RUN_CONFIG_KEYS = {
+    "max_concurrency": lambda value: type(value) is int and value >= 1,
+    "speculate": lambda value: type(value) is bool,
+    "reflection_batch_size": lambda value: type(value) is int and value >= 1,
+    "reflection_max_wait_s": lambda value: type(value) in (int, float) and value >= 0,
+}
+
+
+def check_run_config(config) -> dict:
+    """ The run settings of a job. Raises ValueError for anything but a dict of RUN_CONFIG_KEYS with valid values """
+    if config is None:
+        return {}
+    if not isinstance(config, dict):
+        raise ValueError("'config' must be an object")
+    for key, value in config.items():
+        if key not in RUN_CONFIG_KEYS:
+            raise ValueError(f"Unknown config key '{key}', expected one of: {', '.join(RUN_CONFIG_KEYS)}")
+        if not RUN_CONFIG_KEYS[key](value):
+            raise ValueError(f"Invalid value {value!r} for config key '{key}'")
+    return dict(config)
+
+
+class Job:
+    """ One submitted goal: its status, progress events and result """
+
+    def __init__(self, goal: str, config: dict | None = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.goal = goal
+        self.config = config or {}
+        self.status = "queued"
+        self.submitted_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.events: list[dict] = []
+        self.output: str | None = None
+        self.tasks: list[dict] = []
+        self.error: str | None = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    async def add_event(self, event: dict) -> None:
+        async with self._changed:
+            self.events.append({"elapsed_s": round(time.time() - self.submitted_at, 3), **event})
+            self._changed.notify_all()
+
+    async def wait_for_events(self, seen: int) -> None:
+        """ Wait until there are more than `seen` events or the job is finished """
+        async with self._changed:
+            await self._changed.wait_for(lambda: len(self.events) > seen or self.finished)
+
+    def to_dict(self, events: bool = True) -> dict:
+        job = {
+            "id": self.id, "goal": self.goal, "status": self.status, "submitted_at": self.submitted_at,
+            "started_at": self.started_at, "finished_at": self.finished_at,
+            "output": self.output, "tasks": self.tasks, "error": self.error,
+        }
+        if events:
+            job["events"] = self.events
+        return job
+
+
+class AgentService:
+    """
+    Runs submitted goals on a pool of workers sharing one compiled graph.
+
+    Args:
+        app: Compiled graph; compiled with the default checkpointer if not given
+        workers: Number of goals run at the same time
+        queue_size: Maximum number of jobs waiting for a worker; submit() raises QueueFullError beyond it
+        max_finished_jobs: Finished jobs kept for status requests; the oldest are dropped first
+    """
+
+    def __init__(self, app=None, workers: int = 4, queue_size: int = 100, max_finished_jobs: int = 1000):
+        self.app = app or create_agent_graph()
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: dict[str, Job] = {}
+        self._queue: asyncio.Queue | None = None
+        self._worker_tasks: list[asyncio.Task] = []
+        self._busy = 0
+        self._busy_seconds = 0.0
+        self._started_at: float | None = None
+        self._counters = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0}
+        self._wait_seconds = 0.0
+        self._run_seconds = 0.0
+
+    async def start(self) -> None:
+        """ Start the workers on the running event loop """
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._started_at = time.perf_counter()
+        self._worker_tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """ Cancel the workers; running jobs are marked failed """
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def submit(self, goal: str, config: dict | None = None) -> Job:
+        """
+        Queue a goal. Raises QueueFullError when queue_size jobs are already waiting (backpressure),
+        and ValueError when config is not valid (see check_run_config())
+        """
+        job = Job(goal, check_run_config(config))
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._counters["rejected"] += 1
+            raise QueueFullError(f"The job queue is full ({self.queue_size} jobs waiting)") from None
+        self.jobs[job.id] = job
+        self._counters["submitted"] += 1
+        return job
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            self._busy += 1
+            start = time.perf_counter()
+            try:
+                await self._run(job)
+            finally:
+                self._busy -= 1
+                self._busy_seconds += time.perf_counter() - start
+                self._queue.task_done()
+                self._forget_finished()
+
+    async def _run(self, job: Job) -> None:
+        job.status, job.started_at = "running", time.time()
+        self._wait_seconds += job.started_at - job.submitted_at
+        await job.add_event({"event": "started"})
+        config = new_run_config(thread_id=job.id, **job.config)
+        try:
+            async for chunk in self.app.astream(new_agent_state(job.goal), config, stream_mode="updates"):
+                for node, update in chunk.items():
+                    tasks = [{"id": t["id"], "status": t["status"]} for t in (update or {}).get("tasks") or []]
+                    await job.add_event({"event": "node", "node": node, **({"tasks": tasks} if tasks else {})})
+            state = (await self.app.aget_state(config)).values
+            job.output = state.get("output")
+            job.tasks = [{"id": t["id"], "title": t["title"], "status": t["status"]} for t in state.get("tasks") or []]
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status, job.error = "failed", "The service stopped"
+            raise
+        except Exception as e:
+            job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+        finally:
+            job.finished_at = time.time()
+            self._run_seconds += job.finished_at - job.started_at
+            self._counters[job.status] += 1
+            await job.add_event({"event": job.status})
+
+    def _forget_finished(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    def metrics(self) -> dict:
+        """
+        Queue depth, worker utilization (busy time over uptime, and right now), job counts, mean wait and run times and
+        the rate limiter's stats per provider
+        """
+        uptime = time.perf_counter() - self._started_at if self._started_at else 0.0
+        # Include the time the currently running jobs have been busy so far
+        running_seconds = sum(time.time() - job.started_at for job in self.jobs.values() if job.status == "running")
+        finished = self._counters["done"] + self._counters["failed"]
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_capacity": self.queue_size,
+            "workers": self.workers,
+            "workers_busy": self._busy,
+            "worker_utilization": (self._busy_seconds + running_seconds) / (uptime * self.workers) if uptime else 0.0,
+            "uptime_s": uptime,
+            **{f"jobs_{name}": count for name, count in self._counters.items()},
+            "mean_wait_s": self._wait_seconds / (finished + self._busy) if finished + self._busy else 0.0,
+            "mean_run_s": self._run_seconds / finished if finished else 0.0,
+            "rate_limits": get_rate_limiter().stats(),
+        }
+
+
+
+
+""" HTTP server """
+
+_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Content Too Large", 429: "Too Many Requests"}
+
+# Largest request body read into memory (a goal and its config); larger requests are answered with 413
+MAX_BODY_BYTES = int(os.getenv("AGENT_SERVICE_MAX_BODY_BYTES", str(1024 * 1024)))
+
+
+async def _respond(writer: asyncio.StreamWriter, status: int, body: dict, headers: dict | None = None) -> None:
+    data = json.dumps(body).encode()
+    head = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", "Content-Type: application/json",
+            f"Content-Length: {len(data)}", "Connection: close"]
+    head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+    await writer.drain()
+
+
+async def _stream_events(writer: asyncio.StreamWriter, job: Job) -> None:
+    """ Send the job's events as NDJSON in chunked encoding, as they happen, until the job is finished """
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+    seen = 0
+    while True:
+        events, finished = job.events[seen:], job.finished
+        seen += len(events)
+        for event in events:
+            line = (json.dumps(event) + "\n").encode()
+            writer.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        await writer.drain()
+        if finished and seen == len(job.events):
+            break
+        await job.wait_for_events(seen)
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+async def handle_request(service: AgentService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """ Serve one HTTP request (the connection is closed afterwards) """
+    try:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        headers = {}
+        while (line := (await reader.readline()).decode("latin-1").strip()):
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if len(request_line) < 2:
+            return
+        length = headers.get("content-length", "0")
+        if not length.isdigit():
+            return await _respond(writer, 400, {"error": f"Invalid Content-Length '{length}'"})
+        if int(length) > MAX_BODY_BYTES:
+            return await _respond(writer, 413, {"error": f"The body is larger than {MAX_BODY_BYTES} bytes"})
+        body = await reader.readexactly(int(length))
+        method, path = request_line[0], request_line[1].split("?")[0].rstrip("/")
+        parts = path.strip("/").split("/")
+
+        if path == "/jobs" and method == "POST":
+            try:
+                request = json.loads(body or b"{}")
+            except ValueError:
+                return await _respond(writer, 400, {"error": "The body must be JSON"})
+            if not isinstance(request, dict) or not isinstance(request.get("goal"), str) or not request["goal"].strip():
+                return await _respond(writer, 400, {"error": "A non-empty 'goal' is required"})
+            try:
+                job = service.submit(request["goal"].strip(), request.get("config"))
+            except QueueFullError as e:
+                return await _respond(writer, 429, {"error": str(e)}, {"Retry-After": "5"})
+            except ValueError as e:
+                return await _respond(writer, 400, {"error": str(e)})
+            return await _respond(writer, 202, job.to_dict(events=False), {"Location": f"/jobs/{job.id}"})
+
+        if parts[0] == "jobs" and len(parts) in (2, 3) and method == "GET":
+            job = service.jobs.get(parts[1])
+            if job is None:
+                return await _respond(writer, 404, {"error": f"No job '{parts[1]}'"})
+            if len(parts) == 3 and parts[2] == "events":
+                return await _stream_events(writer, job)
+            return await _respond(writer, 200, job.to_dict())
+
+        if path == "/metrics" and method == "GET":
+            return await _respond(writer, 200, service.metrics())
+        if path == "/health" and method == "GET":
+            return await _respond(writer, 200, {"status": "ok"})
+        return await _respond(writer, 404 if method in ("GET", "POST") else 405, {"error": f"No route for {method} {path}"})
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass  # The client went away
+    finally:
+        writer.close()
+
+
+async def serve(service: AgentService, host: str = "127.0.0.1", port: int = 8765, unix_path: str | None = None):
+    """ Start the service's workers and its HTTP server (TCP, or a Unix socket at unix_path). Returns the asyncio server """
+    await service.start()
+    handler = lambda reader, writer: handle_request(service, reader, writer)
+    if unix_path:
+        return await asyncio.start_unix_server(handler, path=unix_path)
+    return await asyncio.start_server(handler, host, port)
+
+
+
+
+""" Entry point """
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the agent as a local HTTP service")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument("--unix", metavar="PATH", help="Listen on a Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=4, help="Goals run at the same time (default: 4)")
+    parser.add_argument("--queue-size", type=int, default=100, help="Jobs that can wait for a worker (default: 100)")
+    parser.add_argument("--checkpoint-db", default=os.getenv("AGENT_CHECKPOINT_DB", DEFAULT_CHECKPOINT_PATH),
+                        help=f"SQLite file for checkpoints (default: {DEFAULT_CHECKPOINT_PATH})")
+    parser.add_argument("--verbose", action="store_true", help="Show the agent's output (interleaved between jobs)")
+    return parser.parse_args(argv)
+
+
+async def amain(args: argparse.Namespace):
+    load_dotenv()
+    if not os.getenv("OPENAI_API_KEY"):
+        print("Error: OPENAI_API_KEY not found in .env file")
+        return
+
+    checkpointer = get_checkpointer(args.checkpoint_db)
+    if not os.getenv("AGENT_RESULT_STORE_DIR"):
+        configure_result_store(directory=os.path.join(os.path.dirname(args.checkpoint_db) or ".", "results"))
+    service = AgentService(create_agent_graph(checkpointer), workers=args.workers, queue_size=args.queue_size)
+    server = await serve(service, args.host, args.port, args.unix)
+    where = args.unix or f"http://{args.host}:{args.port}"
+    print(f"Agent service listening on {where} ({args.workers} workers, queue of {args.queue_size})", file=sys.stderr)
+
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await service.stop()
+
+
+def main():
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(amain(parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import queue
+import sys
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+"""
+Token streaming to the terminal.
+
+The nodes used to print an LLM response only once it was complete, so the user saw nothing for seconds at a time
+and the final summary arrived as one block. arun_goal() can stream the graph with stream_mode="messages" instead:
+LangGraph then streams every chat model call made inside a node, and TokenRenderer prints the tokens of
+execute_task and reflect_and_complete as they arrive. (reflect asks for a structured verdict, whose raw JSON is not
+worth showing; the node prints the verdict once it is parsed.)
+
+Key Components:
+- TokenRenderer: Feeds on the (message chunk, metadata) pairs of the messages stream. It only queues text, a writer
+  thread does the terminal I/O, so a slow terminal never blocks the event loop. Parallel branches stream at the same
+  time: one stream is shown live, the others are buffered and shown as soon as the live one ends.
+- TimeToFirstTokenHandler: Callback handler that records the time to first token of every LLM call, per node.
+"""
+
+# Nodes whose LLM output is shown, with the label printed before it (the same labels the nodes print otherwise)
+STREAMED_NODES = {
+    "execute_task": "LLM Response: ",
+    "reflect_and_complete": "\n" + "=" * 50 + "\nFINAL RESULT\n" + "=" * 50 + "\n",
+}
+
+
+class _Stream:
+    def __init__(self, node: str, label: str):
+        self.node = node
+        self.label = label
+        self.parts: list[str] = []
+        self.started = False  # Label written
+        self.done = False
+
+
+class TokenRenderer:
+    """
+    Renders streamed LLM tokens to a terminal without blocking the caller.
+
+    Args:
+        out: Stream to write to, sys.stdout if not given
+        nodes: Node name -> label of the nodes whose output is rendered
+    """
+
+    def __init__(self, out=None, nodes: dict[str, str] | None = None):
+        self.out = out
+        self.nodes = STREAMED_NODES if nodes is None else nodes
+        self.started_at = time.perf_counter()
+        self.first_output_at: float | None = None
+        self.shown_nodes: set[str] = set()  # Nodes whose output was rendered
+        self._streams: dict[str, _Stream] = {}  # Message id -> stream, in order of arrival
+        self._live: str | None = None
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_loop, name="token-renderer", daemon=True)
+        self._writer.start()
+
+    @property
+    def time_to_first_output(self) -> float | None:
+        """ Seconds from the creation of the renderer to the first rendered token """
+        return None if self.first_output_at is None else self.first_output_at - self.started_at
+
+    def feed(self, message, metadata: dict) -> None:
+        """ Handle one item of the messages stream: a message chunk (or complete message) and its metadata """
+        node = metadata.get("langgraph_node")
+        label = self.nodes.get(node)
+        if label is None or not getattr(message, "id", None):
+            return
+
+        stream = self._streams.get(message.id)
+        if stream is None:
+            stream = self._streams[message.id] = _Stream(node, label)
+        text = message.text if isinstance(message.text, str) else ""
+        if text:
+            stream.parts.append(text)
+        # A complete message (not a chunk) arrives for calls that were not streamed
+        if getattr(message, "chunk_position", None) == "last" or type(message).__name__ != "AIMessageChunk":
+            stream.done = True
+
+        if self._live is None:
+            self._live = message.id
+        if message.id == self._live:
+            self._show_live()
+
+    def _show_live(self) -> None:
+        """ Write the live stream's new text. Once it is done, write the finished buffered streams and pick the next live one """
+        while self._live is not None:
+            stream = self._streams[self._live]
+            self._write(stream)
+            if not stream.done:
+                return
+            del self._streams[self._live]
+            self._live = next(iter(self._streams), None)
+
+    def _write(self, stream: _Stream) -> None:
+        if stream.parts:
+            if self.first_output_at is None:
+                self.first_output_at = time.perf_counter()
+            text = "".join(stream.parts)
+            stream.parts.clear()
+            if not stream.started:
+                text = stream.label + text
+                stream.started = True
+                self.shown_nodes.add(stream.node)
+            self._queue.put(text)
+        if stream.done and stream.started:
+            self._queue.put("\n")
+
+    def _write_loop(self) -> None:
+        while True:
+            text = self._queue.get()
+            if text is None:
+                return
+            out = self.out or sys.stdout
+            out.write(text)
+            out.flush()
+
+    def close(self) -> None:
+        """ Write what is still buffered and wait until everything is written """
+        for stream in self._streams.values():
+            stream.done = True
+        if self._live is None:
+            self._live = next(iter(self._streams), None)
+        self._show_live()
+        self._queue.put(None)
+        self._writer.join()
+
+
+
+
+""" Time to first token """
+
+class TimeToFirstTokenHandler(BaseCallbackHandler):
+    """
+    Records the time to first token of every chat model call, per graph node.
+    Calls that are not streamed count the time to their complete response.
+    """
+
+    def __init__(self):
+        self._started: dict = {}  # Run id -> (node, start time)
+        self._samples: dict[str, list[float]] = {}  # Node -> seconds to first token
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs) -> None:
+        node = (metadata or {}).get("langgraph_node", "unknown")
+        with self._lock:
+            self._started[run_id] = (node, time.perf_counter())
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs) -> None:
+        if token:
+            self._record(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        self._record(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        with self._lock:
+            self._started.pop(run_id, None)
+
+    def _record(self, run_id) -> None:
+        with self._lock:
+            started = self._started.pop(run_id, None)
+            if started is not None:
+                node, start = started
+                self._samples.setdefault(node, []).append(time.perf_counter() - start)
+
+    def summary(self) -> dict[str, dict]:
+        """ Per node: number of calls and mean, median and maximum time to first token in milliseconds """
+        with self._lock:
+            samples = {node: sorted(values) for node, values in self._samples.items()}
+        return {
+            node: {
+                "calls": len(values),
+                "mean_ms": sum(values) / len(values) * 1000,
+                "p50_ms": values[len(values) // 2] * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+            for node, values in samples.items()
+        }
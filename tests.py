@@ -1,4 +1,27 @@
 from agent import *
+from schemas import *
+from tools import *
+import clients
+import history
+import result_store
+import llm_cache
+import search_cache
+import checkpointer
+import schemas
+import tools
+import streaming
+import asyncio
+import io
+import itertools
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from langchain_core.messages import AIMessage
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from typing import Any
 
 
 """
@@ -24,6 +47,105 @@ def test_pydantic_schemas():
         print(f"test_pydantic_schemas exception: {e}")
 
 
+""" Offline test helpers """
+
+class FakeLLM:
+    """ 
+    Stand-in for the shared ChatOpenAI client, so graph tests run without API calls.
+    Structured to-do lists return `plan`, every other call returns `content` after `delay` seconds
+    (structured reflections as "successful" verdicts explained by `content`).
+    """
+    def __init__(self, plan=None, content="The task was successful.", delay=0.0):
+        self.plan = plan
+        self.content = content
+        self.delay = delay
+        self.calls = []
+
+    def with_structured_output(self, schema):
+        fake = self
+        class Structured:
+            def invoke(self, prompt):
+                return fake.verdict(schema, prompt, fake.invoke(prompt).content) if schema is not TodoListSchema else fake.plan
+            async def ainvoke(self, prompt):
+                return fake.verdict(schema, prompt, (await fake.ainvoke(prompt)).content) if schema is not TodoListSchema else fake.plan
+        return Structured()
+
+    @staticmethod
+    def verdict(schema, prompt: str, content: str):
+        """ "successful" verdict for a reflection prompt, one per task id for batched reflections """
+        if schema is BatchReflectionSchema:
+            return BatchReflectionSchema(verdicts=[
+                TaskVerdictSchema(task_id=int(task_id), status="successful", explanation=content) for task_id in re.findall(r"Task #(\d+)", prompt)
+            ])
+        return ReflectionSchema(status="successful", explanation=content)
+
+    def bind_tools(self, tools):
+        return self
+
+    def invoke(self, prompt):
+        self.calls.append((time.perf_counter(), prompt))
+        time.sleep(self.delay)
+        return AIMessage(content=self.content)
+
+    async def ainvoke(self, prompt):
+        self.calls.append((time.perf_counter(), prompt))
+        await asyncio.sleep(self.delay)
+        return AIMessage(content=self.content)
+
+
+class StreamingFakeLLM(GenericFakeChatModel):
+    """ Chat model that streams `content` word by word, `chunk_delay` seconds per word. Structured output as in FakeLLM """
+    plan: Any = None
+    chunk_delay: float = 0.0
+
+    def with_structured_output(self, schema, **kwargs):
+        return FakeLLM(plan=self.plan).with_structured_output(schema)
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _stream(self, *args, **kwargs):
+        for chunk in super()._stream(*args, **kwargs):
+            time.sleep(self.chunk_delay)
+            yield chunk
+
+
+def streaming_fake_llm(content: str, plan=None, chunk_delay: float = 0.0) -> StreamingFakeLLM:
+    return StreamingFakeLLM(messages=itertools.cycle([AIMessage(content=content)]), plan=plan, chunk_delay=chunk_delay)
+
+
+@contextmanager
+def fake_llm_client(fake_llm):
+    """ Replace the shared LLM client used by the agent nodes with fake_llm """
+    original = clients.get_llm
+    clients.get_llm = lambda *args, **kwargs: fake_llm
+    try:
+        yield fake_llm
+    finally:
+        clients.get_llm = original
+
+
+def run_offline(fake_llm, state: dict, config: dict | None = None) -> dict:
+    """ Run the whole graph with fake_llm in place of the shared LLM client and return the final state """
+    with fake_llm_client(fake_llm):
+        app = create_agent_graph()
+        config = {"configurable": {"thread_id": "test", **(config or {})}, "recursion_limit": 100}
+        return app.invoke(state, config)
+
+
+def new_state(goal: str = "Plan a birthday party") -> dict:
+    return {
+        "goal": goal,
+        "mode": "auto",
+        "tasks": None,
+        "current_task_id": None,
+        "active_task_ids": [],
+        "approved": True,
+        "conversation_history": [],
+        "output": None
+    }
+
+
 """ Test agent nodes """
 
 def test_generate_todos_node(state: AgentState | None = None): # You can test a custom state, otherwise default state is tested
@@ -122,6 +244,1600 @@ def test_reflect_and_complete_node(state: AgentState | None = None):
         print(f"test_reflect_and_complete_node exception: {e}")
 
 
+def test_fast_reflection():
+    """ Tests that unambiguous tool outcomes are reflected on without an LLM call and the rest get a structured verdict """
+    def executed(task_id: int, calls: list[tuple[str, str]]) -> Task:
+        task = {"id": task_id, "title": f"Task {task_id}", "description": "", "depends_on": [], "status": "pending", "result": None, "reflection": None}
+        tool_calls = [{"name": name, "args": {}, "id": str(i)} for i, (name, _) in enumerate(calls)]
+        outcomes = [{**call, "found": name != "missing_tool", "result": result} for call, (name, result) in zip(tool_calls, calls)]
+        return finish_task(task, [], AIMessage(content="", tool_calls=tool_calls), outcomes)["tasks"][0]
+
+    try:
+        wrote = executed(1, [("write_file", "Successfully wrote 12 characters to 'a.md'"), ("append_to_file", "Successfully appended 3 characters to 'a.md'")])
+        broken = executed(2, [("read_file", "Error: File 'b.md' not found"), ("missing_tool", "")])
+        searched = executed(3, [("web_search", "The search was not successful in finding X")])
+        mixed = executed(4, [("write_file", "Successfully wrote 1 characters to 'c.md'"), ("web_search", "Search error: TimeoutError: ")])
+        assert wrote["tool_outcomes"] == ["succeeded", "succeeded"], f"Unexpected outcomes {wrote['tool_outcomes']}"
+        assert broken["tool_outcomes"] == ["failed", "failed"], f"Unexpected outcomes {broken['tool_outcomes']}"
+
+        fake = FakeLLM(content="Needs another search.")
+        state = {"tasks": [wrote, broken, searched, mixed], "active_task_ids": [1, 2, 3, 4], "current_task_id": None}
+        with fake_llm_client(fake):
+            update = reflect(state)
+        statuses = {task["id"]: task["status"] for task in update["tasks"]}
+        assert statuses == {1: "complete", 2: "failed", 3: "complete", 4: "complete"}, f"Unexpected statuses {statuses}"
+        assert len(fake.calls) == 2, f"Only the unclear results should need an LLM call, got {len(fake.calls)}"
+        assert update["llm_calls_saved"] == 2, f"Expected 2 saved LLM calls, got {update['llm_calls_saved']}"
+
+        with fake_llm_client(FakeLLM()):
+            update = asyncio.run(areflect({**state, "active_task_ids": [1, 2]}))
+        assert update["llm_calls_saved"] == 2, f"The async node should take the fast path too, got {update['llm_calls_saved']}"
+        print("test_fast_reflection passed.")
+
+    except AssertionError as e:
+        print(f"test_fast_reflection failed: {e}")
+    except Exception as e:
+        print(f"test_fast_reflection exception: {e}")
+
+
+def test_batched_reflection():
+    """ Tests that batched reflection judges several tasks per LLM call and that a partial batch waits while other tasks run """
+    def task(task_id: int, depends_on: list[int] | None = None) -> Task:
+        return {"id": task_id, "title": f"Task {task_id}", "description": "", "depends_on": depends_on or [], "status": "pending",
+                "result": f"Result {task_id}", "tool_outcomes": [], "reflection": None}
+
+    try:
+        fake = FakeLLM()
+        state = {"tasks": [task(1), task(2), task(3)], "active_task_ids": [1, 2, 3], "current_task_id": 1}
+        with fake_llm_client(fake):
+            update = reflect(state, {"configurable": {"reflection_batch_size": 3}})
+        assert len(fake.calls) == 1, f"Expected one LLM call for the batch, got {len(fake.calls)}"
+        assert [t["status"] for t in update["tasks"]] == ["complete"] * 3, f"Unexpected statuses {update['tasks']}"
+        assert update["llm_calls_saved"] == 2, f"Expected 2 saved LLM calls, got {update['llm_calls_saved']}"
+
+        # Task 1 waits for a fuller batch while task 3 can run; task 2 depends on task 1
+        config = {"configurable": {"reflection_batch_size": 2, "max_concurrency": 4}}
+        state = {"tasks": [task(1), task(2, [1]), task(3)], "active_task_ids": [1], "current_task_id": 1}
+        with fake_llm_client(FakeLLM()) as fake:
+            update = reflect(state, config)
+            assert not fake.calls and update["awaiting_reflection"] == [1], f"Task 1 should wait, got {update}"
+            state.update(update, tasks=merge_tasks(state["tasks"], update["tasks"]))
+            assert has_more_tasks(state) == "execute", "Waiting tasks are still pending"
+            assert select_next_task(state, config)["active_task_ids"] == [3], "Only task 3 should be selected"
+
+            update = asyncio.run(areflect({**state, "active_task_ids": [3]}, config))
+            assert len(fake.calls) == 1 and update["awaiting_reflection"] == [], f"The full batch should be judged at once, got {update}"
+            assert {t["id"] for t in update["tasks"]} == {1, 3}, f"Unexpected tasks {update['tasks']}"
+
+            # Without a max wait (or with nothing else to run) the partial batch is judged right away
+            update = reflect(state, {"configurable": {"reflection_batch_size": 2, "reflection_max_wait_s": 0}})
+            assert update["awaiting_reflection"] == [] and update["tasks"][0]["status"] == "complete", f"Unexpected update {update}"
+
+        plan = TodoListSchema(tasks=[TaskSchema(id=i, title=f"Task {i}", description="") for i in range(1, 7)])
+        fake = FakeLLM(plan=plan)
+        final_state = run_offline(fake, new_state(), {"reflection_batch_size": 4, "max_concurrency": 2})
+        assert all(t["status"] == "complete" for t in final_state["tasks"]), f"Unexpected statuses {final_state['tasks']}"
+        assert final_state["output"], "The run should produce an output"
+        assert len(fake.calls) == 6 + 2 + 1, f"Expected 6 executions, 2 batched reflections and the summary, got {len(fake.calls)} calls"
+        print("test_batched_reflection passed.")
+
+    except AssertionError as e:
+        print(f"test_batched_reflection failed: {e}")
+    except Exception as e:
+        print(f"test_batched_reflection exception: {e}")
+
+
+def test_speculative_execution():
+    """ Tests that the next task runs while its dependency is reflected on, and that its result is discarded if the dependency fails """
+    class FailingFirstTask(FakeLLM):
+        """ Reflections on 'Task 1' come back failed """
+        @staticmethod
+        def verdict(schema, prompt, content):
+            return ReflectionSchema(status="failed" if "'Task 1'" in prompt else "successful", explanation=content)
+
+    class WritingLLM(FakeLLM):
+        def invoke(self, prompt):
+            return AIMessage(content="", tool_calls=[{"name": "write_file", "args": {"file_path": self.content, "content": "x"}, "id": "1"}])
+
+    plan = TodoListSchema(tasks=[TaskSchema(id=i, title=f"Task {i}", description="", depends_on=[i - 1] if i > 1 else []) for i in range(1, 4)])
+    delay = 0.2
+    try:
+        fake = FakeLLM(plan=plan, delay=delay)
+        start = time.perf_counter()
+        final_state = run_offline(fake, new_state(), {"speculate": True})
+        elapsed = time.perf_counter() - start
+        assert all(t["status"] == "complete" for t in final_state["tasks"]), f"Unexpected statuses {final_state['tasks']}"
+        assert (final_state["speculation_hits"], final_state["speculation_misses"]) == (2, 0), \
+            f"Expected 2 hits and no misses, got {final_state['speculation_hits']} / {final_state['speculation_misses']}"
+        assert len(fake.calls) == 3 + 3 + 1, f"Speculation should replace executions, not add to them, got {len(fake.calls)} calls"
+        # 3 executions, 3 reflections and the summary in a row take 7 x delay; two executions overlap a reflection
+        assert elapsed < 6 * delay, f"Expected executions to overlap reflections, took {elapsed:.2f}s"
+
+        with fake_llm_client(FailingFirstTask(plan=plan)):
+            final_state = asyncio.run(arun_goal("Goal", app=create_agent_graph(), config=new_run_config(speculate=True)))
+        statuses = [t["status"] for t in final_state["tasks"]]
+        assert statuses == ["failed", "complete", "complete"], f"Unexpected statuses {statuses}"
+        assert (final_state["speculation_hits"], final_state["speculation_misses"]) == (1, 1), \
+            f"Task 2's speculation should be discarded, got {final_state['speculation_hits']} / {final_state['speculation_misses']}"
+
+        # File writes are held back until the speculation is confirmed
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory, fake_llm_client(WritingLLM(content=os.path.join(directory, "out.md"))):
+            task = {"id": 2, "title": "Task 2", "description": "", "depends_on": [1], "status": "pending", "result": None, "reflection": None}
+            speculation = speculate_task({"conversation_history": []}, task, [1])
+            assert speculation["outcomes"] is None and not os.listdir(directory), "Speculation should not write files"
+            update = finish_speculative_task(dict(task), [], speculation)
+            assert os.listdir(directory) == ["out.md"] and update["tasks"][0]["tool_outcomes"] == ["succeeded"], f"Unexpected update {update}"
+        print("test_speculative_execution passed.")
+
+    except AssertionError as e:
+        print(f"test_speculative_execution failed: {e}")
+    except Exception as e:
+        print(f"test_speculative_execution exception: {e}")
+
+
+def test_get_ready_tasks():
+    """ Tests dependency resolution: only tasks with settled dependencies are ready """
+    try:
+        tasks = [
+            {"id": 1, "title": "A", "description": "", "depends_on": [], "status": "complete", "result": None},
+            {"id": 2, "title": "B", "description": "", "depends_on": [], "status": "pending", "result": None},
+            {"id": 3, "title": "C", "description": "", "depends_on": [1, 2], "status": "pending", "result": None},
+            {"id": 4, "title": "D", "description": "", "depends_on": [1, 99], "status": "pending", "result": None},
+        ]
+        ready = [task["id"] for task in get_ready_tasks(tasks)]
+        assert ready == [2, 4], f"Expected ready tasks [2, 4], got {ready}"
+
+        # A dependency cycle must not stall the plan
+        cycle = [
+            {"id": 1, "title": "A", "description": "", "depends_on": [2], "status": "pending", "result": None},
+            {"id": 2, "title": "B", "description": "", "depends_on": [1], "status": "pending", "result": None},
+        ]
+        ready = [task["id"] for task in get_ready_tasks(cycle)]
+        assert ready == [1], f"Expected the first pending task for a cycle, got {ready}"
+        print("test_get_ready_tasks passed.")
+
+    except AssertionError as e:
+        print(f"test_get_ready_tasks failed: {e}")
+    except Exception as e:
+        print(f"test_get_ready_tasks exception: {e}")
+
+
+def test_parallel_execution():
+    """ Tests that independent tasks run at the same time and dependent tasks wait for their dependencies """
+    plan = TodoListSchema(tasks=[
+        TaskSchema(id=1, title="Search X", description="Search X"),
+        TaskSchema(id=2, title="Search Y", description="Search Y"),
+        TaskSchema(id=3, title="Compare", description="Compare X and Y", depends_on=[1, 2]),
+        TaskSchema(id=4, title="Search Z", description="Search Z"),
+    ])
+    try:
+        fake = FakeLLM(plan=plan, delay=0.2)
+        start = time.perf_counter()
+        final_state = run_offline(fake, new_state())
+        elapsed = time.perf_counter() - start
+
+        statuses = [task["status"] for task in final_state["tasks"]]
+        assert statuses == ["complete"] * 4, f"Expected all tasks complete, got {statuses}"
+
+        # Two rounds of execute + reflect plus the summary, instead of four rounds one after the other
+        assert elapsed < 1.4, f"Expected parallel execution to take < 1.4s, took {elapsed:.2f}s"
+
+        executions = [entry for entry in final_state["conversation_history"] if entry.startswith("Executing")]
+        assert executions == ["Executing task #1: Search X", "Executing task #2: Search Y", "Executing task #4: Search Z", "Executing task #3: Compare"], \
+            f"Unexpected execution order {executions}"
+
+        # With a concurrency cap of 1 the tasks run one at a time, in plan order
+        final_state = run_offline(FakeLLM(plan=plan), new_state(), {"max_concurrency": 1})
+        executions = [entry for entry in final_state["conversation_history"] if entry.startswith("Executing")]
+        assert executions == ["Executing task #1: Search X", "Executing task #2: Search Y", "Executing task #3: Compare", "Executing task #4: Search Z"], \
+            f"Unexpected sequential execution order {executions}"
+
+        # A cap below 1 is an error, not the default
+        for value in (0, -2, "many"):
+            try:
+                get_max_concurrency({"configurable": {"max_concurrency": value}})
+                assert False, f"max_concurrency {value!r} should be rejected"
+            except ValueError:
+                pass
+        print("test_parallel_execution passed.")
+
+    except AssertionError as e:
+        print(f"test_parallel_execution failed: {e}")
+    except Exception as e:
+        print(f"test_parallel_execution exception: {e}")
+
+
+def test_async_goals_share_one_event_loop():
+    """ Tests that arun_goal() drives many goals concurrently on a single event loop """
+    plan = TodoListSchema(tasks=[
+        TaskSchema(id=1, title="Search X", description="Search X"),
+        TaskSchema(id=2, title="Write report", description="Write the report", depends_on=[1]),
+    ])
+    try:
+        with fake_llm_client(FakeLLM(plan=plan, delay=0.1)):
+            app = create_agent_graph()
+
+            async def run_all():
+                return await asyncio.gather(*(arun_goal(f"Goal {i}", app=app) for i in range(20)))
+
+            start = time.perf_counter()
+            final_states = asyncio.run(run_all())
+            elapsed = time.perf_counter() - start
+
+        assert len(final_states) == 20, f"Expected 20 final states, got {len(final_states)}"
+        assert all(state["output"] for state in final_states), "Every goal should produce an output"
+        assert [state["goal"] for state in final_states] == [f"Goal {i}" for i in range(20)], "Goals should not mix up their states"
+
+        # Each goal spends 5 x 0.1s waiting on the LLM; run one after the other that would be 10s
+        assert elapsed < 3, f"Expected concurrent goals to finish in < 3s, took {elapsed:.2f}s"
+        print("test_async_goals_share_one_event_loop passed.")
+
+    except AssertionError as e:
+        print(f"test_async_goals_share_one_event_loop failed: {e}")
+    except Exception as e:
+        print(f"test_async_goals_share_one_event_loop exception: {e}")
+
+
+def test_token_streaming():
+    """ Tests that LLM tokens are rendered while they are generated and that time to first token is recorded per node """
+    plan = TodoListSchema(tasks=[
+        TaskSchema(id=1, title="Search X", description="Search X"),
+        TaskSchema(id=2, title="Search Y", description="Search Y"),
+    ])
+    words = 20
+    chunk_delay = 0.01
+    fake = streaming_fake_llm(" ".join(["word"] * words), plan=plan, chunk_delay=chunk_delay)
+
+    try:
+        out = io.StringIO()
+        renderer = streaming.TokenRenderer(out=out)
+        ttft = streaming.TimeToFirstTokenHandler()
+        with fake_llm_client(fake):
+            final_state = asyncio.run(arun_goal("Compare X and Y", app=create_agent_graph(),
+                                                config=new_run_config(callbacks=[ttft]), renderer=renderer))
+
+        rendered = out.getvalue()
+        assert rendered.count("LLM Response: word") == 2, f"Expected both task results streamed, got {rendered!r}"
+        assert "Reflection" not in rendered, f"Structured reflections should not be streamed, got {rendered!r}"
+        assert "FINAL RESULT" in rendered and final_state["output"] in rendered, f"Expected the final result streamed, got {rendered!r}"
+        # Parallel branches are not interleaved: every streamed response is written as one block
+        assert all(line.count("word") == words for line in rendered.splitlines() if "word" in line), f"Interleaved output: {rendered!r}"
+
+        response_time = words * chunk_delay
+        assert renderer.time_to_first_output < response_time, \
+            f"First output after {renderer.time_to_first_output:.3f}s, a full response takes {response_time:.3f}s"
+
+        summary = ttft.summary()
+        assert {"execute_task", "reflect_and_complete"} <= set(summary), f"Missing nodes in {summary}"
+        assert summary["execute_task"]["calls"] == 2, f"Expected 2 execute_task calls, got {summary['execute_task']}"
+        assert summary["reflect_and_complete"]["max_ms"] < response_time * 1000, f"Time to first token too high: {summary}"
+        print("test_token_streaming passed.")
+
+    except AssertionError as e:
+        print(f"test_token_streaming failed: {e}")
+    except Exception as e:
+        print(f"test_token_streaming exception: {e}")
+
+
+
+
+""" Test conversation history """
+
+def test_history_manager():
+    """ Tests that the history manager keeps the context within its budget and keeps what matters """
+    try:
+        conversation = ["Goal: Compare cats and dogs"]
+        for i in range(1, 31):
+            conversation += [
+                f"Executing task #{i}: Search subtopic {i}",
+                f"Result: {'Some long search result text. ' * 50}",
+                f"Reflection on task #{i}: The search was successful. Task marked as complete.",
+            ]
+        task = {"id": 31, "title": "Summarize", "description": "Summarize the findings", "depends_on": [3]}
+
+        manager = history.HistoryManager(budget_tokens=500, recent_entries=4)
+        context = manager.context_for(conversation, task)
+        assert history.count_tokens(context) <= 500, f"Context has {history.count_tokens(context)} tokens, budget is 500"
+        assert context.startswith("Goal: Compare cats and dogs"), "The goal should always be kept"
+        assert "Reflection on task #30: The search was successful. Task marked as complete." in context, "Recent entries should be kept verbatim"
+        assert "Executing task #3: Search subtopic 3" in context, "Entries about dependencies should be kept"
+
+        # Disabled manager renders the full history, as before
+        full = history.HistoryManager(budget_tokens=0).context_for(conversation, task)
+        assert full == str(conversation), "A disabled manager should render the full history"
+        print("test_history_manager passed.")
+
+    except AssertionError as e:
+        print(f"test_history_manager failed: {e}")
+    except Exception as e:
+        print(f"test_history_manager exception: {e}")
+
+
+""" Test result store """
+
+def test_result_store():
+    """ Tests that outputs are stored once, referenced with a bounded preview and resolved on demand """
+    import tempfile
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            store = result_store.ResultStore(directory=directory, preview_chars=50)
+            output = "Search result line. " * 100
+
+            reference = store.reference(output)
+            assert reference.startswith("[result:"), f"Long outputs should be referenced, got {reference[:40]}"
+            assert len(reference) < 120, f"Reference should be short, got {len(reference)} chars"
+            assert store.reference(output) == reference, "The same output should get the same reference"
+            assert len(store) == 1, f"The output should be stored once, store has {len(store)} items"
+            assert store.reference("Successfully wrote 5 characters") == "Successfully wrote 5 characters", "Short outputs should stay inline"
+
+            resolved = store.resolve(f"Before\n{reference}\nAfter")
+            assert resolved == f"Before\n{output}\nAfter", "resolve() should replace the reference with the full output"
+
+            # References end at their own "…", also when the history is rendered on one line
+            other_output = "Another… result. " * 50
+            other = store.reference(other_output)
+            line = str([f"Task 1: {reference}", "Task 2: done", f"Task 3: {other}", "Task 4: done"])
+            resolved = store.resolve(line)
+            assert resolved == line.replace(reference, output).replace(other, other_output), \
+                f"Only the references should be replaced, got {resolved[-200:]}"
+
+            # A new store on the same directory still resolves the reference
+            reopened = result_store.ResultStore(directory=directory)
+            assert reopened.resolve(reference) == output, "On-disk outputs should survive a restart"
+
+        # Without a directory the memory is bounded too; dropped outputs resolve to their preview
+        small = result_store.ResultStore(max_memory_bytes=5000)
+        references = [small.reference(f"Output {i}. " + "x" * 2000) for i in range(4)]
+        assert small.memory_bytes <= 5000 and small.evictions == 2, f"Expected 2 evictions, got {small.evictions} ({small.memory_bytes} bytes)"
+        assert small.resolve(references[0]) == references[0] and small.resolve(references[-1]).endswith("x" * 2000), \
+            "Dropped outputs should keep their preview, kept ones should resolve"
+        print("test_result_store passed.")
+
+    except AssertionError as e:
+        print(f"test_result_store failed: {e}")
+    except Exception as e:
+        print(f"test_result_store exception: {e}")
+
+
+def test_dependency_results_are_resolved():
+    """ Tests that dependent tasks and the final summary see the stored tool outputs, not only their previews """
+    try:
+        search_result = "1. Long search result. " * 120
+        reference = get_result_store().reference(search_result)
+        state = new_state("Summarize the search")
+        state["tasks"] = [
+            {"id": 1, "title": "Search X", "description": "Search X", "status": "complete", "result": reference, "depends_on": []},
+            {"id": 2, "title": "Summarize X", "description": "Summarize the results", "status": "pending", "result": None, "depends_on": [1]},
+        ]
+        state["conversation_history"] = ["Summarize the search", "Executing task #1: Search X", f"Result: {reference}"]
+
+        limit = get_resolved_result_chars()
+        context = task_context(state, state["tasks"][1])
+        assert search_result[:limit] in context, "The dependency's result should be resolved in the task context"
+        assert f"{len(search_result) - limit} more characters" in context, "Resolved results should be capped"
+        assert search_result[:limit] in final_output_prompt(state), "The final summary should see the resolved results"
+        assert "Results of the tasks" not in task_context(state, state["tasks"][0]), "Independent tasks get no dependency results"
+        print("test_dependency_results_are_resolved passed.")
+
+    except AssertionError as e:
+        print(f"test_dependency_results_are_resolved failed: {e}")
+    except Exception as e:
+        print(f"test_dependency_results_are_resolved exception: {e}")
+
+
+def test_tool_results_grow_linearly():
+    """ Tests that a task with many tool calls writes each output to the history once, as a reference """
+    try:
+        task = {"id": 1, "title": "Search", "description": "Search", "depends_on": [], "status": "pending", "result": None, "reflection": None}
+        tool_calls = [{"name": "web_search", "args": {"query": f"query {i}"}, "id": str(i)} for i in range(20)]
+        outcomes = [{**call, "found": True, "result": f"Output {i} " + "x" * 2000} for i, call in enumerate(tool_calls)]
+
+        update = finish_task(dict(task), [], AIMessage(content="", tool_calls=tool_calls), outcomes)
+        history_chars = sum(len(entry) for entry in update["conversation_history"])
+        assert history_chars < 20 * 400, f"History should grow linearly with bounded previews, got {history_chars} chars"
+        assert update["tasks"][0]["result"].count("[result:") == 20, "The task result should hold one reference per tool call"
+
+        resolved = result_store.get_result_store().resolve(update["tasks"][0]["result"])
+        assert "Output 19 " + "x" * 2000 in resolved, "The full outputs should be available through the store"
+        print("test_tool_results_grow_linearly passed.")
+
+    except AssertionError as e:
+        print(f"test_tool_results_grow_linearly failed: {e}")
+    except Exception as e:
+        print(f"test_tool_results_grow_linearly exception: {e}")
+
+
+""" Test LLM response cache """
+
+def test_llm_cache_eviction_and_ttl():
+    """ Tests LRU eviction, TTL expiry and hit/miss counters of the SQLite LLM cache """
+    import tempfile
+    from langchain_core.outputs import ChatGeneration
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            cache = llm_cache.SQLiteLLMCache(path=os.path.join(directory, "cache.sqlite"), max_entries=2, ttl_seconds=None)
+            generation = [ChatGeneration(message=AIMessage(content="", tool_calls=[{"name": "web_search", "args": {"query": "X"}, "id": "1"}]))]
+
+            cache.update("prompt 1", "llm", generation)
+            cached = cache.lookup("prompt 1", "llm")
+            assert cached[0].message.tool_calls[0]["args"] == {"query": "X"}, "Tool calls should survive the cache"
+            assert cache.lookup("prompt 1", "other llm") is None, "A different LLM should miss"
+
+            cache.update("prompt 2", "llm", generation)
+            cache.lookup("prompt 1", "llm")  # Prompt 2 is now the least recently used
+            cache.update("prompt 3", "llm", generation)
+            assert cache.lookup("prompt 2", "llm") is None, "The least recently used entry should be evicted"
+            assert cache.lookup("prompt 1", "llm") is not None, "Recently used entries should be kept"
+
+            stats = cache.stats()
+            assert stats["entries"] == 2 and stats["evictions"] == 1, f"Unexpected stats {stats}"
+            assert stats["hits"] == 3 and stats["misses"] == 2, f"Unexpected hit/miss counts {stats}"
+
+            cache.ttl_seconds = 0.01
+            time.sleep(0.02)
+            assert cache.lookup("prompt 1", "llm") is None, "Expired entries should miss"
+            cache.close()
+        print("test_llm_cache_eviction_and_ttl passed.")
+
+    except AssertionError as e:
+        print(f"test_llm_cache_eviction_and_ttl failed: {e}")
+    except Exception as e:
+        print(f"test_llm_cache_eviction_and_ttl exception: {e}")
+
+
+def test_llm_cache_with_chat_model():
+    """ Tests that a cached ChatOpenAI answers repeated tool-bound calls without a request, against a local fake server """
+    import json
+    import tempfile
+    from langchain_openai import ChatOpenAI
+    from benchmarks.fake_server import FakeServer
+
+    def respond_with_tool_call(body):
+        tool = body["tools"][0]["function"]["name"]
+        return {"role": "assistant", "content": None,
+                "tool_calls": [{"id": "call_1", "type": "function", "function": {"name": tool, "arguments": json.dumps({"query": "X"})}}]}
+
+    try:
+        with tempfile.TemporaryDirectory() as directory, FakeServer(responder=respond_with_tool_call) as server:
+            cache = llm_cache.SQLiteLLMCache(path=os.path.join(directory, "cache.sqlite"))
+            llm = ChatOpenAI(model="gpt-5-mini", temperature=0, base_url=server.base_url, api_key="fake", cache=cache)
+
+            first = llm.bind_tools(AVAILABLE_TOOLS).invoke("Search X")
+            second = llm.bind_tools(AVAILABLE_TOOLS).invoke("Search X")
+            assert server.requests == 1, f"The repeated call should be served from the cache, server got {server.requests} requests"
+            assert first.tool_calls == second.tool_calls, "Cached tool calls should match the original ones"
+
+            llm.bind_tools(AVAILABLE_TOOLS[:1]).invoke("Search X")
+            assert server.requests == 2, "Binding different tools should miss the cache"
+
+            # Timeouts are not part of the key
+            other = ChatOpenAI(model="gpt-5-mini", temperature=0, base_url=server.base_url, api_key="fake", cache=cache, timeout=5)
+            other.bind_tools(AVAILABLE_TOOLS).invoke("Search X")
+            assert server.requests == 2, "Transport settings should not change the cache key"
+            cache.close()
+        print("test_llm_cache_with_chat_model passed.")
+
+    except AssertionError as e:
+        print(f"test_llm_cache_with_chat_model failed: {e}")
+    except Exception as e:
+        print(f"test_llm_cache_with_chat_model exception: {e}")
+
+
+""" Test plan cache """
+
+def test_plan_cache():
+    """ Tests reusing and filling in the plan of a similar goal, eviction, persistence and forgetting rejected plans """
+    import tempfile
+    import agent
+    import plan_cache
+    plan = TodoListSchema(tasks=[
+        TaskSchema(id=1, title="Search news about Tesla", description="Search the web for today's news about Tesla", depends_on=[]),
+        TaskSchema(id=2, title="Write summary", description="Write a summary to agent-files/tesla.md", depends_on=[1]),
+    ])
+    previous = plan_cache.get_plan_cache()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "plans.sqlite")
+            cache = plan_cache.PlanCache(path=path, max_entries=2)
+            plan_cache.configure_plan_cache(cache)
+            with fake_llm_client(FakeLLM(plan=plan)):
+                agent.generate_todos(new_state("Summarize today's news about Tesla"))
+            with fake_llm_client(FakeLLM(plan=None)):  # Would fail if the LLM were asked
+                update = agent.generate_todos(new_state("Summarize today's news about Nvidia"))
+            assert update["tasks"][0]["title"] == "Search news about Nvidia", f"The parameter should be filled in, got {update['tasks'][0]}"
+            assert update["tasks"][1]["description"] == "Write a summary to agent-files/nvidia.md", f"Got {update['tasks'][1]}"
+            assert update["tasks"][1]["depends_on"] == [1] and update["tasks"][0]["status"] == "pending", "The plan structure should be kept"
+
+            assert cache.lookup("Summarize today's sports news") is None, "Plans with words that cannot be filled in should not be reused"
+            assert cache.lookup("Write a poem about the ocean") is None, "Dissimilar goals should miss"
+            stats = cache.stats()
+            assert stats["similar_hits"] == 1 and stats["misses"] == 3 and stats["hit_rate"] == 0.25, f"Unexpected stats {stats}"
+
+            cache.store("Write a poem about the ocean", {"tasks": []})
+            cache.store("Plan a 3-day trip to Rome", {"tasks": []})
+            assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1, f"The oldest plan should be evicted, got {cache.stats()}"
+            reopened = plan_cache.PlanCache(path=path)
+            match = reopened.lookup("Plan a 5-day trip to Paris")
+            assert match is not None and match[1] == "Plan a 3-day trip to Rome", f"Plans should be kept across runs, got {match}"
+
+            assert cache.lookup("Plan a 5-day trip to Paris") is not None, "The similar plan should be offered"
+            agent.apply_approval("n", "Plan a 5-day trip to Paris")
+            assert cache.lookup("Plan a 5-day trip to Paris") is None, "A rejected plan should not be offered again"
+
+            cache.store("Plan a 3-day trip to Rome", {"tasks": []})
+            for days in range(4, 8):
+                cache.lookup(f"Plan a {days}-day trip to Paris")
+            assert len(cache._sources) == 2, f"Only the latest max_entries reused plans should be remembered, got {len(cache._sources)}"
+            reopened.close()
+            cache.close()
+        print("test_plan_cache passed.")
+
+    except AssertionError as e:
+        print(f"test_plan_cache failed: {e}")
+    except Exception as e:
+        print(f"test_plan_cache exception: {e}")
+    finally:
+        plan_cache.configure_plan_cache(previous)
+
+
+""" Test checkpoints """
+
+def test_resume_after_crash():
+    """ Tests that a run interrupted by a crash resumes from its checkpoints without executing finished tasks again """
+    import tempfile
+    plan = TodoListSchema(tasks=[
+        TaskSchema(id=1, title="Search X", description="Search X"),
+        TaskSchema(id=2, title="Search Y", description="Search Y"),
+        TaskSchema(id=3, title="Compare", description="Compare X and Y", depends_on=[1, 2]),
+    ])
+
+    class CrashingLLM(FakeLLM):
+        """ Fails while executing task #2, after task #1 (running at the same time) has finished """
+        async def ainvoke(self, prompt):
+            if "Title: Search Y" in str(prompt) and "Execute this task" in str(prompt):
+                self.calls.append((time.perf_counter(), prompt))
+                await asyncio.sleep(0.1)
+                raise RuntimeError("Simulated crash")
+            return await super().ainvoke(prompt)
+
+    def executed_titles(fake):
+        return [prompt.split("Title: ")[1].split("\n")[0] for _, prompt in fake.calls if str(prompt).startswith("Execute this task")]
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoints.sqlite")
+            saver = checkpointer.SQLiteCheckpointSaver(path)
+            crashing = CrashingLLM(plan=plan)
+            with fake_llm_client(crashing):
+                try:
+                    run_goal("Compare X and Y", app=create_agent_graph(saver), config=new_run_config("run-1"))
+                    assert False, "The first run should have crashed"
+                except RuntimeError:
+                    pass
+            saver.close()  # Simulated restart: a new checkpointer on the same file
+
+            saver = checkpointer.SQLiteCheckpointSaver(path)
+            assert saver.thread_ids() == ["run-1"], f"Unexpected threads {saver.thread_ids()}"
+            resumed = FakeLLM(plan=plan)
+            with fake_llm_client(resumed):
+                final_state = resume_goal("run-1", app=create_agent_graph(saver))
+
+            statuses = [task["status"] for task in final_state["tasks"]]
+            assert statuses == ["complete"] * 3, f"Expected all tasks complete, got {statuses}"
+            assert executed_titles(crashing) == ["Search X", "Search Y"], f"Unexpected first run {executed_titles(crashing)}"
+            assert executed_titles(resumed) == ["Search Y", "Compare"], f"Finished tasks should not run again, got {executed_titles(resumed)}"
+            assert final_state["output"], "The resumed run should produce an output"
+
+            # A finished thread resumes to its final state without any LLM call
+            again = FakeLLM(plan=plan)
+            with fake_llm_client(again):
+                assert resume_goal("run-1", app=create_agent_graph(saver))["output"] == final_state["output"], "Expected the same final state"
+            assert not again.calls, "A finished run should not call the LLM again"
+
+            try:
+                resume_goal("unknown", app=create_agent_graph(saver))
+                assert False, "Resuming an unknown thread should fail"
+            except ValueError:
+                pass
+            saver.close()
+        print("test_resume_after_crash passed.")
+
+    except AssertionError as e:
+        print(f"test_resume_after_crash failed: {e}")
+    except Exception as e:
+        print(f"test_resume_after_crash exception: {e}")
+
+
+def test_checkpoint_writes_are_batched():
+    """ Tests that checkpoint writes of a run are committed in a few transactions and are all readable afterwards """
+    import tempfile
+    plan = TodoListSchema(tasks=[TaskSchema(id=i, title=f"Task {i}", description=f"Task {i}") for i in range(1, 6)])
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            saver = checkpointer.SQLiteCheckpointSaver(os.path.join(directory, "checkpoints.sqlite"), flush_interval=0.5)
+            with fake_llm_client(FakeLLM(plan=plan)):
+                app = create_agent_graph(saver)
+                final_state = run_goal("Five tasks", app=app, config=new_run_config("batched"))
+
+            checkpoints = list(saver.list(new_run_config("batched")))
+            assert len(checkpoints) > 5, f"Expected a checkpoint per super-step, got {len(checkpoints)}"
+            assert saver.flushes < len(checkpoints) / 2, f"Expected batched commits, got {saver.flushes} for {len(checkpoints)} checkpoints"
+            assert checkpoints[0].checkpoint["channel_values"]["output"] == final_state["output"], "The latest checkpoint should hold the final state"
+            saver.close()
+
+            # A failed commit keeps its writes queued, and the background writer retries them
+            class LockedOnce:
+                def __init__(self, conn):
+                    self.conn, self.failures = conn, 1
+
+                def __getattr__(self, name):
+                    return getattr(self.conn, name)
+
+                def execute(self, sql, params=()):
+                    if sql == "COMMIT" and self.failures:
+                        self.failures -= 1
+                        raise sqlite3.OperationalError("database is locked")
+                    return self.conn.execute(sql, params)
+
+            saver = checkpointer.SQLiteCheckpointSaver(os.path.join(directory, "checkpoints.sqlite"), flush_interval=0.05)
+            latest = saver.get_tuple(new_run_config("batched"))
+            saver._conn = LockedOnce(saver._conn)
+            saver.put_writes(latest.config, [("output", "retried")], "task-1")
+            time.sleep(0.3)
+            assert saver._conn.failures == 0 and saver._writer.is_alive(), "The writer should survive a failed commit"
+            writes = saver.get_tuple(latest.config).pending_writes
+            assert ("task-1", "output", "retried") in writes, f"Writes of a failed commit should not be lost, got {writes}"
+            saver.close()
+        print("test_checkpoint_writes_are_batched passed.")
+
+    except AssertionError as e:
+        print(f"test_checkpoint_writes_are_batched failed: {e}")
+    except Exception as e:
+        print(f"test_checkpoint_writes_are_batched exception: {e}")
+
+
+def test_delta_checkpoints():
+    """ Tests that delta-encoded checkpoints store less than whole ones and reconstruct the same states, also after compaction """
+    import tempfile
+    plan = TodoListSchema(tasks=[TaskSchema(id=i, title=f"Task {i}", description=f"Task {i}") for i in range(1, 21)])
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            whole = checkpointer.SQLiteCheckpointSaver(os.path.join(directory, "whole.sqlite"), delta=False)
+            delta = checkpointer.SQLiteCheckpointSaver(os.path.join(directory, "delta.sqlite"), keyframe_interval=4)
+            for saver in (whole, delta):
+                with fake_llm_client(FakeLLM(plan=plan, content="A long and detailed task result. " * 40)):
+                    run_goal("Twenty tasks", app=create_agent_graph(saver), config=new_run_config("run"))
+
+            config = new_run_config("run")
+            whole_states = [t.checkpoint["channel_values"] for t in whole.list(config)]
+            delta_states = [t.checkpoint["channel_values"] for t in delta.list(config)]
+            assert whole_states == delta_states, "Delta-encoded checkpoints should reconstruct every state exactly"
+            assert delta.storage_bytes() < whole.storage_bytes() * 0.6, \
+                f"Expected delta encoding to store much less, got {delta.storage_bytes()} vs {whole.storage_bytes()}"
+
+            # Compaction keeps the latest checkpoint readable and drops everything else
+            latest = delta_states[0]
+            before = delta.storage_bytes()
+            delta.compact("run", keep_last=1)
+            assert len(list(delta.list(config))) == 1, "Expected one checkpoint after compaction"
+            assert delta.get_tuple(config).checkpoint["channel_values"] == latest, "The latest state should survive compaction"
+            assert delta.storage_bytes() < before / 2, f"Expected compaction to free storage, {delta.storage_bytes()} of {before} bytes left"
+
+            # A restarted checkpointer reads the compacted thread, and new checkpoints build on it
+            delta.close()
+            delta = checkpointer.SQLiteCheckpointSaver(os.path.join(directory, "delta.sqlite"))
+            assert delta.get_tuple(config).checkpoint["channel_values"] == latest, "Expected the same state after a restart"
+            whole.close()
+            delta.close()
+        print("test_delta_checkpoints passed.")
+
+    except AssertionError as e:
+        print(f"test_delta_checkpoints failed: {e}")
+    except Exception as e:
+        print(f"test_delta_checkpoints exception: {e}")
+
+
+""" Test tracing """
+
+def test_tracing():
+    """ Tests that nodes, LLM calls and tool calls are traced to JSONL with their parents, tokens and HTTP requests """
+    import json
+    import tempfile
+    import uuid
+    import httpx
+    import tracing
+    from benchmarks.fakes import ScriptedChatModel, offline, synthetic_plan
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace.jsonl")
+            tracer = tracing.Tracer(path)
+            llm = ScriptedChatModel(plan=synthetic_plan(3), tool_call_percent=100)
+            with offline(llm):
+                asyncio.run(arun_goal("Write a report", config=new_run_config(thread_id="traced", callbacks=[tracer])))
+            summary = tracer.close()
+
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+            spans = [record for record in records if record["type"] == "span"]
+            assert records[-1]["type"] == "summary", "The summary should be the last record"
+            by_id = {span["span_id"]: span for span in spans}
+            assert {span["trace_id"] for span in spans} == {"traced"}, "Every span should carry the thread id"
+
+            nodes = [span["name"] for span in spans if span["kind"] == "node"]
+            assert nodes.count("execute_task") == 3, f"Expected 3 execute_task spans, got {nodes}"
+            assert {"generate_todos", "select_next_task", "reflect", "reflect_and_complete"} <= set(nodes), f"Missing nodes in {nodes}"
+
+            tool_spans = [span for span in spans if span["kind"] == "tool"]
+            assert [span["name"] for span in tool_spans] == ["web_search"] * 3, f"Expected 3 web_search spans, got {tool_spans}"
+            assert all(by_id[span["parent_id"]]["name"] == "execute_task" for span in tool_spans), "Tool spans should be children of their node"
+            assert all(span["attributes"]["output_chars"] > 0 for span in tool_spans), "Tool output sizes should be recorded"
+
+            llm_spans = [span for span in spans if span["kind"] == "llm"]
+            assert all(by_id[span["parent_id"]]["kind"] == "node" for span in llm_spans), "LLM spans should be children of their node"
+            assert all(span["attributes"]["input_tokens"] > 0 for span in llm_spans), "Input tokens should be recorded"
+
+            execute = next(entry for entry in summary if entry["kind"] == "node" and entry["name"] == "execute_task")
+            assert execute["count"] == 3 and execute["total_ms"] > 0, f"Unexpected summary entry {execute}"
+
+        # HTTP requests made during an LLM call count against its span; a retry of the rate limiter is marked
+        import ratelimit
+        tracer = tracing.Tracer()
+        run_id = uuid.uuid4()
+        token = ratelimit._attempt.set(1)
+        try:
+            tracer.on_chat_model_start({}, [[]], run_id=run_id, invocation_params={"model": "test-model"})
+        finally:
+            ratelimit._attempt.reset(token)
+        request = httpx.Request("POST", "https://example.com", content=b"{}")
+        tracing.trace_http_request(request)
+        tracing.trace_http_response(httpx.Response(200, content=b"12345"))
+        tracer.on_llm_error(RuntimeError("timeout"), run_id=run_id)
+        tracing.trace_http_request(request)  # Outside of an LLM call: not counted
+        attributes = tracer.spans[0]["attributes"]
+        assert (attributes["http_requests"], attributes["retries"], attributes["request_bytes"], attributes["response_bytes"]) == (1, 1, 2, 5), \
+            f"Unexpected HTTP attributes {attributes}"
+        assert tracer.spans[0]["status"] == "error", "Failed LLM calls should be marked"
+        print("test_tracing passed.")
+
+    except AssertionError as e:
+        print(f"test_tracing failed: {e}")
+    except Exception as e:
+        print(f"test_tracing exception: {e}")
+
+
+
+
+""" Test tools """
+
+def test_async_file_tools():
+    """ Tests the async versions of the file tools """
+    import tempfile
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "notes", "todo.txt")
+
+            async def write_and_read():
+                await write_file.ainvoke({"file_path": path, "content": "first line\n"})
+                await append_to_file.ainvoke({"file_path": path, "content": "second line\n"})
+                return await read_file.ainvoke({"file_path": path})
+
+            content = asyncio.run(write_and_read())
+            assert "first line\nsecond line" in content, f"Unexpected file contents: {content}"
+        print("test_async_file_tools passed.")
+
+    except AssertionError as e:
+        print(f"test_async_file_tools failed: {e}")
+    except Exception as e:
+        print(f"test_async_file_tools exception: {e}")
+
+
+def test_read_file_ranges():
+    """ Tests ranged reads, the size cap, probing and encoding sniffing of read_file """
+    import tempfile
+    import tools
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "big.log")
+            with open(path, "w", encoding="utf-8") as f:
+                f.writelines(f"line {i} of the log\n" for i in range(100_000))
+            assert os.path.getsize(path) >= tools.READ_FILE_MMAP_BYTES, "The test file should be memory-mapped"
+
+            whole = read_file.invoke({"file_path": path})
+            assert len(whole) < tools.get_read_file_max_chars() + 1000, f"Large files should be capped, got {len(whole)} characters"
+            assert "line 0 of the log" in whole and "line 99999 of the log" in whole, "The excerpt should show the start and the end"
+            assert "bytes omitted" in whole, "The excerpt should say that the middle was omitted"
+
+            page = read_file.invoke({"file_path": path, "offset": 50_000, "limit": 2})
+            assert "line 50000 of the log\nline 50001 of the log\n" in page and "line 50002" not in page, f"Unexpected page {page}"
+            assert "offset=50002" in page, f"The page should say where to continue, got {page}"
+
+            chunk = read_file.invoke({"file_path": path, "offset": 5, "limit": 9, "unit": "bytes"})
+            assert "\n\n0 of the \n" in chunk and "offset=14" in chunk, f"Unexpected byte range {chunk!r}"
+
+            probe = read_file.invoke({"file_path": path, "probe": True})
+            assert "100,000 lines" in probe and "utf-8" in probe and "line 0" not in probe, f"Unexpected probe {probe}"
+
+            assert "no lines" in read_file.invoke({"file_path": path, "offset": 200_000}), "Reading past the end should say so"
+
+            for name, text, encoding in [("utf16.txt", "héllo\nwörld\n", "utf-16"), ("latin.txt", "café crème\n", "cp1252")]:
+                other = os.path.join(directory, name)
+                with open(other, "w", encoding=encoding) as f:
+                    f.write(text)
+                assert read_file.invoke({"file_path": other}).endswith(text), f"{name} should be decoded"
+            assert "wörld" in read_file.invoke({"file_path": os.path.join(directory, "utf16.txt"), "offset": 1, "limit": 1}), "UTF-16 line ranges should work"
+
+            binary = os.path.join(directory, "data.bin")
+            with open(binary, "wb") as f:
+                f.write(bytes(range(256)))
+            assert read_file.invoke({"file_path": binary}).startswith("Error:"), "Binary files should not be returned as text"
+        print("test_read_file_ranges passed.")
+
+    except AssertionError as e:
+        print(f"test_read_file_ranges failed: {e}")
+    except Exception as e:
+        print(f"test_read_file_ranges exception: {e}")
+
+
+def test_workspace_search():
+    """ Tests the search_workspace tool: keyword and regex queries, index updates by the file tools and files changed outside the agent """
+    import tempfile
+    import workspace_index
+    from tools import search_workspace, write_file, append_to_file
+    try:
+        assert workspace_index.required_words(r"\bTimeout\b") == [("timeout", True, True)], "Bounded literal words are required"
+        assert workspace_index.required_words(r"error: time(out)?") == [("error", False, True), ("time", True, False)], \
+            f"Unexpected required words {workspace_index.required_words(r'error: time(out)?')}"
+        assert workspace_index.required_words(r"foo|bar") == [], "Alternatives require nothing"
+
+        with tempfile.TemporaryDirectory() as root:
+            index = workspace_index.WorkspaceIndex(root, background=False)
+            workspace_index.configure_workspace_index(index)
+            with open(os.path.join(root, "old.md"), "w") as f:
+                f.write("Budget notes\nThe budget is 100 EUR\n")
+            assert "old.md:2: The budget is 100 EUR" in search_workspace.invoke({"query": "budget EUR"}), "Existing files should be indexed"
+
+            write_file.invoke({"file_path": os.path.join(root, "report.md"), "content": "# Report\nMarket growth was 5%\nTicket-42 is open\n"})
+            append_to_file.invoke({"file_path": os.path.join(root, "report.md"), "content": "Deadline: Friday\n"})
+            assert index.stats()["dirty"] == 0, f"Writes by the tools should update the index directly, got {index.stats()}"
+            result = search_workspace.invoke({"query": "deadline"})
+            assert "report.md:4: Deadline: Friday" in result, f"Appended text should be found, got {result}"
+            assert "No matches" in search_workspace.invoke({"query": "budget growth"}), "Every keyword should be in the file"
+            result = search_workspace.invoke({"query": r"ticket-\d+", "regex": True})
+            assert "report.md:3: Ticket-42 is open" not in result, "Regex queries are case-sensitive"
+            assert "report.md:3:" in search_workspace.invoke({"query": r"(?i)ticket-\d+", "regex": True}), "Regex queries should match"
+            assert search_workspace.invoke({"query": "(unclosed", "regex": True}).startswith("Error:"), "Invalid patterns should be reported"
+
+            # Changed outside the agent: found by the stat walk and scanned until re-indexed
+            with open(os.path.join(root, "old.md"), "w") as f:
+                f.write("Replaced by another process\n")
+            os.utime(os.path.join(root, "old.md"), ns=(time.time_ns() + 10**9,) * 2)
+            index.refresh(force=True)
+            assert index.stats()["dirty"] == 1, f"The changed file should be marked, got {index.stats()}"
+            assert "old.md:1:" in search_workspace.invoke({"query": "another process"}), "Changed files should be searched"
+            assert "No matches" in search_workspace.invoke({"query": "budget"}), "Old content should be gone"
+            assert index.stats()["dirty"] == 0, "Changed files should be re-indexed"
+
+            os.remove(os.path.join(root, "report.md"))
+            index.refresh(force=True)
+            assert "No matches" in search_workspace.invoke({"query": "deadline"}), "Deleted files should be dropped"
+        print("test_workspace_search passed.")
+
+    except AssertionError as e:
+        print(f"test_workspace_search failed: {e}")
+    except Exception as e:
+        print(f"test_workspace_search exception: {e}")
+    finally:
+        workspace_index.configure_workspace_index(None)
+
+
+def test_file_cache():
+    """ Tests the write-through file cache and the buffered append handles, also with files changed by another process """
+    import tempfile
+    import file_cache
+    from tools import read_file, write_file, append_to_file
+    previous_cache = file_cache.get_file_cache()
+    cache, pool = file_cache.FileCache(max_bytes=1000), file_cache.AppendPool(flush_interval=0.05)
+    file_cache.configure_file_cache(cache)
+    file_cache.configure_append_pool(pool)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "notes.md")
+            write_file.invoke({"file_path": path, "content": "first\n"})
+            assert "first" in read_file.invoke({"file_path": path}), "Written content should be read back"
+            assert cache.stats()["hits"] == 1, f"A read after a write should come from the cache, got {cache.stats()}"
+
+            append_to_file.invoke({"file_path": path, "content": "second\n"})
+            append_to_file.invoke({"file_path": path, "content": "third\n"})
+            assert pool.stats()["pending_bytes"] == 13, f"Appends should be buffered, got {pool.stats()}"
+            result = read_file.invoke({"file_path": path})
+            assert "first\nsecond\nthird\n" in result, f"Reads should include buffered appends, got {result}"
+            assert cache.stats()["hits"] == 2 and pool.stats()["opens"] == 1, \
+                f"Flushed appends should extend the cached content through one handle, got {cache.stats()} {pool.stats()}"
+
+            append_to_file.invoke({"file_path": path, "content": "fourth\n"})
+            time.sleep(0.3)
+            with open(path) as f:
+                assert f.read().endswith("fourth\n"), "Buffered appends should be written within the flush interval"
+
+            # Another process overwrites the file with content of the same size, and then replaces it
+            with open(path, "w") as f:
+                f.write("FIRST\nSECOND\nTHIRD\nFOURTH\n")
+            os.utime(path, ns=(time.time_ns() - 10**10,) * 2)
+            assert "FIRST" in read_file.invoke({"file_path": path}), "Files changed by another process should be read again"
+            assert cache.stats()["stale"] == 1, f"The changed entry should be dropped, got {cache.stats()}"
+            with open(path + ".tmp", "w") as f:
+                f.write("replaced\n")
+            os.replace(path + ".tmp", path)
+            append_to_file.invoke({"file_path": path, "content": "appended\n"})
+            result = read_file.invoke({"file_path": path})
+            assert "replaced\nappended\n" in result and pool.stats()["reopens"] == 1, \
+                f"Appends should go to the file now at the path, got {result} {pool.stats()}"
+
+            for i in range(3):
+                write_file.invoke({"file_path": os.path.join(directory, f"big{i}.txt"), "content": "x" * 400})
+            assert cache.stats()["bytes"] <= 1000 and cache.stats()["evictions"] >= 1, f"The memory cap should be kept, got {cache.stats()}"
+
+            # By default appends are on disk when the tool returns, and write errors are returned to the caller
+            file_cache.configure_append_pool(file_cache.AppendPool())
+            result = append_to_file.invoke({"file_path": path, "content": "durable\n"})
+            with open(path) as f:
+                assert result.startswith("Successfully") and f.read().endswith("durable\n"), \
+                    f"Appends should be written before the tool returns, got {result}"
+            result = append_to_file.invoke({"file_path": directory, "content": "x"})
+            assert result.startswith("Error"), f"A failed append should be reported, got {result}"
+
+            # A failed buffered write is raised by the next append to the file
+            pool = file_cache.AppendPool(flush_interval=10)
+            file_cache.configure_append_pool(pool)
+            result = append_to_file.invoke({"file_path": path, "content": "buffered\n"})
+            assert not result.startswith("Successfully"), f"Buffered appends should not be reported as written, got {result}"
+            handle = pool._handles[os.path.abspath(path)]
+
+            class FullDisk:
+                def __init__(self, file):
+                    self.fileno, self.flush, self.close = file.fileno, file.flush, file.close
+
+                def write(self, data):
+                    raise OSError(28, "No space left on device")
+
+            disk = handle.file
+            handle.file = FullDisk(disk)
+            pool._flush_due()
+            result = append_to_file.invoke({"file_path": path, "content": "more\n"})
+            assert result.startswith("Error") and pool.stats()["errors"] == 1, \
+                f"The failed background write should be returned, got {result} {pool.stats()}"
+            # The text of the failed write is kept, and written once the disk has room again
+            assert pool.stats()["pending_bytes"] == 9, f"The failed write should stay buffered, got {pool.stats()}"
+            handle.file = disk
+            pool.flush()
+            with open(path) as f:
+                assert f.read().endswith("durable\nbuffered\n"), "The buffered text should be written by a later flush"
+        print("test_file_cache passed.")
+
+    except AssertionError as e:
+        print(f"test_file_cache failed: {e}")
+    except Exception as e:
+        print(f"test_file_cache exception: {e}")
+    finally:
+        file_cache.configure_file_cache(previous_cache)
+        file_cache.configure_append_pool(file_cache.AppendPool())
+
+
+def test_group_tool_calls():
+    """ Tests that only tool calls on a written path are grouped together """
+    try:
+        tool_calls = [
+            {"name": "web_search", "args": {"query": "X"}, "id": "1"},
+            {"name": "write_file", "args": {"file_path": "agent-files/report.md", "content": "a"}, "id": "2"},
+            {"name": "web_search", "args": {"query": "Y"}, "id": "3"},
+            {"name": "append_to_file", "args": {"file_path": "./agent-files/report.md", "content": "b"}, "id": "4"},
+            {"name": "read_file", "args": {"file_path": "agent-files/other.md"}, "id": "5"},
+            {"name": "read_file", "args": {"file_path": "agent-files/other.md"}, "id": "6"},
+        ]
+        groups = group_tool_calls(tool_calls)
+        assert groups == [[0], [1, 3], [2], [4], [5]], f"Unexpected groups {groups}"
+        print("test_group_tool_calls passed.")
+
+    except AssertionError as e:
+        print(f"test_group_tool_calls failed: {e}")
+    except Exception as e:
+        print(f"test_group_tool_calls exception: {e}")
+
+
+def test_concurrent_tool_calls():
+    """ Tests that independent tool calls run at the same time while their results keep the requested order """
+    import tempfile
+    import agent
+    from langchain_core.tools import tool
+
+    @tool
+    def slow_search(query: str) -> str:
+        """ Search that takes 0.2 seconds """
+        time.sleep(0.2)
+        return f"Results for {query}"
+
+    async def aslow_search(query: str) -> str:
+        await asyncio.sleep(0.2)
+        return f"Results for {query}"
+    slow_search.coroutine = aslow_search
+
+    original_tools = tools.AVAILABLE_TOOLS
+    tools.AVAILABLE_TOOLS = original_tools + [slow_search]
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "report.md")
+            tool_calls = [
+                {"name": "slow_search", "args": {"query": "X"}, "id": "1"},
+                {"name": "write_file", "args": {"file_path": path, "content": "first\n"}, "id": "2"},
+                {"name": "slow_search", "args": {"query": "Y"}, "id": "3"},
+                {"name": "append_to_file", "args": {"file_path": path, "content": "second\n"}, "id": "4"},
+                {"name": "slow_search", "args": {"query": "Z"}, "id": "5"},
+            ]
+
+            for run in (invoke_tools, lambda calls: asyncio.run(ainvoke_tools(calls))):
+                start = time.perf_counter()
+                outcomes = run(tool_calls)
+                elapsed = time.perf_counter() - start
+
+                assert elapsed < 0.5, f"Expected concurrent tool calls to take < 0.5s, took {elapsed:.2f}s"
+                assert [outcome["id"] for outcome in outcomes] == ["1", "2", "3", "4", "5"], "Outcomes should keep the tool call order"
+                assert outcomes[2]["result"] == "Results for Y", f"Unexpected result {outcomes[2]['result']}"
+                with open(path, encoding="utf-8") as f:
+                    content = f.read()
+                assert content == "first\nsecond\n", f"Writes to the same path should keep their order, got {content!r}"
+        print("test_concurrent_tool_calls passed.")
+
+    except AssertionError as e:
+        print(f"test_concurrent_tool_calls failed: {e}")
+    except Exception as e:
+        print(f"test_concurrent_tool_calls exception: {e}")
+    finally:
+        tools.AVAILABLE_TOOLS = original_tools
+
+
+def test_web_search_cache():
+    """ Tests that web_search serves normalized repeats from the cache and sends concurrent identical queries once """
+    import tools
+
+    class StubTavilyClient:
+        """ Local stand-in for TavilyClient and AsyncTavilyClient """
+        def __init__(self):
+            self.queries = []
+            self._lock = threading.Lock()
+
+        def search(self, query, max_results=3):
+            with self._lock:
+                self.queries.append(query)
+            time.sleep(0.1)
+            return {"results": [{"title": f"About {query}", "content": "Stub content", "url": "https://example.com"}]}
+
+    class AsyncStubTavilyClient(StubTavilyClient):
+        async def search(self, query, max_results=3):
+            self.queries.append(query)
+            await asyncio.sleep(0.1)
+            return {"results": [{"title": f"About {query}", "content": "Stub content", "url": "https://example.com"}]}
+
+    stub, async_stub = StubTavilyClient(), AsyncStubTavilyClient()
+    original_clients = tools.get_tavily_client, tools.get_async_tavily_client
+    original_key = os.environ.get("TAVILY_API_KEY")
+    tools.get_tavily_client, tools.get_async_tavily_client = (lambda: stub), (lambda: async_stub)
+    os.environ["TAVILY_API_KEY"] = "test-key"
+    cache = search_cache.SearchCache(ttl_seconds=0.5)
+    search_cache.configure_search_cache(cache)
+    try:
+        assert search_cache.normalize_query("  Latest AI   news? ") == "latest ai news", "Queries should be normalized"
+        assert search_cache.normalize_query("C++ vs node.js") == "c++ vs node.js", "Punctuation inside words should be kept"
+
+        # Concurrent identical queries from threads wait for one request
+        results = [None] * 5
+        def search(index):
+            results[index] = web_search.invoke({"query": ["Latest AI news", "latest ai NEWS?", " latest AI news "][index % 3]})
+        threads = [threading.Thread(target=search, args=(i,)) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(stub.queries) == 1, f"Expected one request for identical queries, got {len(stub.queries)}"
+        assert len(set(results)) == 1 and "Stub content" in results[0], f"Every caller should get the same result: {results}"
+
+        # Repeats are served from the cache until the TTL expires
+        web_search.invoke({"query": "latest AI news!"})
+        assert len(stub.queries) == 1, "A repeated query should be served from the cache"
+        time.sleep(0.6)
+        web_search.invoke({"query": "latest AI news"})
+        assert len(stub.queries) == 2, "An expired entry should be fetched again"
+
+        # Same for concurrent asyncio tasks
+        async def search_concurrently():
+            return await asyncio.gather(*[web_search.ainvoke({"query": "Quantum computing"}) for _ in range(5)])
+        async_results = asyncio.run(search_concurrently())
+        assert len(async_stub.queries) == 1, f"Expected one async request, got {len(async_stub.queries)}"
+        assert len(set(async_results)) == 1, "Every async caller should get the same result"
+
+        stats = cache.stats()
+        assert stats["misses"] == 3 and stats["deduplicated"] == 8 and stats["hits"] == 1, f"Unexpected stats {stats}"
+
+        # A cancelled fetch is not passed on: a caller waiting for it fetches the query itself
+        async def cancel_the_leader():
+            cache, started = search_cache.SearchCache(), asyncio.Event()
+
+            async def slow_fetch():
+                started.set()
+                await asyncio.sleep(10)
+
+            async def fetch():
+                return "Fetched by the waiter"
+
+            leader = asyncio.create_task(cache.aget_or_fetch("cancelled", slow_fetch))
+            await started.wait()
+            waiter = asyncio.create_task(cache.aget_or_fetch("cancelled", fetch))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await asyncio.wait_for(waiter, 1), leader.cancelled()
+        result, cancelled = asyncio.run(cancel_the_leader())
+        assert cancelled and result == "Fetched by the waiter", f"The waiter should fetch again, got {result!r}"
+
+        # Failed searches are not cached
+        failing = search_cache.SearchCache()
+        failing.get_or_fetch("broken", lambda: "Search error: timeout")
+        assert failing.stats()["entries"] == 0, "Errors should not be cached"
+
+        # Least recently used entries are evicted over the memory limit
+        small = search_cache.SearchCache(max_bytes=250)
+        for query in ("a", "b", "c"):
+            small.get_or_fetch(query, lambda: "x" * 100)
+        assert small.stats()["entries"] == 2 and small.stats()["evictions"] == 1, f"Unexpected stats {small.stats()}"
+
+        # The on-disk tier is shared between instances, and slow disk I/O does not hold up memory hits
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "searches.sqlite")
+            search_cache.SearchCache(path=path).get_or_fetch("shared", lambda: "From disk")
+            shared = search_cache.SearchCache(path=path)
+            shared.get_or_fetch("in memory", lambda: "From memory")
+            assert shared.get_or_fetch("shared", lambda: "Fetched") == "From disk", "Results stored on disk should be found"
+            with shared._disk_lock:  # A slow disk lookup of another query is running
+                lookup = threading.Thread(target=shared.get_or_fetch, args=("other", lambda: "Other"))
+                lookup.start()
+                start = time.perf_counter()
+                assert shared.get_or_fetch("in memory", lambda: "Fetched") == "From memory"
+                assert time.perf_counter() - start < 0.1, "A memory hit should not wait for disk I/O"
+            lookup.join()
+            assert shared.stats()["disk_hits"] == 1 and shared.stats()["misses"] == 2, f"Unexpected stats {shared.stats()}"
+        print("test_web_search_cache passed.")
+
+    except AssertionError as e:
+        print(f"test_web_search_cache failed: {e}")
+    except Exception as e:
+        print(f"test_web_search_cache exception: {e}")
+    finally:
+        tools.get_tavily_client, tools.get_async_tavily_client = original_clients
+        if original_key is None:
+            os.environ.pop("TAVILY_API_KEY", None)
+        else:
+            os.environ["TAVILY_API_KEY"] = original_key
+        search_cache.configure_search_cache(None)
+
+
+""" Test shared clients """
+
+def test_client_registry_reuses_instances():
+    """ Tests that get_llm() and get_tavily_client() build each client only once """
+    os.environ.setdefault("OPENAI_API_KEY", "test-key")
+    os.environ.setdefault("TAVILY_API_KEY", "test-key")
+    try:
+        clients.close_clients()
+        assert clients.get_llm() is clients.get_llm(), "get_llm() should return the same instance"
+        assert clients.get_llm() is not clients.get_llm(temperature=0.5), "Different temperatures should get different instances"
+        assert clients.get_tavily_client() is clients.get_tavily_client(), "get_tavily_client() should return the same instance"
+        assert clients.get_llm().http_client is clients.get_http_client(), "LLM should use the shared connection pool"
+
+        # Instances built concurrently from several threads must still be unique
+        clients.close_clients()
+        seen = []
+        threads = [threading.Thread(target=lambda: seen.append(clients.get_llm())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len({id(llm) for llm in seen}) == 1, f"Expected one shared instance, got {len({id(llm) for llm in seen})}"
+
+        # Inside an event loop the instance is bound to that loop's async pool
+        async def get_async_llm():
+            return clients.get_llm(), clients.get_async_http_client()
+        llm, async_client = asyncio.run(get_async_llm())
+        assert llm.http_async_client is async_client, "LLM should use the event loop's async connection pool"
+        print("test_client_registry_reuses_instances passed.")
+
+    except AssertionError as e:
+        print(f"test_client_registry_reuses_instances failed: {e}")
+    except Exception as e:
+        print(f"test_client_registry_reuses_instances exception: {e}")
+    finally:
+        clients.close_clients()
+
+
+def test_configure_clients():
+    """ Tests that configure_clients() applies new settings to freshly built clients """
+    os.environ.setdefault("OPENAI_API_KEY", "test-key")
+    original = clients.get_settings()
+    try:
+        old_llm = clients.get_llm()
+        clients.configure_clients(max_connections=5, timeout=15)
+        new_llm = clients.get_llm()
+        assert new_llm is not old_llm, "configure_clients() should rebuild clients"
+        assert new_llm.request_timeout == 15, f"Expected timeout=15, got {new_llm.request_timeout}"
+        assert clients.get_settings()["max_connections"] == 5, "max_connections should be updated"
+
+        try:
+            clients.configure_clients(pool_size=5)
+            assert False, "Unknown settings should raise ValueError"
+        except ValueError:
+            pass
+        print("test_configure_clients passed.")
+
+    except AssertionError as e:
+        print(f"test_configure_clients failed: {e}")
+    except Exception as e:
+        print(f"test_configure_clients exception: {e}")
+    finally:
+        clients.configure_clients(**original)
+
+
+""" Test model routing """
+
+def test_model_routing():
+    """ Tests per-node and per-task tiers, the latency-budget fallback and the cost report, against a local OpenAI-compatible server """
+    import agent
+    import routing
+    from benchmarks.fake_server import FakeServer
+
+    try:
+        with FakeServer(model_latency={"slow-model": 1.0}) as server:
+            endpoint = {"base_url": server.base_url, "api_key": "fake"}
+            router = routing.Router({
+                "tiers": {
+                    "fast": {"model": "fast-model", "input_cost_per_mtok": 1.0, "output_cost_per_mtok": 2.0, **endpoint},
+                    "default": {"model": "default-model", **endpoint},
+                    "slow": {"model": "slow-model", **endpoint},
+                },
+                "nodes": {
+                    "reflect": {"tier": "fast"},
+                    "execute_task": {"tier": "default", "rules": [{"needs_tools": False, "tier": "fast"}]},
+                    "reflect_and_complete": {"tier": "slow", "latency_budget_s": 0.3, "fallback": "fast"},
+                },
+            })
+            routing.configure_router(router)
+
+            agent.reflect_on_task({"id": 1, "title": "Search news", "status": "pending", "result": "Done", "reflection": None})
+            assert server.models == ["fast-model"], f"reflect should use the fast tier, got {server.models}"
+            tool_task = {"title": "Search the web for X", "description": "Save the results to a file"}
+            assert router.routes("execute_task", "prompt", tool_task)[0]["tier"] == "default", "Tasks that need tools keep the node's tier"
+            assert router.routes("execute_task", "prompt", {"title": "Think of a name", "description": "Pick one"})[0]["tier"] == "fast", \
+                "Tasks without tool needs should be routed by the rule"
+
+            for run in (agent.reflect_and_complete, lambda state: asyncio.run(agent.areflect_and_complete(state))):
+                start = time.perf_counter()
+                update = run(new_state("Summarize X"))
+                elapsed = time.perf_counter() - start
+                assert update["output"] == "Task completed successfully.", f"Unexpected output {update}"
+                assert elapsed < 0.9, f"The slow tier should be given up after its latency budget, took {elapsed:.2f}s"
+
+            stats = {(entry["node"], entry["tier"]): entry for entry in router.stats()}
+            slow, fallback = stats[("reflect_and_complete", "slow")], stats[("reflect_and_complete", "fast")]
+            assert slow["timeouts"] == 2 and fallback["fallbacks"] == 2, f"Unexpected stats {slow} {fallback}"
+            reflect = stats[("reflect", "fast")]
+            assert reflect["input_tokens"] == 12 and abs(reflect["cost_usd"] - (12 * 1.0 + 4 * 2.0) / 1e6) < 1e-12, f"Unexpected cost {reflect}"
+            assert "reflect_and_complete" in routing.format_stats(router.stats()), "The report should list every node"
+
+        try:
+            routing.Router({"tiers": {"fast": {"model": "m"}}, "nodes": {"reflect": {"tier": "missing"}}})
+            assert False, "Unknown tiers should be rejected"
+        except ValueError:
+            pass
+
+        router = routing.Router({"tiers": {"fast": {"model": "m"}}})
+        route = router.routes("reflect")[0]
+        for seconds in [0.1] * routing.LATENCY_SAMPLE_SIZE + [0.3] * routing.LATENCY_SAMPLE_SIZE:
+            router.record("reflect", route, seconds)
+        entry = router.stats()[0]
+        assert len(router._stats[("reflect", "fast")]["latencies"]) == routing.LATENCY_SAMPLE_SIZE, "Only recent latencies should be kept"
+        assert abs(entry["mean_ms"] - 200) < 1e-6 and abs(entry["p95_ms"] - 300) < 1e-6, f"Unexpected latency stats {entry}"
+        print("test_model_routing passed.")
+
+    except AssertionError as e:
+        print(f"test_model_routing failed: {e}")
+    except Exception as e:
+        print(f"test_model_routing exception: {e}")
+    finally:
+        routing.configure_router(None)
+
+
+""" Test rate limiting """
+
+def test_rate_limiting():
+    """ Tests the token buckets, the AIMD concurrency limit and retries of 429s from a local OpenAI- and Tavily-compatible server """
+    import agent
+    import ratelimit
+    import routing
+    import tools
+    from benchmarks.fake_server import FakeServer
+
+    original_key = os.environ.get("TAVILY_API_KEY")
+    original_settings = clients.get_settings()
+    try:
+        bucket = ratelimit.TokenBucket(rate=10, capacity=1)
+        assert bucket.reserve(1) == 0, "A full bucket should not make the caller wait"
+        assert 0.09 < bucket.reserve(1) <= 0.1, "The next request should wait for the refill"
+
+        concurrency = ratelimit.AdaptiveConcurrency(maximum=8)
+        started = time.monotonic()
+        for _ in range(2):
+            concurrency.acquire()
+        concurrency.release(started, overloaded=True)
+        concurrency.release(started, overloaded=True)
+        assert concurrency.limit == 4, f"One burst of 429s should halve the limit once, got {concurrency.limit}"
+        concurrency.acquire()
+        concurrency.release(time.monotonic())
+        assert concurrency.limit == 4.25, f"A success should add 1/limit, got {concurrency.limit}"
+
+        # An interrupted or cancelled call frees its slot
+        limiter = ratelimit.ProviderLimiter("interrupted", max_concurrency=1)
+
+        def interrupted():
+            raise KeyboardInterrupt
+
+        async def cancelled():
+            raise asyncio.CancelledError
+
+        for call in (lambda: limiter.call(interrupted), lambda: asyncio.run(limiter.acall(cancelled))):
+            try:
+                call()
+            except (KeyboardInterrupt, asyncio.CancelledError):
+                pass
+            assert limiter.concurrency.in_flight == 0, f"The slot should be freed, {limiter.concurrency.in_flight} in flight"
+
+        # Only the waits of recent calls are kept; the totals cover every call
+        limiter = ratelimit.ProviderLimiter("sampled")
+        for _ in range(ratelimit.WAIT_SAMPLE_SIZE + 10):
+            limiter.call(lambda: "ok")
+        stats = limiter.stats()
+        assert len(limiter._waits) == ratelimit.WAIT_SAMPLE_SIZE, f"The wait sample should be bounded, has {len(limiter._waits)}"
+        assert stats["calls"] == ratelimit.WAIT_SAMPLE_SIZE + 10 and stats["wait_s"] < 0.5, f"Unexpected stats {stats}"
+
+        with FakeServer(latency=0.05, reject_first=2) as server:
+            os.environ["TAVILY_API_KEY"] = "test-key"
+            clients.configure_clients(tavily_base_url=server.base_url)
+            routing.configure_router(routing.Router({"tiers": {"default": {"model": "m", "base_url": server.base_url, "api_key": "fake"}}}))
+            limiter = ratelimit.RateLimiter({
+                "tavily": {"backoff_base_s": 0.01, "requests_per_minute": 1200, "burst_s": 0.1},
+                "default": {"backoff_base_s": 0.01},
+            })
+            ratelimit.configure_rate_limiter(limiter)
+
+            # The first two requests are rejected with 429 and retried
+            response = agent.invoke_llm("reflect_and_complete", "Summarize")
+            assert response.content == "Task completed successfully.", f"Unexpected response {response}"
+            llm = limiter.provider(server.base_url).stats()
+            assert llm["rate_limited"] == 2 and llm["retries"] == 2 and llm["calls"] == 1, f"Unexpected stats {llm}"
+            assert llm["concurrency_decreases"] == 2 and llm["concurrency_limit"] == 8, f"Each 429 of a new request should halve the limit: {llm}"
+
+            # Concurrent searches beyond what the server accepts are retried until they all succeed
+            server.max_in_flight, server.rejected = 2, 0
+            async def search_concurrently():
+                return await asyncio.gather(*[tools.aweb_search(f"Rate limits {i}") for i in range(6)])
+            results = asyncio.run(search_concurrently())
+            assert all("Result 1 for" in result for result in results), f"Every search should succeed: {results}"
+            tavily = limiter.provider("tavily").stats()
+            assert tavily["calls"] == 6 and tavily["failures"] == 0, f"Unexpected stats {tavily}"
+            assert tavily["rate_limited"] == server.rejected, f"Every 429 should be counted: {tavily} vs {server.rejected}"
+            # 20 requests per second with bursts of 2: the six searches sent at once had to wait
+            assert tavily["wait_s"] > 0.1, f"The request rate should be paced, waited {tavily['wait_s']}s"
+
+            # A search still rate limited after the retries is not reported as a failed tool call
+            server.max_in_flight, server.reject_first, server.requests = None, 10, 0
+            ratelimit.configure_rate_limiter(ratelimit.RateLimiter({"tavily": {"max_retries": 1, "backoff_base_s": 0.01}}))
+            result = tools.web_search.invoke({"query": "Still limited"})
+            assert result.startswith("Search unavailable"), f"Unexpected result {result}"
+            outcome = {"name": "web_search", "found": True, "result": result}
+            assert agent.classify_tool_outcome(outcome) == "unclear", "A rate-limited search should be left to the LLM to judge"
+            assert "429s" in ratelimit.format_stats(ratelimit.get_rate_limiter().stats()), "The report should have a 429 column"
+        print("test_rate_limiting passed.")
+
+    except AssertionError as e:
+        print(f"test_rate_limiting failed: {e}")
+    except Exception as e:
+        print(f"test_rate_limiting exception: {e}")
+    finally:
+        ratelimit.configure_rate_limiter(None)
+        routing.configure_router(None)
+        clients.configure_clients(**original_settings)
+        if original_key is None:
+            os.environ.pop("TAVILY_API_KEY", None)
+        else:
+            os.environ["TAVILY_API_KEY"] = original_key
+
+
+""" Test batch runner """
+
+def test_batch_runner():
+    """ Tests that a JSONL batch runs goals concurrently, writes a record per goal and resumes without redoing finished goals """
+    import json
+    import tempfile
+    import batch
+
+    plan = TodoListSchema(tasks=[TaskSchema(id=1, title="Search X", description="Search X")])
+    goals = [json.dumps({"id": f"g{i}", "goal": f"Goal {i}"}) for i in range(3)]
+    goals += ["", "not json", json.dumps({"request_id": "user-001", "title": "Title", "body": "Body"})]
+    goals += [json.dumps({"id": "g1", "goal": "Goal 1 again"})]  # A repeated id would share g1's checkpoint thread
+    try:
+        with tempfile.TemporaryDirectory() as directory, fake_llm_client(FakeLLM(plan=plan, delay=0.1)):
+            input_path, output = os.path.join(directory, "goals.jsonl"), os.path.join(directory, "out", "results.jsonl")
+            with open(input_path, "w") as f:
+                f.write("\n".join(goals) + "\n")
+            app = create_agent_graph()
+
+            start = time.perf_counter()
+            stats = asyncio.run(batch.arun_batch(input_path, output, concurrency=4, app=app))
+            elapsed = time.perf_counter() - start
+            with open(output) as f:
+                records = [json.loads(line) for line in f]
+            assert sorted(r["id"] for r in records) == ["g0", "g1", "g2", "user-001"], f"Unexpected records {records}"
+            assert next(r for r in records if r["id"] == "g1")["goal"] == "Goal 1", "A repeated job id should be skipped"
+            assert all(r["status"] == "ok" and r["output"] for r in records), f"Every goal should succeed: {records}"
+            assert next(r for r in records if r["id"] == "user-001")["goal"] == "Title\n\nBody", "Goals should be read from title and body"
+            assert len({r["thread_id"] for r in records}) == 4, "Every goal needs its own thread id"
+            # Each goal waits 3 x 0.1s on the LLM; one after the other that would take 1.2s
+            assert elapsed < 0.9, f"Expected goals to run concurrently, took {elapsed:.2f}s"
+            assert stats["ok"] == 4 and stats["goals_per_min"] > 0 and stats["latency_s"]["p50"] >= 0.3, f"Unexpected stats {stats}"
+
+            try:
+                asyncio.run(batch.arun_batch(input_path, output, app=app))
+                assert False, "A batch should not append to earlier results without resume"
+            except FileExistsError:
+                pass
+
+            # Interrupted after two goals, in the middle of writing the third record
+            with open(output, "w") as f:
+                f.write("\n".join(json.dumps(r) for r in records[:2]) + "\n" + json.dumps(records[2])[:20])
+            stats = asyncio.run(batch.arun_batch(input_path, output, app=app, resume=True))
+            assert stats["skipped"] == 2 and stats["ok"] == 2, f"Only the unfinished goals should run again, got {stats}"
+            assert batch.finished_jobs(output) == {"g0", "g1", "g2", "user-001"}, f"Unexpected finished jobs {batch.finished_jobs(output)}"
+        print("test_batch_runner passed.")
+
+    except AssertionError as e:
+        print(f"test_batch_runner failed: {e}")
+    except Exception as e:
+        print(f"test_batch_runner exception: {e}")
+
+
+""" Test agent service """
+
+def test_agent_service():
+    """ Tests that the service runs jobs on its workers, applies backpressure, streams progress and reports metrics """
+    import json
+    import urllib.error
+    import urllib.request
+    import service
+
+    plan = TodoListSchema(tasks=[TaskSchema(id=1, title="Search X", description="Search X")])
+
+    def request(url: str, body: dict | None = None) -> tuple[int, bytes]:
+        data = json.dumps(body).encode() if body is not None else None
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, data=data, method="POST" if data else "GET"), timeout=10) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    async def scenario():
+        agent_service = service.AgentService(create_agent_graph(), workers=2, queue_size=2)
+        server = await service.serve(agent_service, port=0)
+        base = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        try:
+            # Nothing is taken off the queue before the event loop runs again: 2 jobs fit, the third is rejected
+            jobs = [agent_service.submit(f"Goal {i}") for i in range(2)]
+            try:
+                agent_service.submit("Goal 2")
+                assert False, "A full queue should reject jobs"
+            except service.QueueFullError:
+                pass
+
+            status, body = await asyncio.to_thread(request, base + "/jobs", {"goal": "Goal 3"})
+            assert status == 202, f"Expected 202 once the workers took the queued jobs, got {status} {body}"
+            job_id = json.loads(body)["id"]
+            status, _ = await asyncio.to_thread(request, base + "/jobs", {"goal": ""})
+            assert status == 400, f"An empty goal should be rejected, got {status}"
+            for config in ({"thread_id": "other"}, {"max_concurrency": "8"}, {"max_concurrency": 0}, [1]):
+                status, _ = await asyncio.to_thread(request, base + "/jobs", {"goal": "Goal 4", "config": config})
+                assert status == 400, f"The config {config} should be rejected, got {status}"
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+            writer.write(b"POST /jobs HTTP/1.1\r\nContent-Length: abc\r\n\r\n")
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            assert response.startswith(b"HTTP/1.1 400"), f"An invalid Content-Length should be rejected, got {response[:40]}"
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+            writer.write(f"POST /jobs HTTP/1.1\r\nContent-Length: {service.MAX_BODY_BYTES + 1}\r\n\r\n".encode())
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            assert response.startswith(b"HTTP/1.1 413"), f"A body over the limit should not be read, got {response[:40]}"
+
+            status, body = await asyncio.to_thread(request, base + f"/jobs/{job_id}/events")
+            events = [json.loads(line) for line in body.decode().splitlines()]
+            assert events[0]["event"] == "started" and events[-1]["event"] == "done", f"Unexpected events {events}"
+            assert any(e.get("node") == "reflect" and e.get("tasks") == [{"id": 1, "status": "complete"}] for e in events), f"Missing progress in {events}"
+
+            status, body = await asyncio.to_thread(request, base + f"/jobs/{job_id}")
+            job = json.loads(body)
+            assert status == 200 and job["status"] == "done" and job["output"], f"Unexpected job {job}"
+            assert all(j.finished for j in jobs), "The directly submitted jobs should be finished before the later one"
+
+            status, body = await asyncio.to_thread(request, base + "/metrics")
+            metrics = json.loads(body)
+            assert metrics["jobs_submitted"] == 3 and metrics["jobs_rejected"] == 1 and metrics["jobs_done"] == 3, f"Unexpected metrics {metrics}"
+            assert metrics["queue_depth"] == 0 and 0 < metrics["worker_utilization"] <= 1, f"Unexpected metrics {metrics}"
+            assert (await asyncio.to_thread(request, base + "/jobs/missing"))[0] == 404, "Unknown jobs should be 404"
+        finally:
+            server.close()
+            await server.wait_closed()
+            await agent_service.stop()
+
+    try:
+        with fake_llm_client(FakeLLM(plan=plan, delay=0.05)):
+            asyncio.run(scenario())
+        print("test_agent_service passed.")
+
+    except AssertionError as e:
+        print(f"test_agent_service failed: {e}")
+    except Exception as e:
+        print(f"test_agent_service exception: {e}")
+
+
+""" Test startup """
+
+def test_lazy_startup():
+    """
+    Tests that main.py imports the agent only when it is needed, that importing the agent does not import
+    langgraph, langchain or pydantic, and that the workflow graph is built once and compiled once per checkpointer
+    """
+    import agent
+    import subprocess
+    import sys
+    from langgraph.checkpoint.memory import MemorySaver
+
+    def imported_by(module: str, names: tuple[str, ...]) -> str:
+        script = f"import {module}, sys; print([name for name in {names!r} if name in sys.modules])"
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip()
+
+    try:
+        heavy = ("langgraph", "langchain_core", "langchain_openai", "langsmith", "pydantic", "tavily", "tools", "clients", "schemas")
+        imported = imported_by("main", ("agent", "dotenv") + heavy)
+        assert imported == "[]", f"Importing main should not import {imported}"
+        imported = imported_by("agent", heavy)
+        assert imported == "[]", f"Importing agent should not import {imported}"
+        assert agent.TodoListSchema is schemas.TodoListSchema and agent.AVAILABLE_TOOLS is tools.AVAILABLE_TOOLS, \
+            "The schemas and tools should still be importable from agent"
+
+        assert agent_workflow() is agent_workflow(), "The workflow graph should be built once"
+        first, second = MemorySaver(), MemorySaver()
+        app, other = create_agent_graph(first), create_agent_graph(second)
+        assert app is not other and app.checkpointer is first and other.checkpointer is second, \
+            "Graphs with different checkpointers should be compiled separately"
+        assert create_agent_graph(first) is app, "The graph should be compiled once per checkpointer"
+        print("test_lazy_startup passed.")
+
+    except AssertionError as e:
+        print(f"test_lazy_startup failed: {e}")
+    except Exception as e:
+        print(f"test_lazy_startup exception: {e}")
+
+
 """ Test graph compilation """
 
 def test_graph_compilation():
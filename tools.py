@@ -1,6 +1,17 @@
 from langchain_core.tools import tool
-from tavily import TavilyClient
+from clients import get_tavily_client, get_async_tavily_client
+from ratelimit import get_rate_limiter, is_rate_limited
+from search_cache import get_search_cache
+from file_cache import get_append_pool, get_file_cache
+from workspace_index import get_workspace_index, snippet
+from typing import Literal
+import asyncio
+import codecs
+import contextlib
+import itertools
+import mmap
 import os
+import re
 import subprocess
 import traceback
 
@@ -20,59 +31,153 @@ def web_search(query: str) -> str:
     if not api_key:
         return "Error: TAVILY_API_KEY not found in .env file."
     
+    def search() -> str:
+        # Paced and retried on 429s by the rate limiter (see ratelimit.py)
+        response = get_rate_limiter().provider("tavily").call(lambda: get_tavily_client().search(query, max_results=3))
+        return format_search_results(query, response)
+
     try:
-        client = TavilyClient(api_key=api_key)
-        response = client.search(query, max_results=3)
-        
-        # Handle response - it should be a dict
-        if not isinstance(response, dict):
-            return f"Unexpected response type from Tavily: {type(response)}"
-        
-        # Get results list
-        results_list = response.get('results', [])
-        if not results_list:
-            return f"No results found for query: '{query}'"
-        
-        results = []
-        for i, result in enumerate(results_list, 1):
-            if not isinstance(result, dict):
-                continue
-                
-            title = result.get('title', 'No title')
-            content = result.get('content', 'No description')
-            url = result.get('url', '')
-            
-            results.append(
-                f"{i}. {title}\n"
-                f"   {content}\n"
-                f"   Source: {url}"
-            )
-        
-        if not results:
-            return f"No valid results found for query: '{query}'"
-        
-        return "\n\n".join(results)
+        # Repeated and concurrent identical queries are answered by one request
+        cache = get_search_cache()
+        return cache.get_or_fetch(query, search, namespace="max_results=3") if cache else search()
     
     except Exception as e:
+        if is_rate_limited(e):
+            return rate_limited_message()
         error_details = traceback.format_exc()
         return f"Search error: {type(e).__name__}: {str(e)}"
 
 
+async def aweb_search(query: str) -> str:
+    """ Async version of web_search, using the event loop's AsyncTavilyClient """
+    api_key = os.getenv("TAVILY_API_KEY")
+    if not api_key:
+        return "Error: TAVILY_API_KEY not found in .env file."
+    
+    async def search() -> str:
+        response = await get_rate_limiter().provider("tavily").acall(lambda: get_async_tavily_client().search(query, max_results=3))
+        return format_search_results(query, response)
+
+    try:
+        cache = get_search_cache()
+        return await cache.aget_or_fetch(query, search, namespace="max_results=3") if cache else await search()
+    
+    except Exception as e:
+        if is_rate_limited(e):
+            return rate_limited_message()
+        return f"Search error: {type(e).__name__}: {str(e)}"
+
+
+def rate_limited_message() -> str:
+    """
+    Result of a search that was still rate limited after every retry. It is not reported as an error: the search
+    itself was fine and can be repeated later, so reflect leaves the verdict to the LLM instead of failing the task
+    """
+    return "Search unavailable: the search API is rate limiting requests, try again later."
+
+
+def format_search_results(query: str, response) -> str:
+    """ Format a Tavily search response as numbered results with title, content summary and source URL """
+    # Handle response - it should be a dict
+    if not isinstance(response, dict):
+        return f"Unexpected response type from Tavily: {type(response)}"
+    
+    # Get results list
+    results_list = response.get('results', [])
+    if not results_list:
+        return f"No results found for query: '{query}'"
+    
+    results = []
+    for i, result in enumerate(results_list, 1):
+        if not isinstance(result, dict):
+            continue
+            
+        title = result.get('title', 'No title')
+        content = result.get('content', 'No description')
+        url = result.get('url', '')
+        
+        results.append(
+            f"{i}. {title}\n"
+            f"   {content}\n"
+            f"   Source: {url}"
+        )
+    
+    if not results:
+        return f"No valid results found for query: '{query}'"
+    
+    return "\n\n".join(results)
+
+
+# read_file limits. Files from READ_FILE_MMAP_BYTES on are memory-mapped instead of loaded
+READ_FILE_MMAP_BYTES = 1024 * 1024
+_SNIFF_BYTES = 64 * 1024
+_SCAN_CHUNK_BYTES = 1024 * 1024
+_BOMS = [  # UTF-32 first, its little-endian BOM starts with the UTF-16 one
+    (codecs.BOM_UTF32_LE, "utf-32-le"), (codecs.BOM_UTF32_BE, "utf-32-be"), (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"), (codecs.BOM_UTF16_BE, "utf-16-be"),
+]
+
+
+def get_read_file_max_chars() -> int:
+    """ Most characters read_file returns at once; larger reads return a head/tail excerpt. Set with AGENT_READ_FILE_MAX_CHARS """
+    return max(1000, int(os.getenv("AGENT_READ_FILE_MAX_CHARS", "20000")))
+
+
 @tool
-def read_file(file_path: str) -> str:
+def read_file(file_path: str, offset: int = 0, limit: int | None = None, unit: Literal["lines", "bytes"] = "lines", probe: bool = False) -> str:
     """
-    Read the contents of a file.
+    Read the contents of a file, or a range of it. Large files are returned as an excerpt of their start and end,
+    page through them with offset and limit.
     
     Args:
         file_path (str): The path to the file to read (e.g., "notes.txt", "data/results.json")
+        offset (int): First line (or byte, see unit) to read, counting from 0
+        limit (int): Number of lines (or bytes) to read. Reads to the end of the file if not given
+        unit (str): "lines" (default) or "bytes"
+        probe (bool): Only return the file's size, line count and encoding, without its contents
     
     Returns:
-        str: The contents of the file, or an error message if the file cannot be read
+        str: The contents of the file (or the requested range), or an error message if the file cannot be read
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return f"File '{file_path}' contents:\n\n{content}"
+        if offset < 0 or (limit is not None and limit < 0):
+            return "Error: offset and limit must not be negative"
+        if unit not in ("lines", "bytes"):
+            return f"Error: unit must be 'lines' or 'bytes', not '{unit}'"
+
+        with _file_contents(file_path) as data:
+            size = len(data)
+            encoding, bom = _sniff_encoding(data[:_SNIFF_BYTES])
+            if encoding is None:
+                return f"Error: File '{file_path}' looks like a binary file ({_describe(size, 'binary')}) and cannot be read as text"
+            if probe:
+                if not _single_byte_newlines(encoding):
+                    text = bytes(data[bom:]).decode(encoding, errors="replace")
+                    lines = text.count("\n") + (bool(text) and not text.endswith("\n"))
+                else:
+                    lines = _count_lines(data, bom)
+                return f"File '{file_path}': {_describe(size, encoding)}, {lines:,} lines"
+
+            if unit == "bytes":
+                start = min(bom + offset, size)
+                end = size if limit is None else min(start + limit, size)
+                label = f"bytes {start}-{end}"
+                more = f"continue with offset={end - bom}" if end < size else None
+            elif offset == 0 and limit is None and _single_byte_newlines(encoding):
+                start, end, label, more = bom, size, None, None  # The whole file, no need to count its lines
+            elif _single_byte_newlines(encoding):
+                start, end, lines = _line_range(data, bom, offset, limit)
+                if lines == 0 and offset > 0:
+                    return f"File '{file_path}' ({_describe(size, encoding)}) has no lines from offset {offset} on"
+                label = f"lines {offset + 1}-{offset + lines}"
+                more = f"continue with offset={offset + lines}" if end < size else None
+            else:
+                # UTF-16/32: newlines are not single bytes, read the lines through a decoder
+                return _read_decoded_lines(file_path, size, encoding, offset, limit)
+
+            whole = offset == 0 and limit is None
+            return _render(file_path, data, start, end, encoding, size, None if whole else label, more)
+
     except FileNotFoundError:
         return f"Error: File '{file_path}' not found"
     except PermissionError:
@@ -81,6 +186,137 @@ def read_file(file_path: str) -> str:
         return f"Error reading file: {type(e).__name__}: {str(e)}"
 
 
+def _single_byte_newlines(encoding: str) -> bool:
+    return encoding in ("utf-8", "cp1252")
+
+
+@contextlib.contextmanager
+def _file_contents(file_path: str):
+    """
+    The file's bytes: from the file cache if it is unchanged since it was cached, memory-mapped for large files
+    so only the pages that are read are loaded, and read (and cached) otherwise
+    """
+    get_append_pool().flush(file_path)  # Buffered appends are part of the file
+    cache = get_file_cache()
+    contents = cache.get(file_path) if cache else None
+    if contents is not None:
+        yield contents
+        return
+
+    with open(file_path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        if st.st_size >= READ_FILE_MMAP_BYTES:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+            return
+        contents = f.read()
+    if cache:
+        cache.put(file_path, contents, st)
+    yield contents
+
+
+def _sniff_encoding(sample: bytes) -> tuple[str | None, int]:
+    """ Encoding of a file from its first bytes, and the length of its byte order mark. None for binary files """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding, len(bom)
+    if b"\x00" in sample:
+        return None, 0
+    try:
+        sample.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start < len(sample) - 3:  # Not just a character cut off at the end of the sample
+            return "cp1252", 0
+    return "utf-8", 0
+
+
+def _line_range(data, start: int, offset: int, limit: int | None) -> tuple[int, int, int]:
+    """ Byte range of `limit` lines from line `offset` on, and the number of lines in it """
+    start, _ = _skip_lines(data, start, offset)
+    if limit is None:
+        return start, len(data), _count_lines(data, start)
+    end, lines = _skip_lines(data, start, limit)
+    return start, end, lines
+
+
+def _skip_lines(data, position: int, lines: int) -> tuple[int, int]:
+    """ Position after the next `lines` lines from position on, and the number of lines skipped (fewer at the end of the file) """
+    skipped = 0
+    while skipped < lines and position < len(data):
+        chunk = data[position:position + _SCAN_CHUNK_BYTES]
+        newlines = chunk.count(b"\n")
+        if skipped + newlines < lines:
+            # Whole chunk, counted in C; the last line of the file may have no newline
+            skipped += newlines
+            position += len(chunk)
+            if position == len(data) and not chunk.endswith(b"\n"):
+                skipped += 1
+            continue
+        index = -1
+        for _ in range(lines - skipped):
+            index = chunk.find(b"\n", index + 1)
+        return position + index + 1, lines
+    return position, skipped
+
+
+def _count_lines(data, start: int = 0) -> int:
+    """ Number of lines from start to the end of the file, scanned in chunks """
+    size = len(data)
+    newlines = sum(data[i:i + _SCAN_CHUNK_BYTES].count(b"\n") for i in range(start, size, _SCAN_CHUNK_BYTES))
+    return newlines + (size > start and data[size - 1:size] != b"\n")
+
+
+def _read_decoded_lines(file_path: str, size: int, encoding: str, offset: int, limit: int | None) -> str:
+    """ Line range of a UTF-16/32 file, read through a decoder without loading the file """
+    max_chars = get_read_file_max_chars()
+    with open(file_path, encoding=encoding.replace("-le", "").replace("-be", ""), errors="replace", newline="") as f:
+        selected = itertools.islice(f, offset, None if limit is None else offset + limit)
+        lines, chars = [], 0
+        for line in selected:
+            if chars + len(line) > max_chars:
+                break
+            lines.append(line)
+            chars += len(line)
+        more = next(selected, None) is not None or next(f, None) is not None
+    content = "".join(lines)
+    if offset == 0 and not more:
+        return f"File '{file_path}' contents:\n\n{content}"
+    footer = f"\n\n[More lines follow: continue with offset={offset + len(lines)}]" if more else ""
+    return f"File '{file_path}' lines {offset + 1}-{offset + len(lines)} ({_describe(size, encoding)}):\n\n{content}{footer}"
+
+
+def _render(file_path: str, data, start: int, end: int, encoding: str, size: int, label: str | None, more: str | None) -> str:
+    """ Decode a byte range of the file. Ranges over the size cap become an excerpt of their first and last lines """
+    max_chars = get_read_file_max_chars()
+    footer = f"\n\n[More follows: {more}]" if more else ""
+
+    if end - start <= max_chars:
+        content = bytes(data[start:end]).decode(encoding, errors="replace")
+        if label is None:
+            return f"File '{file_path}' contents:\n\n{content}"
+        return f"File '{file_path}' {label} ({_describe(size, encoding)}):\n\n{content}{footer}"
+
+    # Head and tail, cut at line boundaries where possible
+    half = max_chars // 2
+    head_end = data.rfind(b"\n", start, start + half) + 1 or start + half
+    tail_start = data.find(b"\n", end - half, end) + 1 or end - half
+    head = bytes(data[start:head_end]).decode(encoding, errors="replace")
+    tail = bytes(data[tail_start:end]).decode(encoding, errors="replace")
+    omitted = tail_start - head_end
+    return (
+        f"File '{file_path}' {label or 'contents'} ({_describe(size, encoding)}) is too large to return whole, "
+        f"showing its start and end. Use offset and limit to read the rest, or probe=True for its line count.\n\n"
+        f"{head}\n[... {omitted:,} bytes omitted ...]\n{tail}{footer}"
+    )
+
+
+def _describe(size: int, encoding: str) -> str:
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:,} {unit}, {encoding}" if unit == "bytes" else f"{size:.1f} {unit}, {encoding}"
+        size /= 1024
+
+
 
 @tool
 def write_file(file_path: str, content: str) -> str:
@@ -98,8 +334,15 @@ def write_file(file_path: str, content: str) -> str:
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(file_path) if os.path.dirname(file_path) else '.', exist_ok=True)
         
+        get_append_pool().release(file_path)  # Buffered appends go first, then are overwritten
         with open(file_path, 'w', encoding='utf-8') as f:
             f.write(content)
+            f.flush()
+            st = os.fstat(f.fileno())
+        cache = get_file_cache()
+        if cache:
+            cache.put(file_path, content.encode('utf-8'), st, written=True)
+        get_workspace_index().update(file_path, content)
         
         return f"Successfully wrote {len(content)} characters to '{file_path}'"
     except PermissionError:
@@ -121,11 +364,9 @@ def append_to_file(file_path: str, content: str) -> str:
         str: Success message or error message
     """
     try:
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(file_path) if os.path.dirname(file_path) else '.', exist_ok=True)
-        
-        with open(file_path, 'a', encoding='utf-8') as f:
-            f.write(content)
+        # Written through an open handle (the directory is created when it is opened); buffered only if AGENT_APPEND_FLUSH_MS is set
+        if not get_append_pool().append(file_path, content):
+            return f"Buffered {len(content)} characters for '{file_path}'; they are written within AGENT_APPEND_FLUSH_MS"
         
         return f"Successfully appended {len(content)} characters to '{file_path}'"
     except PermissionError:
@@ -134,5 +375,59 @@ def append_to_file(file_path: str, content: str) -> str:
         return f"Error appending to file: {type(e).__name__}: {str(e)}"
 
 
+@tool
+def search_workspace(query: str, regex: bool = False, max_results: int = 20) -> str:
+    """
+    Search the files in the agent-files/ workspace and return the matching lines as file:line snippets.
+    Use it to find something in earlier files instead of reading them whole.
+    
+    Args:
+        query (str): Keywords (every keyword must be in the file, case-insensitive), or a regular expression if regex is true
+        regex (bool): Treat query as a Python regular expression, matched against each line
+        max_results (int): Maximum number of matching lines to return
+    
+    Returns:
+        str: One "path:line: text" entry per matching line, or a message that nothing matched
+    """
+    index = get_workspace_index()
+    try:
+        get_append_pool().flush()
+        matches, files = index.search(query, regex=regex, max_results=max(1, max_results))
+    except re.error as e:
+        return f"Error: Invalid regular expression '{query}': {e}"
+    except Exception as e:
+        return f"Error searching workspace: {type(e).__name__}: {str(e)}"
+
+    if not matches:
+        return f"No matches for '{query}' in {index.root}/"
+    lines = [f"{os.path.join(index.root, path)}:{number}: {snippet(line, query, regex)}" for path, number, line in matches]
+    shown = f", showing the first {len(matches)}" if len(matches) == max_results else ""
+    return f"Matches for '{query}' in {files} file(s){shown}:\n" + "\n".join(lines)
+
+
+
+""" Async tool implementations """
+
+def run_in_thread(sync_tool):
+    """ 
+    Give a tool an async implementation that runs its sync function in a worker thread,
+    so file I/O does not block the event loop. 
+    """
+    async def coroutine(**kwargs):
+        return await asyncio.to_thread(sync_tool.func, **kwargs)
+    return coroutine
+
+
+# tool.ainvoke() uses these instead of running the sync function in the default executor
+web_search.coroutine = aweb_search
+read_file.coroutine = run_in_thread(read_file)
+write_file.coroutine = run_in_thread(write_file)
+append_to_file.coroutine = run_in_thread(append_to_file)
+search_workspace.coroutine = run_in_thread(search_workspace)
+
+
 # List of all available tools for the agent
-AVAILABLE_TOOLS = [web_search, read_file, write_file, append_to_file]
+AVAILABLE_TOOLS = [web_search, read_file, write_file, append_to_file, search_workspace]
+
+# Tools that modify the file at their 'file_path' argument. Calls to these must not run concurrently with other calls on the same path
+FILE_WRITING_TOOLS = {write_file.name, append_to_file.name}
@@ -0,0 +1,290 @@
+import contextvars
+import json
+import os
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from ratelimit import current_attempt
+
+"""
+Span-based tracing of graph nodes, LLM calls and tool invocations.
+
+A Tracer is a callback handler: pass it with the run's callbacks (new_run_config(callbacks=[tracer])) and every
+graph node, chat model call and tool call of the run becomes a span with its wall time and attributes:
+- LLM calls: model, input/output/cached tokens, prompt and completion size, time to first token, HTTP requests
+  and request/response bytes (counted by the HTTP hooks below), and retries: 1 if the rate limiter (ratelimit.py)
+  sent the call again after a failed attempt, whose span is marked as failed
+- Tool calls: input and output size
+- Nodes: output size
+Spans are nested under the nearest traced parent (an LLM call under its node) and written, one JSON object per line,
+to a JSONL file as they finish. summary() aggregates them per span name; close() appends it to the file.
+
+When no Tracer is attached nothing is recorded: the HTTP hooks installed on the shared clients (see clients.py)
+only read one context variable per request.
+"""
+
+# The LLM span of the call running in the current context, for the HTTP hooks
+_current_llm_span: contextvars.ContextVar[dict | None] = contextvars.ContextVar("current_llm_span", default=None)
+
+# Attributes added up per span name in summary()
+SUMMED_ATTRIBUTES = ("input_tokens", "output_tokens", "cached_tokens", "retries", "http_requests", "request_bytes",
+                     "response_bytes", "input_chars", "output_chars")
+
+
+class Tracer(BaseCallbackHandler):
+    """
+    Callback handler recording spans for graph nodes, LLM calls and tool calls.
+
+    Args:
+        path: JSONL file the spans are appended to; spans are only kept in memory if not given
+    """
+
+    run_inline = True  # Called in the context of the traced call, so the HTTP hooks see its span
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.spans: list[dict] = []  # Finished spans
+        self._open: dict = {}  # Run id -> open span
+        self._parents: dict = {}  # Run id of every running runnable -> parent run id
+        self._context_tokens: dict = {}  # LLM run id -> token to restore the current LLM span
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+
+    # Span bookkeeping
+
+    def _start(self, run_id, parent_run_id, kind: str, name: str, metadata: dict | None, **attributes) -> dict:
+        metadata = metadata or {}
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+            parent = parent_run_id
+            while parent is not None and parent not in self._open:  # Nearest traced ancestor
+                parent = self._parents.get(parent)
+            span = {
+                "type": "span",
+                "trace_id": metadata.get("thread_id"),
+                "span_id": run_id.hex,
+                "parent_id": parent.hex if parent is not None else None,
+                "kind": kind,
+                "name": name,
+                "node": metadata.get("langgraph_node"),
+                "start": time.time(),
+                "duration_ms": None,
+                "status": "ok",
+                "attributes": attributes,
+                "_start": time.perf_counter(),
+            }
+            self._open[run_id] = span
+        return span
+
+    def _end(self, run_id, error: BaseException | None = None, **attributes) -> dict | None:
+        with self._lock:
+            self._parents.pop(run_id, None)
+            span = self._open.pop(run_id, None)
+            if span is None:
+                return None
+            span["duration_ms"] = (time.perf_counter() - span.pop("_start")) * 1000
+            span["attributes"].update(attributes)
+            if error is not None:
+                span["status"] = "error"
+                span["error"] = f"{type(error).__name__}: {error}"
+            self.spans.append(span)
+            if self._file is not None:
+                self._file.write(json.dumps(span, default=str) + "\n")
+        return span
+
+    # Graph nodes (and every other runnable, so spans nest under the right parent)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, name=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        parent = self._open.get(parent_run_id)
+        # The node itself, not the runnable of the same name it wraps
+        if node is not None and name == node and not (parent and parent["kind"] == "node" and parent["name"] == node):
+            self._start(run_id, parent_run_id, "node", node, metadata)
+        else:
+            with self._lock:
+                self._parents[run_id] = parent_run_id
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        if run_id in self._open:
+            self._end(run_id, output_chars=_size(outputs))
+        else:
+            with self._lock:
+                self._parents.pop(run_id, None)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        if run_id in self._open:
+            self._end(run_id, error)
+        else:
+            with self._lock:
+                self._parents.pop(run_id, None)
+
+    # LLM calls
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, invocation_params=None, **kwargs):
+        params = invocation_params or {}
+        model = params.get("model") or params.get("model_name") or (metadata or {}).get("ls_model_name") or (serialized or {}).get("name", "chat_model")
+        span = self._start(run_id, parent_run_id, "llm", model, metadata,
+                           input_chars=sum(len(str(message.content)) for batch in messages for message in batch),
+                           http_requests=0, retries=int(current_attempt() > 0), request_bytes=0, response_bytes=0)
+        self._context_tokens[run_id] = _current_llm_span.set(span)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        span = self._open.get(run_id)
+        if span is not None and token and "time_to_first_token_ms" not in span["attributes"]:
+            span["attributes"]["time_to_first_token_ms"] = (time.perf_counter() - span["_start"]) * 1000
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._restore_llm_span(run_id)
+        attributes = {"output_chars": 0}
+        for generations in response.generations:
+            for generation in generations:
+                attributes["output_chars"] += len(generation.text or "")
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    attributes["input_tokens"] = attributes.get("input_tokens", 0) + usage.get("input_tokens", 0)
+                    attributes["output_tokens"] = attributes.get("output_tokens", 0) + usage.get("output_tokens", 0)
+                    cached = (usage.get("input_token_details") or {}).get("cache_read")
+                    if cached:
+                        attributes["cached_tokens"] = attributes.get("cached_tokens", 0) + cached
+        self._end(run_id, **attributes)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._restore_llm_span(run_id)
+        self._end(run_id, error)
+
+    def _restore_llm_span(self, run_id) -> None:
+        token = self._context_tokens.pop(run_id, None)
+        if token is None:
+            return
+        try:
+            _current_llm_span.reset(token)
+        except ValueError:  # Ended in another context than it started in
+            _current_llm_span.set(None)
+
+    # Tool calls
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, metadata=None, name=None, **kwargs):
+        self._start(run_id, parent_run_id, "tool", name or (serialized or {}).get("name", "tool"), metadata, input_chars=len(input_str or ""))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, output_chars=_size(output))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    # Retries of runnables wrapped with with_retry()
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        with self._lock:
+            parent = run_id
+            while parent is not None and parent not in self._open:
+                parent = self._parents.get(parent)
+            if parent is not None:
+                attributes = self._open[parent]["attributes"]
+                attributes["retries"] = attributes.get("retries", 0) + 1
+
+    # Results
+
+    def summary(self) -> list[dict]:
+        """
+        Spans aggregated per kind and name (LLM and tool calls also per node): count, errors,
+        wall time statistics and summed attributes, slowest total first
+        """
+        with self._lock:
+            spans = list(self.spans)
+        groups: dict[tuple, list[dict]] = {}
+        for span in spans:
+            node = span["node"] if span["kind"] != "node" else None
+            groups.setdefault((span["kind"], span["name"], node), []).append(span)
+
+        summary = []
+        for (kind, name, node), group in groups.items():
+            durations = sorted(span["duration_ms"] for span in group)
+            entry = {
+                "kind": kind,
+                "name": name,
+                "node": node,
+                "count": len(group),
+                "errors": sum(span["status"] == "error" for span in group),
+                "total_ms": sum(durations),
+                "mean_ms": sum(durations) / len(durations),
+                "p50_ms": durations[len(durations) // 2],
+                "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+                "max_ms": durations[-1],
+            }
+            for attribute in SUMMED_ATTRIBUTES:
+                values = [span["attributes"][attribute] for span in group if attribute in span["attributes"]]
+                if values:
+                    entry[attribute] = sum(values)
+            summary.append(entry)
+        return sorted(summary, key=lambda entry: entry["total_ms"], reverse=True)
+
+    def close(self) -> list[dict]:
+        """ Append the summary to the trace file, close it and return the summary """
+        summary = self.summary()
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps({"type": "summary", "spans": summary}) + "\n")
+                self._file.close()
+                self._file = None
+        return summary
+
+
+def _size(value) -> int:
+    """ Payload size of a node or tool output, in characters """
+    if isinstance(value, str):
+        return len(value)
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return len(str(value))
+
+
+def format_summary(summary: list[dict]) -> str:
+    """ Render a summary as a table """
+    lines = [f"{'span':<46}  {'count':>5}  {'total':>9}  {'mean':>9}  {'p95':>9}  {'tokens in/out':>15}  {'retries':>7}  {'errors':>6}"]
+    for entry in summary:
+        tokens = f"{entry['input_tokens']}/{entry['output_tokens']}" if "input_tokens" in entry else "-"
+        label = f"{entry['kind']}:{entry['name']}" + (f" in {entry['node']}" if entry["node"] else "")
+        lines.append(
+            f"{label:<46}  {entry['count']:>5}  {entry['total_ms']:>7.0f}ms  {entry['mean_ms']:>7.1f}ms  "
+            f"{entry['p95_ms']:>7.1f}ms  {tokens:>15}  {entry.get('retries', 0):>7}  {entry['errors']:>6}"
+        )
+    return "\n".join(lines)
+
+
+
+
+""" HTTP hooks """
+
+def trace_http_request(request) -> None:
+    """ httpx request hook: counts requests and bytes sent for the current LLM span """
+    span = _current_llm_span.get()
+    if span is None:
+        return
+    attributes = span["attributes"]
+    attributes["http_requests"] += 1
+    attributes["request_bytes"] += int(request.headers.get("content-length", 0))
+
+
+def trace_http_response(response) -> None:
+    """ httpx response hook: counts bytes received for the current LLM span """
+    span = _current_llm_span.get()
+    if span is not None:
+        span["attributes"]["response_bytes"] += int(response.headers.get("content-length", 0))
+
+
+async def atrace_http_request(request) -> None:
+    """ Async version of trace_http_request(), for httpx.AsyncClient """
+    trace_http_request(request)
+
+
+async def atrace_http_response(response) -> None:
+    """ Async version of trace_http_response(), for httpx.AsyncClient """
+    trace_http_response(response)
@@ -0,0 +1,371 @@
+import os
+import re
+import threading
+import time
+
+try:
+    import re._parser as _sre_parse  # Python 3.11+
+    import re._constants as _sre_constants
+except ImportError:
+    import sre_parse as _sre_parse
+    import sre_constants as _sre_constants
+
+"""
+Inverted index over the agent's workspace (agent-files/), for the search_workspace tool.
+
+execute_task tells the model to keep its files in agent-files/. Without an index the only way to find something
+there is to read whole files into the prompt. WorkspaceIndex maps every word to the files containing it, so a
+keyword query only opens the few files that contain all of its words, and a regex query only the files that
+contain the words every match needs (see required_words()). Matching lines are returned as file:line snippets.
+
+Keeping the index current:
+- write_file and append_to_file update it directly (see tools.py), without reading the file back.
+- Files changed outside the agent are found by a stat walk at most every `rescan_interval` seconds. Until they are
+  re-indexed they are searched with a streaming scan instead of the index. The walk and the re-indexing run in a
+  background thread, so a query never waits for them (except the first one, which needs the list of files).
+"""
+
+_WORD = re.compile(r"\w+")
+_WORD_CHAR = re.compile(r"\w")
+_BOUNDARIES = {  # Anchors that keep a word from continuing past them
+    _sre_constants.AT_BEGINNING, _sre_constants.AT_BEGINNING_LINE, _sre_constants.AT_BEGINNING_STRING,
+    _sre_constants.AT_BOUNDARY, _sre_constants.AT_END, _sre_constants.AT_END_LINE, _sre_constants.AT_END_STRING,
+}
+_SNIPPET_CHARS = 200
+
+
+def words(text: str) -> set[str]:
+    """ Lowercased words of a text, as they are indexed """
+    return set(_WORD.findall(text.lower()))
+
+
+def required_words(pattern: str) -> list[tuple[str, bool, bool]]:
+    """
+    Words that every match of a regular expression contains, as (word, bounded on the left, bounded on the right).
+    A word that is not bounded may be part of a longer indexed word. Only the top-level sequence of the pattern is
+    used, so alternations, optional parts and repeats never add a requirement that a match could avoid.
+    """
+    try:
+        items = list(_sre_parse.parse(pattern))
+    except Exception:
+        return []
+
+    result = []
+    word, left_bounded, previous_boundary = "", False, False  # previous_boundary: the last item ends any word
+    for op, value in items + [(None, None)]:
+        if op == _sre_constants.LITERAL and _WORD_CHAR.match(chr(value)):
+            if not word:
+                left_bounded = previous_boundary
+            word += chr(value)
+            continue
+
+        boundary = (op == _sre_constants.LITERAL) or (op == _sre_constants.AT and value in _BOUNDARIES)
+        if word:
+            result.append((word.lower(), left_bounded, boundary))
+            word = ""
+        previous_boundary = boundary
+    return result
+
+
+class WorkspaceIndex:
+    """
+    Incrementally maintained word index of the text files under root.
+
+    Args:
+        root: Workspace directory
+        rescan_interval: Seconds between stat walks looking for files changed outside the agent
+        max_file_bytes: Larger files are not indexed, only scanned
+        background: Rescan and re-index in a background thread. Otherwise queries do it first
+    """
+
+    def __init__(self, root: str = "agent-files", rescan_interval: float = 1.0, max_file_bytes: int = 16 * 1024 * 1024,
+                 background: bool = True):
+        self.root = root
+        self.rescan_interval = rescan_interval
+        self.max_file_bytes = max_file_bytes
+        self.background = background
+        self._worker: threading.Thread | None = None
+        self._postings: dict[str, set[str]] = {}  # word -> paths of the indexed files containing it
+        self._file_words: dict[str, set[str]] = {}  # path -> its words, to remove them again
+        self._signatures: dict[str, tuple[int, int]] = {}  # path -> (mtime_ns, size) when it was last indexed or scanned
+        self._dirty: set[str] = set()  # Changed outside the agent, not (yet) re-indexed: always scanned
+        self._unindexed: set[str] = set()  # Too large to index: always scanned
+        self._last_scan = 0.0
+        self._lock = threading.RLock()
+
+    # Index maintenance
+
+    def _path(self, path: str) -> str | None:
+        """ Normalized path of a file under root, None for files outside of it """
+        path = os.path.normpath(path)
+        root = os.path.normpath(self.root)
+        if os.path.abspath(path) != os.path.abspath(root) and os.path.abspath(path).startswith(os.path.abspath(root) + os.sep):
+            return os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+        return None
+
+    def _remove(self, path: str) -> None:
+        """ Drop a file from the index. Called with the lock held """
+        for word in self._file_words.pop(path, ()):
+            paths = self._postings.get(word)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._postings[word]
+
+    def _add_words(self, path: str, new_words: set[str]) -> None:
+        """ Called with the lock held """
+        known = self._file_words.setdefault(path, set())
+        for word in new_words - known:
+            self._postings.setdefault(word, set()).add(path)
+        known |= new_words
+
+    def _signature(self, path: str) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(os.path.join(self.root, path))
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def update(self, path: str, content: str | None = None, appended: bool = False) -> None:
+        """
+        Record a write by the agent.
+
+        Args:
+            path: The written file
+            content: The written text (the appended text if appended). Read from the file if not given
+            appended: content was appended to the file instead of replacing it
+        """
+        path = self._path(path)
+        if path is None:
+            return
+        signature = self._signature(path)
+        with self._lock:
+            if not self._last_scan:
+                return  # Not built yet, the first query indexes every file
+            indexed = path in self._file_words
+            self._dirty.discard(path)
+            self._unindexed.discard(path)
+            if signature is None:  # Deleted meanwhile
+                self._remove(path)
+                self._signatures.pop(path, None)
+                return
+            self._signatures[path] = signature
+            if signature[1] > self.max_file_bytes:
+                self._remove(path)
+                self._unindexed.add(path)
+            elif content is None or (appended and not indexed and signature[1] != len(content.encode("utf-8"))):
+                # Unknown content, or appended to a file that is not in the index: read it again
+                self._remove(path)
+                self._dirty.add(path)
+            else:
+                if not appended:
+                    self._remove(path)
+                self._add_words(path, words(content))
+
+    def refresh(self, force: bool = False) -> None:
+        """ Find files created, changed or deleted outside the agent. They are scanned until they are re-indexed """
+        now = time.monotonic()
+        if not force and now - self._last_scan < self.rescan_interval:
+            return
+
+        found = {}
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                full_path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    continue
+                found[os.path.relpath(full_path, self.root)] = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            for path in set(self._signatures) - set(found):
+                self._remove(path)
+                del self._signatures[path]
+                self._dirty.discard(path)
+                self._unindexed.discard(path)
+            for path, signature in found.items():
+                if self._signatures.get(path) != signature:
+                    self._remove(path)
+                    self._signatures[path] = signature
+                    self._unindexed.discard(path)
+                    if signature[1] > self.max_file_bytes:
+                        self._unindexed.add(path)
+                    else:
+                        self._dirty.add(path)
+            self._last_scan = now
+
+    def reindex(self) -> None:
+        """ Index the files changed outside the agent """
+        while True:
+            with self._lock:
+                if not self._dirty:
+                    return
+                path = next(iter(self._dirty))
+                signature = self._signatures.get(path)
+            file_words = set()
+            try:
+                with open(os.path.join(self.root, path), encoding="utf-8", errors="replace") as f:
+                    if "\x00" in f.read(8192):
+                        file_words = None  # Binary: never matches
+                    else:
+                        f.seek(0)
+                        for line in f:
+                            file_words |= words(line)
+            except OSError:
+                file_words = set()
+            with self._lock:
+                if path in self._dirty and self._signatures.get(path) == signature:  # Not changed again meanwhile
+                    self._dirty.discard(path)
+                    self._remove(path)
+                    if file_words is not None:
+                        self._add_words(path, file_words)
+
+    def _maintain(self) -> None:
+        """ Rescan when it is due and index changed files, in the background unless background is off """
+        if not self._last_scan:
+            self.refresh(force=True)  # The first query needs the list of files
+        due = time.monotonic() - self._last_scan >= self.rescan_interval
+        if not due and not self._dirty:
+            return
+        if not self.background:
+            self.refresh()
+            self.reindex()
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._update, name="workspace-index", daemon=True)
+                self._worker.start()
+
+    def _update(self) -> None:
+        self.refresh()
+        self.reindex()
+
+    def wait(self) -> None:
+        """ Wait until the background rescan and re-indexing are done """
+        worker = self._worker
+        if worker is not None:
+            worker.join()
+
+    # Queries
+
+    def _files_with(self, word: str, left_bounded: bool, right_bounded: bool) -> set[str]:
+        """ Indexed files containing word, or an indexed word it can be part of. Called with the lock held """
+        if left_bounded and right_bounded:
+            return set(self._postings.get(word, ()))
+        if left_bounded:
+            matches = (w for w in self._postings if w.startswith(word))
+        elif right_bounded:
+            matches = (w for w in self._postings if w.endswith(word))
+        else:
+            matches = (w for w in self._postings if word in w)
+        files = set()
+        for w in matches:
+            files |= self._postings[w]
+        return files
+
+    def candidates(self, required: list[tuple[str, bool, bool]]) -> list[str]:
+        """ Files that can contain a match: indexed files with every required word, and every file not in the index """
+        with self._lock:
+            files = None
+            for word in sorted(required, key=lambda r: not (r[1] and r[2])):  # Exact lookups first, they are cheapest
+                matching = self._files_with(*word)
+                files = matching if files is None else files & matching
+                if len(files) <= 8:  # Few enough to scan, further (slower) lookups would not save anything
+                    break
+            if files is None:
+                files = set(self._file_words)
+            return sorted(files | self._dirty | self._unindexed)
+
+    def search(self, query: str, regex: bool = False, max_results: int = 20) -> tuple[list[tuple[str, int, str]], int]:
+        """
+        Find lines matching a keyword query (every word must be in the file, lines with more of the words come first)
+        or a regular expression.
+
+        Returns:
+            Up to max_results (path relative to root, line number, line) matches, and the number of files with a match
+
+        Raises:
+            re.error: If regex is set and the pattern is invalid
+        """
+        if not os.path.isdir(self.root):
+            return [], 0
+        self._maintain()
+
+        if regex:
+            pattern = re.compile(query)
+            required = required_words(query)
+            line_score = lambda line: 1 if pattern.search(line) else 0
+        else:
+            query_words = sorted(words(query))
+            if not query_words:
+                return [], 0
+            required = [(word, True, True) for word in query_words]
+            word_patterns = [re.compile(rf"\b{re.escape(word)}\b", re.IGNORECASE) for word in query_words]
+            line_score = lambda line: sum(1 for p in word_patterns if p.search(line))
+
+        matches, files_matched = [], 0
+        for path in self.candidates(required):
+            file_matches = self._scan(path, line_score)
+            # Candidates not yet indexed may lack some of the words
+            if not regex and file_matches and not all(any(p.search(match[3]) for match in file_matches) for p in word_patterns):
+                continue
+            if file_matches:
+                files_matched += 1
+                matches.extend(file_matches)
+
+        matches.sort(key=lambda match: (-match[0], match[1], match[2]))
+        return [(path, number, line) for _, path, number, line in matches[:max_results]], files_matched
+
+    def _scan(self, path: str, line_score) -> list[tuple[int, str, int, str]]:
+        """ Streaming scan of one file: (score, path, line number, line) of its matching lines """
+        matches = []
+        try:
+            with open(os.path.join(self.root, path), encoding="utf-8", errors="replace") as f:
+                for number, line in enumerate(f, 1):
+                    score = line_score(line)
+                    if score:
+                        matches.append((score, path, number, line.rstrip("\n")))
+        except OSError:
+            pass
+        return matches
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"files": len(self._signatures), "indexed": len(self._file_words), "words": len(self._postings),
+                    "dirty": len(self._dirty), "unindexed": len(self._unindexed)}
+
+
+def snippet(line: str, query: str, regex: bool) -> str:
+    """ The line, shortened around its first match if it is long """
+    line = line.strip()
+    if len(line) <= _SNIPPET_CHARS:
+        return line
+    match = re.search(query, line) if regex else re.search("|".join(re.escape(w) for w in words(query)), line, re.IGNORECASE)
+    start = max(0, (match.start() if match else 0) - _SNIPPET_CHARS // 4)
+    end = start + _SNIPPET_CHARS
+    return ("…" if start else "") + line[start:end] + ("…" if end < len(line) else "")
+
+
+
+
+""" Default index """
+
+_default_index: WorkspaceIndex | None = None
+_default_lock = threading.Lock()
+
+
+def get_workspace_index() -> WorkspaceIndex:
+    """ Return the process-wide index of the workspace directory, AGENT_WORKSPACE_DIR (default agent-files) """
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = WorkspaceIndex(os.getenv("AGENT_WORKSPACE_DIR", "agent-files"))
+        return _default_index
+
+
+def configure_workspace_index(index: WorkspaceIndex) -> None:
+    """ Replace the process-wide workspace index """
+    global _default_index
+    with _default_lock:
+        _default_index = index